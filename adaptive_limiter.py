@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : adaptive_limiter.py
+@Description: 自适应并发限制器 (AIMD + 延迟梯度)，替代写死的 API_SEMAPHORE_LIMIT
+@Logic      :
+    1. 每个模型一个独立的限制器 (生图 / 视觉分池)，慢的生图不会让视觉调用排队。
+    2. 加性增：调用成功、延迟正常且并发已用满时，limit 每轮 (约 limit 次成功) +1。
+    3. 乘性减 (同一冷却期内最多减一次，避免一串失败把 limit 打到底)：
+       - 429 限流           : limit *= THROTTLE_BACKOFF
+       - 5xx / 连接错误      : limit *= ERROR_BACKOFF
+       - 延迟梯度           : 近期平均延迟 > 基线 * LATENCY_TOLERANCE，且持续超过一个冷却期时 limit *= LATENCY_BACKOFF
+         基线取最近 window 次成功延迟的 BASELINE_PERCENTILE 分位 (不用最小值：偶发一次特别快的调用会让基线过低，
+         正常波动就触发降并发)；单次慢调用把 ewma 顶上去不算，要一直高才降。
+       其他异常 (4xx 参数错误、审核拦截等) 与服务端容量无关，不调整 limit。
+       客户端读超时 (我们自己设的 timeout 到点) 也归为其他：长尾调用本来就慢，不能当成服务端过载把 limit 砍掉。
+    4. limit 在 [min_limit, max_limit] 之间浮动，stats() 返回当前值供 /limits 接口查看。
+    5. 排队规则 (优先级 / 租户公平) 继承自 priority_pool.PriorityPool。
+@Usage      :
+    async with limiter.slot() as s:
+        try:
+            ...  # 调用远程 API
+        except Exception as e:
+            s.fail(e)   # 被捕获的异常也要上报，才能触发降并发
+"""
+
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from priority_pool import PriorityPool
+
+THROTTLE_BACKOFF = 0.7
+ERROR_BACKOFF = 0.8
+LATENCY_BACKOFF = 0.9
+LATENCY_TOLERANCE = 2.0
+BASELINE_PERCENTILE = 0.2
+
+
+def classify_error(exc: Any) -> str:
+    """异常分类: throttled / error / other"""
+    if exc is None or exc is True:
+        return "error"
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status == 429:
+        return "throttled"
+    if isinstance(status, int):
+        return "error" if status >= 500 else "other"
+    name = type(exc).__name__.lower()
+    # 连接失败 (含 ConnectTimeout) 才算服务端不可用；客户端读超时 (asyncio / httpx ReadTimeout) 归 other，不降并发
+    if isinstance(exc, ConnectionError) or "connect" in name:
+        return "error"
+    return "other"
+
+
+class AdaptiveLimiter(PriorityPool):
+    """asyncio 并发限制器，limit 根据延迟与错误率自动调整"""
+
+    def __init__(self, name: str, initial: int, min_limit: int = 1, max_limit: int = 100,
+                 window: int = 500, cooldown_s: float = 1.0, weights: Optional[Dict[str, float]] = None):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        super().__init__(name, min(max(initial, self.min_limit), self.max_limit), weights)
+        self.cooldown_s = float(cooldown_s)
+
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._ewma: Optional[float] = None
+        self._last_decrease = 0.0
+        self._high_since: Optional[float] = None   # ewma 开始持续高于阈值的时刻
+        self.last_change = ""
+
+        self.success = 0
+        self.throttled = 0
+        self.errors = 0
+        self.others = 0
+
+    # ---------------- 控制算法 ----------------
+
+    def _observe(self, error: Any, latency: float):
+        if error is None:
+            self.success += 1
+            self._latencies.append(latency)
+            self._ewma = latency if self._ewma is None else 0.8 * self._ewma + 0.2 * latency
+            baseline = self._baseline()
+            if len(self._latencies) >= 10 and self._ewma > baseline * LATENCY_TOLERANCE:
+                now = time.monotonic()
+                if self._high_since is None:
+                    self._high_since = now
+                elif now - self._high_since >= self._cooldown():
+                    self._decrease(LATENCY_BACKOFF, f"延迟 {self._ewma:.1f}s > 基线 {baseline:.1f}s x{LATENCY_TOLERANCE}")
+                    self._high_since = now   # 降完重新计时，仍然高要再撑一个冷却期才会再降
+                return
+            self._high_since = None
+            if self.inflight + 1 >= int(self.limit) or len(self._queue):
+                # 名额已用满才加，避免空闲时 limit 无意义地涨到上限
+                old = int(self.limit)
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+                if int(self.limit) != old:
+                    self.last_change = f"+1 -> {int(self.limit)}"
+            return
+
+        kind = classify_error(error)
+        if kind == "throttled":
+            self.throttled += 1
+            self._decrease(THROTTLE_BACKOFF, "429 限流")
+        elif kind == "error":
+            self.errors += 1
+            self._decrease(ERROR_BACKOFF, f"服务端错误: {type(error).__name__}")
+        else:
+            self.others += 1
+
+    def _baseline(self) -> float:
+        """基线延迟：窗口内成功延迟的 BASELINE_PERCENTILE 分位"""
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * BASELINE_PERCENTILE)]
+
+    def _cooldown(self) -> float:
+        # 冷却期取 "基线延迟" 与 10s 的较小者：大约每轮调用最多减一次
+        return max(self.cooldown_s, min(self._baseline() if self._latencies else 0.0, 10.0))
+
+    def _decrease(self, factor: float, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self._cooldown():
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self.last_change = f"x{factor} -> {int(self.limit)} ({reason})"
+
+    # ---------------- 运行时查看 ----------------
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "latency_ewma_s": round(self._ewma, 3) if self._ewma is not None else None,
+            "latency_baseline_s": round(self._baseline(), 3) if self._latencies else None,
+            "success": self.success,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "others": self.others,
+            "last_change": self.last_change,
+        }
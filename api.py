@@ -17,24 +17,41 @@ import sys
 import json
 import time
 import base64
+import hashlib
+import inspect
 import asyncio
 import logging
 import httpx
 import cv2
 import numpy as np
-from typing import List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from PIL import Image
-from volcenginesdkarkruntime import Ark 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-# 引入优化后的 ResNet 模块
-from image_correct_optimized import processor
+# 引入优化后的 ResNet 模块 (多进程模式下由 model_server.py 副本加载，API 进程不加载模型)
+from model_server import RemoteModelPool
+from cache_store import SqliteLRUStore, SingleFlight, VisionCache, vision_signature, VISION_THUMB_SIDE
+from bg_detect import analyze_background
+from job_queue import JobStore
+from uploader import CdnUploader
+from ref_assets import RefAssetManager
+from red_frame import order_points as _order_points, red_frame_crop as _red_frame_crop
+from image_handle import ImageHandle, CodecStats
+from jpeg_codec import set_default_codec
+from adaptive_limiter import AdaptiveLimiter
+from ark_async import AsyncArk, ArkAPIError
+from priority_pool import PriorityPool, get_tag, set_tag, current_tag
+from strategies import StrategyRegistry, StrategySpec, InputProfile
+from metrics import (registry as metrics_registry, Trace, current_trace, trace_requested, record, add_bytes,
+                     add_codec, observe_pool, pool_collector, REQUESTS_TOTAL, STRATEGY_TOTAL,
+                     GEN_INPUT_TOTAL, GEN_API_SECONDS)
 
 # ================= 1. 日志配置 =================
 logger = logging.getLogger("SmartCard")
@@ -48,29 +65,130 @@ logger.propagate = False
 
 # ================= 2. 全局配置 =================
 class CONFIG:
-    VOLC_API_KEY = ""
-    VOLC_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+    # 外部依赖地址均可用环境变量覆盖，压测时指向 bench/ 下的替身服务 (见 bench/loadgen.py)
+    VOLC_API_KEY = os.environ.get("RESTORE_VOLC_API_KEY", "")
+    VOLC_BASE_URL = os.environ.get("RESTORE_VOLC_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+    # ✅ [新增] Ark 原生异步调用 (ark_async.py) 的超时与重试
+    ARK_GEN_TIMEOUT_S = 180
+    ARK_VISION_TIMEOUT_S = 180  # 布局分析线上长尾 60~90s (runtime.log)，与生图一致，不能比旧 SDK (不超时) 更早掐断
+    ARK_MAX_RETRIES = 2         # 视觉: 连接失败与 5xx 重试；生图: 仅 ConnectError 重试 (防重复计费)；429 交给限流器
     MODEL_GEN = "doubao-seedream-4-5-251128"
     MODEL_VISION = "doubao-seed-1-6-vision-250815"
     
     FIXED_GEN_SIZE = "3000x1824"
+    # ✅ [新增] 生图主图输入方式：inline = 内联 Base64 (每个策略各发一遍几 MB)；
+    # url = 等矫正图上传 CDN 后把 URL 交给 Ark (4 个策略共用，出网流量约降为 1/4)，上传超时 / 失败或 Ark 拉图失败时回退内联
+    GEN_INPUT_MODE = os.environ.get("RESTORE_GEN_INPUT", "inline")
+    GEN_INPUT_URL_WAIT_S = float(os.environ.get("RESTORE_GEN_INPUT_URL_WAIT_S", "15"))
+    # Ark 拉不到我们的 CDN 图后，整个进程在这段时间内直接发内联，不再每个策略先试一次 URL 再重发
+    GEN_INPUT_URL_REJECT_COOLDOWN_S = 300
+    # 只有错误码 / 信息里带这些字样 (拉图失败) 才回退内联；参数错误、审核拦截等 400 照常失败
+    GEN_INPUT_URL_FETCH_ERROR_HINTS = ("download", "fetch", "url", "access", "unreachable", "timeout", "timed out")
+
+    # ResNet 缩图检测 (长边 1024) + 原图一次透视直出 3000x1824，省掉全分辨率推理和 LANCZOS 二次缩放
+    RESNET_PROXY_DETECT = True
 
     # === 暴力并发配置 ===
     # 由于使用了 URL 模式，带宽压力极小，可以放心拉满
+    # === 多进程部署 ===
+    # 设置后 API 进程不加载模型，矫正/裁切/红框全部转发给独立的模型服务副本 (见 model_server.py)
+    # 例: RESTORE_MODEL_SERVERS="unix:/tmp/restore_model_0.sock,unix:/tmp/restore_model_1.sock"
+    MODEL_SERVER_ADDRS = [a.strip() for a in os.environ.get("RESTORE_MODEL_SERVERS", "").split(",") if a.strip()]
+    MODEL_SERVER_CONNS = 8      # 每个副本的最大并发连接数
+    MODEL_SERVER_TIMEOUT_S = 120
+    # uvicorn worker 数：目前只支持 1。
+    # 每个 worker 都会各起一套 Job worker / 参考图保活 / 限流器 / SingleFlight，并发上限会翻倍、去重只在进程内生效，
+    # 这些单例拆到独立进程之前，>1 直接拒绝启动。多进程部署靠 model_server 副本分担 CPU / GPU。
+    API_WORKERS = int(os.environ.get("RESTORE_API_WORKERS", "1"))
+
+    # GPU 准入数 = ResNet 微批队列能攒到的最大批 (模型侧不再逐张持锁，队列会自动合批)
     GPU_SEMAPHORE_LIMIT = 8
-    API_SEMAPHORE_LIMIT = 50
+    # ✅ [修改] Ark 调用不再共用一个 API_SEMAPHORE_LIMIT，按模型分池自适应调整 (见 adaptive_limiter.py)
+    # initial: 启动时的并发；运行中在 [min, max] 之间按延迟与 429/5xx 自动升降，当前值见 GET /limits
+    ADAPTIVE_LIMITS = {
+        # 走原生异步调用后不再受线程池限制，上限只是保护性的天花板
+        "gen": {"initial": 20, "min": 2, "max": 120},     # MODEL_GEN (images.generate，单次 20s+)
+        "vision": {"initial": 30, "min": 4, "max": 160},  # MODEL_VISION (chat.completions，单次数秒)
+    }
     UPLOAD_SEMAPHORE_LIMIT = 50
     WORKFLOW_SEMAPHORE_LIMIT = 15
+    # 工作流名额里给交互请求预留的个数：bulk (批量接口 / 异步 Job) 最多同时占 15 - 3 = 12 个
+    WORKFLOW_INTERACTIVE_RESERVE = 3
+
+    # ✅ [新增] 优先级调度 (见 priority_pool.py)
+    # 请求头 X-Tenant-Id / X-Priority (interactive | bulk) 指定租户与优先级；未指定租户时按客户端 IP 区分
+    # 未显式指定优先级时：批量接口超过 BULK_BATCH_THRESHOLD 张、以及异步 Job，自动按 bulk 处理
+    BULK_BATCH_THRESHOLD = 5
+
+    # ✅ [新增] 策略注册表配置文件 (不存在时使用 strategies.py 内置的 4 个默认策略)
+    STRATEGY_CONFIG_PATH = os.environ.get("RESTORE_STRATEGY_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "strategies.json"))
+
+    # ✅ [新增] 策略截止时间与提前返回
+    # 单个策略 (生图+下载+裁切+上传) 的截止时间，超时即取消该策略；按策略名配置，没配的用 default
+    # (策略配置里的 deadline_s 优先)。默认不启用 ({} = 不限)。
+    # 计时从拿到生图名额开始 (排队不算)，且不会低于 ARK_GEN_TIMEOUT_S + STRATEGY_DEADLINE_MARGIN_S，
+    # 否则高峰期排队 / 正常的长尾生图会被误杀
+    STRATEGY_DEADLINE_S = {}
+    STRATEGY_DEADLINE_MARGIN_S = 60  # 下载 + 裁切 + 上传的余量
+    # 提前返回：成功 EARLY_RETURN_MIN_SUCCESS 个策略 (0=不按个数)，或从开始处理起超过 EARLY_RETURN_AFTER_S 秒 (0=不限)，
+    # 就先返回已有结果。剩余策略：
+    #   background=True  -> 后台继续跑完，完整结果写入结果缓存 (返回体带 pending_strategies)
+    #   background=False -> 直接取消 (返回体带 cancelled_strategies)
+    EARLY_RETURN_MIN_SUCCESS = 0
+    EARLY_RETURN_AFTER_S = 0
+    EARLY_RETURN_BACKGROUND = True
+    TENANT_WEIGHTS = {}         # 租户权重 (默认 1.0)，例: {"vip_customer": 3.0}
 
 
     # === 上传接口 ===
-    UPLOAD_API_URL = "https://tt.36588.com.cn/mcard/common/commonUpload"
-    IMG_URL_PREFIX = "https://tt.36588.com.cn/mcard/assets/resource/imgs/normal/"
-
-    REF_LOCAL_DIR = "/home/ubuntu/zj/restore/ref_imgs"
+    UPLOAD_API_URL = os.environ.get("RESTORE_UPLOAD_API_URL", "https://tt.36588.com.cn/mcard/common/commonUpload")
+    IMG_URL_PREFIX = os.environ.get("RESTORE_IMG_URL_PREFIX", "https://tt.36588.com.cn/mcard/assets/resource/imgs/normal/")
+    # ✅ [新增] 上传方式: multipart / binary 直接发二进制 (无 Base64 膨胀)，失败自动回退 base64 JSON
+    # 默认 base64 与线上接口保持一致；CDN 开通二进制接口后切换 (本地可用 bench/fake_upload_server.py 验证)
+    UPLOAD_TRANSPORT = os.environ.get("RESTORE_UPLOAD_TRANSPORT", "base64")
+    UPLOAD_BINARY_URL = os.environ.get("RESTORE_UPLOAD_BINARY_URL", "")   # 为空时与 UPLOAD_API_URL 相同
+
+    REF_LOCAL_DIR = os.environ.get("RESTORE_REF_LOCAL_DIR", "/home/ubuntu/zj/restore/ref_imgs")
+    # ✅ [新增] 参考图保活：链接状态 (URL + 上传时的内容哈希) 持久化，重启后沿用；探活间隔 (分钟)
+    REF_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "ref_assets.json")
+    REF_CHECK_INTERVAL_MIN = int(os.environ.get("RESTORE_REF_CHECK_INTERVAL_MIN", "60"))
+
+    # ✅ [新增] JPEG 编解码后端: auto (有 PyTurboJPEG 用 turbojpeg，否则 cv2) / turbojpeg / cv2 / pil
+    # 对比数据见 bench/bench_codec.py
+    JPEG_CODEC = os.environ.get("RESTORE_JPEG_CODEC", "auto")
+
+    # ✅ [新增] 分阶段计时 (见 metrics.py)：指标在 GET /metrics，单图 trace 按需输出
+    # 返回体附带 trace：请求头 X-Trace: 1，或 TRACE_IN_RESPONSE 全局打开
+    TRACE_IN_RESPONSE = os.environ.get("RESTORE_TRACE", "0") == "1"
+    TRACE_LOG_PATH = os.environ.get("RESTORE_TRACE_LOG", "")   # 非空时每张图的 trace 追加一行 JSON 到该文件
+
+    # === 整体结果缓存 (同图重复提交直接返回已存 URL) ===
+    # key = 图片哈希 + 策略 + Prompt 版本 + 模型；TTL 要短于 CDN 链接的有效期
+    RESULT_CACHE_ENABLED = os.environ.get("RESTORE_RESULT_CACHE", "1") == "1"
+    RESULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "workflow_cache.sqlite3")
+    RESULT_CACHE_MAX_ENTRIES = 20000
+    RESULT_CACHE_TTL_S = 12 * 3600
+
+    # === 视觉分析缓存 (缩略图 pHash + Prompt，近似重复上传也能跳过视觉调用) ===
+    VISION_CACHE_ENABLED = os.environ.get("RESTORE_VISION_CACHE", "1") == "1"
+    VISION_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "vision_cache.sqlite3")
+    VISION_CACHE_MAX_ENTRIES = 50000
+    VISION_CACHE_MAX_DISTANCE = 4  # pHash 汉明距离阈值 (64 位)
+
+    # === 本地纯色背景检测 (置信度不足时才回退 PROMPT_BG_CHECK 远程调用) ===
+    BG_LOCAL_ENABLED = True
+    BG_LOCAL_MIN_CONFIDENCE = 0.75
+
+    # === 异步 Job 队列 (SQLite 持久化，重启后按租约断点续跑) ===
+    JOB_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "jobs.sqlite3")
+    JOB_WORKERS = 15            # 同时消费队列的协程数 (实际并发仍受 workflow_pool 约束)
+    JOB_LEASE_S = 300           # 子项租约，处理中每 1/3 租约续一次
+    JOB_MAX_ATTEMPTS = 3
+    JOB_POLL_S = 1.0
+    JOB_CALLBACK_RETRIES = 3
     
     # === [已填入] 参考图 URL 配置 (零带宽消耗) ===
-    REF_IMGS_URLS = [
+    REF_IMGS_URLS = [u.strip() for u in os.environ.get("RESTORE_REF_IMGS_URLS", "").split(",") if u.strip()] or [
         "https://tt.36588.com.cn/mcard/assets/resource/imgs/normal/printdiy1/M00/B9/17/oYYBAGll6wKAJWQTABAy8xidGMs775.png",
         "https://tt.36588.com.cn/mcard/assets/resource/imgs/normal/printdiy1/M00/B9/18/oYYBAGll6wqAKfDIABUkz0aLF5o094.png",
         "https://tt.36588.com.cn/mcard/assets/resource/imgs/normal/printdiy1/M00/B9/18/oYYBAGll6xCAMoBzAA8pW2TABec002.png",
@@ -125,90 +243,83 @@ class CONFIG:
 app = FastAPI(title="Smart Card Restore Ultimate", description="URL Mode + High Quality")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
-# 资源池
-gpu_lock = asyncio.Semaphore(CONFIG.GPU_SEMAPHORE_LIMIT)
-api_lock = asyncio.Semaphore(CONFIG.API_SEMAPHORE_LIMIT)
-upload_lock = asyncio.Semaphore(CONFIG.UPLOAD_SEMAPHORE_LIMIT)
-workflow_lock = asyncio.Semaphore(CONFIG.WORKFLOW_SEMAPHORE_LIMIT)
-
+@app.middleware("http")
+async def request_tag_middleware(request: Request, call_next):
+    """从请求头读取租户与优先级，写入 contextvar，供各资源池排队时使用"""
+    priority = (request.headers.get("x-priority") or "").strip().lower()
+    tenant = request.headers.get("x-tenant-id") or (request.client.host if request.client else "default")
+    token = set_tag(tenant, priority or "interactive", explicit=bool(priority))
+    trace_token = trace_requested.set(request.headers.get("x-trace", "") in ("1", "true"))
+    try:
+        return await call_next(request)
+    finally:
+        trace_requested.reset(trace_token)
+        current_tag.reset(token)
+
+# 资源池 (全部按 优先级 + 租户加权公平 排队，不再是 FIFO 的 Semaphore)
+gpu_pool = PriorityPool("gpu", CONFIG.GPU_SEMAPHORE_LIMIT, CONFIG.TENANT_WEIGHTS)
+gen_limiter = AdaptiveLimiter(f"gen:{CONFIG.MODEL_GEN}", CONFIG.ADAPTIVE_LIMITS["gen"]["initial"],
+                              CONFIG.ADAPTIVE_LIMITS["gen"]["min"], CONFIG.ADAPTIVE_LIMITS["gen"]["max"],
+                              weights=CONFIG.TENANT_WEIGHTS)
+vision_limiter = AdaptiveLimiter(f"vision:{CONFIG.MODEL_VISION}", CONFIG.ADAPTIVE_LIMITS["vision"]["initial"],
+                                 CONFIG.ADAPTIVE_LIMITS["vision"]["min"], CONFIG.ADAPTIVE_LIMITS["vision"]["max"],
+                                 weights=CONFIG.TENANT_WEIGHTS)
+upload_pool = PriorityPool("upload", CONFIG.UPLOAD_SEMAPHORE_LIMIT, CONFIG.TENANT_WEIGHTS)
+workflow_pool = PriorityPool("workflow", CONFIG.WORKFLOW_SEMAPHORE_LIMIT, CONFIG.TENANT_WEIGHTS,
+                             reserve=CONFIG.WORKFLOW_INTERACTIVE_RESERVE)
+# 各池的排队时间 / 占用时间进 metrics，瞬时 limit / inflight / queued 在抓取 /metrics 时读取
+_all_pools = {"gen": gen_limiter, "vision": vision_limiter, "gpu": gpu_pool, "upload": upload_pool, "workflow": workflow_pool}
+for _p in _all_pools.values(): _p.observer = observe_pool
+metrics_registry.add_collector(pool_collector(_all_pools))
+
+# 线程池只跑真正的计算 (解码/裁切/Base64 等)；Ark 调用走 ark_async，不占线程
 cpu_executor = ThreadPoolExecutor(max_workers=64)
-ark_client = Ark(api_key=CONFIG.VOLC_API_KEY, base_url=CONFIG.VOLC_BASE_URL)
+jpeg_codec = set_default_codec(CONFIG.JPEG_CODEC)
 http_client = httpx.AsyncClient(timeout=60.0, limits=httpx.Limits(max_keepalive_connections=500, max_connections=1000))
+ark_async = AsyncArk(CONFIG.VOLC_API_KEY, CONFIG.VOLC_BASE_URL, http_client, CONFIG.ARK_MAX_RETRIES)
 img_processor = None
+model_pool: Optional[RemoteModelPool] = None
+result_cache = SqliteLRUStore(CONFIG.RESULT_CACHE_PATH, CONFIG.RESULT_CACHE_MAX_ENTRIES, CONFIG.RESULT_CACHE_TTL_S, name="workflow")
+workflow_flight = SingleFlight()
+job_store = JobStore(CONFIG.JOB_DB_PATH, CONFIG.JOB_LEASE_S, CONFIG.JOB_MAX_ATTEMPTS)
+job_wakeup = asyncio.Event()
+job_worker_tasks: List[asyncio.Task] = []
+# ✅ [新增] 脱离请求的后台任务 (后台补全 / Job 回调) 在这里持有强引用，防止被 GC；关闭时统一取消
+background_tasks: Set[asyncio.Future] = set()
+vision_cache = VisionCache(CONFIG.VISION_CACHE_PATH, CONFIG.VISION_CACHE_MAX_ENTRIES, CONFIG.VISION_CACHE_MAX_DISTANCE)
+uploader = CdnUploader(CONFIG.UPLOAD_API_URL, CONFIG.IMG_URL_PREFIX, CONFIG.UPLOAD_TRANSPORT,
+                       binary_url=CONFIG.UPLOAD_BINARY_URL, client=http_client, executor=cpu_executor)
 # ✅ [新增] 初始化定时任务调度器
 scheduler = AsyncIOScheduler()
-# ================= 4. 参考图保活逻辑 (全是新增的) =================
-
-async def ensure_local_refs():
-    """确保本地有参考图文件，如果没有则下载初始 URL"""
-    if not os.path.exists(CONFIG.REF_LOCAL_DIR):
-        os.makedirs(CONFIG.REF_LOCAL_DIR)
-    
-    for i, url in enumerate(CONFIG.REF_IMGS_URLS):
-        file_path = os.path.join(CONFIG.REF_LOCAL_DIR, f"ref_{i}.png")
-        if not os.path.exists(file_path):
-            logger.info(f"📥 [初始化] 本地缺少参考图 {i+1}，正在从初始 URL 下载备份...")
-            content = await async_download(url)
-            if content:
-                with open(file_path, "wb") as f:
-                    f.write(content)
-                logger.info(f"✅ [初始化] 参考图 {i+1} 下载成功: {file_path}")
-            else:
-                logger.error(f"❌ [初始化] 参考图 {i+1} 下载失败! URL: {url}")
+# ================= 4. 参考图保活逻辑 (✅ [修改] 交给 ref_assets.RefAssetManager) =================
+# 只重传失效 / 内容变化的链接，URL 列表整体替换，不再原地修改 CONFIG.REF_IMGS_URLS
+ref_assets = RefAssetManager(
+    [os.path.join(CONFIG.REF_LOCAL_DIR, f"ref_{i}.png") for i in range(len(CONFIG.REF_IMGS_URLS))],
+    CONFIG.REF_IMGS_URLS, uploader=uploader, client=http_client, state_path=CONFIG.REF_STATE_PATH,
+)
 
 async def refresh_reference_images_task():
-    """定时任务：读取本地参考图 -> 上传 -> 更新内存 URL"""
-    logger.info("⏰ [定时任务] 开始执行参考图保活上传...")
-    
-    # 1. 确保本地有图
-    await ensure_local_refs()
-    
-    new_urls = []
-    success_count = 0
-    
-    # 2. 遍历本地文件并上传 (假设固定4张)
-    for i in range(len(CONFIG.REF_IMGS_URLS)): 
-        file_path = os.path.join(CONFIG.REF_LOCAL_DIR, f"ref_{i}.png")
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, "rb") as f:
-                    content = f.read()
-                
-                # 复用上传逻辑
-                new_url = await async_upload(content)
-                
-                if new_url:
-                    new_urls.append(new_url)
-                    success_count += 1
-                    logger.info(f"✅ [定时任务] 参考图 {i+1} 上传成功 -> {new_url}")
-                else:
-                    logger.error(f"❌ [定时任务] 参考图 {i+1} 上传失败，将保留旧链接")
-                    if i < len(CONFIG.REF_IMGS_URLS):
-                        new_urls.append(CONFIG.REF_IMGS_URLS[i])
-            except Exception as e:
-                logger.error(f"❌ [定时任务] 处理参考图 {i+1} 异常: {e}")
-                if i < len(CONFIG.REF_IMGS_URLS):
-                    new_urls.append(CONFIG.REF_IMGS_URLS[i])
-        else:
-            logger.error(f"⚠️ [定时任务] 本地文件丢失: {file_path}")
-            if i < len(CONFIG.REF_IMGS_URLS):
-                new_urls.append(CONFIG.REF_IMGS_URLS[i])
-
-    # 3. 更新全局配置
-    if success_count == 4: 
-        CONFIG.REF_IMGS_URLS = new_urls
-        logger.info(f"🎉 [定时任务] 参考图池已刷新，当前最新 URL 列表: \n{json.dumps(new_urls, indent=2)}")
+    """定时任务：HEAD 探活 -> 只重传失效的参考图 -> 原子替换 URL 列表"""
+    logger.info("⏰ [定时任务] 开始检查参考图链接...")
+    await ref_assets.ensure_local()
+    summary = await ref_assets.refresh()
+    if summary["failed"]:
+        logger.warning(f"⚠️ [定时任务] 参考图检查完成，有失败: {summary}")
     else:
-        CONFIG.REF_IMGS_URLS = new_urls
-        logger.warning(f"⚠️ [定时任务] 参考图刷新完成，但有失败 ({success_count}/4 成功)")
+        logger.info(f"🎉 [定时任务] 参考图检查完成: {summary}")
 
 # ================= 修改原来的启动/关闭事件 =================
 
 @app.on_event("startup")
 async def startup_event():
-    global img_processor
-    logger.info("⏳ 正在加载 ResNet 模型(test)...")
-    img_processor = processor
+    global img_processor, model_pool
+    if CONFIG.MODEL_SERVER_ADDRS:
+        logger.info(f"🔌 多进程模式：模型请求转发至 {CONFIG.MODEL_SERVER_ADDRS}")
+        model_pool = RemoteModelPool(CONFIG.MODEL_SERVER_ADDRS, CONFIG.MODEL_SERVER_CONNS, CONFIG.MODEL_SERVER_TIMEOUT_S)
+    else:
+        logger.info("⏳ 正在加载 ResNet 模型(test)...")
+        from image_correct_optimized import processor
+        img_processor = processor
     
     # ✅ [优化] 启动定时任务 (加 try-except 保护)
     logger.info("⏰ 正在启动定时任务调度器...")
@@ -219,26 +330,35 @@ async def startup_event():
     except Exception as e:
         logger.error(f"❌ [启动警告] 初始参考图更新失败，将使用默认或旧缓存: {e}")
 
-    # 2. 添加定时作业：每天 00:00 执行
-    scheduler.add_job(refresh_reference_images_task, 'cron', hour=0, minute=0)
+    # 2. 添加定时作业：HEAD 探活很便宜，按间隔检查 (只有失效时才重传)
+    scheduler.add_job(refresh_reference_images_task, 'interval', minutes=CONFIG.REF_CHECK_INTERVAL_MIN)
     scheduler.start()
+
+    # 3. 启动 Job 队列消费者 (上次进程未完成的子项会在租约过期后自动续跑)
+    for i in range(CONFIG.JOB_WORKERS):
+        job_worker_tasks.append(asyncio.create_task(_job_worker(i)))
+    pending = await _job_db(job_store.pending_count)
+    if pending:
+        logger.info(f"📦 [Job] 队列中有 {pending} 个未完成子项，将断点续跑")
     
-    logger.info(f"🔥 系统启动 | ...")
+    logger.info(f"🔥 系统启动 | JPEG 后端: {jpeg_codec.name} | 默认策略: {[x.name for x in strategy_registry.select()]} | ...")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    for t in job_worker_tasks: t.cancel()
+    for t in list(background_tasks): t.cancel()
+    await asyncio.gather(*job_worker_tasks, *background_tasks, return_exceptions=True)
     await http_client.aclose()
     cpu_executor.shutdown()
     # ✅ [新增] 关闭调度器
     scheduler.shutdown()
+    result_cache.close()
+    vision_cache.close()
+    job_store.close()
 
 # ================= 4. 辅助函数 =================
 
 
-def _bytes_to_b64_str(data: bytes) -> str:
-    b64 = base64.b64encode(data).decode('utf-8')
-    return f"data:image/jpeg;base64,{b64}"
-
 def _extract_json(content: str) -> dict:
     try:
         if "```json" in content: content = content.split("```json")[1].split("```")[0]
@@ -246,119 +366,182 @@ def _extract_json(content: str) -> dict:
         return json.loads(content.strip())
     except: return {}
 
+def _spawn_background(coro: Awaitable) -> asyncio.Task:
+    """启动一个不被请求 await 的后台任务：挂到 background_tasks 上保活，结束后自动移除"""
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def _log_vision_cache_write(fut: asyncio.Future):
+    """视觉缓存写入 future 的完成回调：释放引用，并把异常取出来记日志 (否则异常无人读取)"""
+    background_tasks.discard(fut)
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.warning(f"⚠️ 视觉缓存写入失败: {fut.exception()}")
+
 def _pil_to_base64(img: Image.Image) -> str:
     buff = io.BytesIO()
     img.save(buff, format="JPEG", quality=95) # 保持高清
     return base64.b64encode(buff.getvalue()).decode('utf-8')
 
-def _pil_to_bytes(img: Image.Image) -> bytes:
-    buff = io.BytesIO()
-    img.save(buff, format="JPEG", quality=95) # 保持高清
-    return buff.getvalue()
-
-def _bytes_to_cv2(data: bytes) -> np.ndarray:
-    arr = np.frombuffer(data, np.uint8)
-    return cv2.imdecode(arr, cv2.IMREAD_COLOR)
-
-def _order_points(pts):
-    rect = np.zeros((4, 2), dtype="float32")
-    s = pts.sum(axis=1)
-    rect[0], rect[2] = pts[np.argmin(s)], pts[np.argmax(s)]
-    diff = np.diff(pts, axis=1)
-    rect[1], rect[3] = pts[np.argmin(diff)], pts[np.argmax(diff)]
-    return rect
-
-def _try_red_frame_crop_memory(img_bytes: bytes) -> Optional[bytes]:
-    try:
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        img_cv = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img_cv is None: return None
-        hsv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2HSV)
-        mask = cv2.bitwise_or(
-            cv2.inRange(hsv, np.array([0, 70, 50]), np.array([10, 255, 255])),
-            cv2.inRange(hsv, np.array([170, 70, 50]), np.array([180, 255, 255]))
-        )
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5,5), np.uint8))
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours: return None
-        c = max(contours, key=cv2.contourArea)
-        if cv2.contourArea(c) < 2000: return None
-        approx = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
-        if len(approx) == 4:
-            pts = _order_points(approx.reshape(4, 2))
-            dst = np.array([[0, 0], [2999, 0], [2999, 1823], [0, 1823]], dtype="float32")
-            M = cv2.getPerspectiveTransform(pts, dst)
-            warped = cv2.warpPerspective(img_cv, M, (3000, 1824))
-            return _pil_to_bytes(Image.fromarray(cv2.cvtColor(warped, cv2.COLOR_BGR2RGB)))
-    except: pass
-    return None
-
 # ================= 5. 网络功能 =================
 
 async def async_download(url: str) -> Optional[bytes]:
     try:
         resp = await http_client.get(url)
-        return resp.content if resp.status_code == 200 else None
+        if resp.status_code != 200: return None
+        add_bytes("download", len(resp.content))
+        return resp.content
     except: return None
 
+# URL 输入被 Ark 拒绝后，在此时刻之前一律内联发送 (进程级)
+_url_input_disabled_until = [0.0]
+
+def _is_image_fetch_error(e: ArkAPIError) -> bool:
+    """Ark 报错是否是"拉取输入图片失败"(而不是 Prompt / 参数 / 审核问题)"""
+    if e.status_code != 400:
+        return False   # 拉图失败 Ark 统一报 400；401/403 鉴权、429、5xx 换内联也没用
+    text = f"{e.code} {e.message}".lower()
+    if "sensitive" in text or "risk" in text:
+        return False   # 审核拦截换成内联也一样会被拦
+    return any(h in text for h in CONFIG.GEN_INPUT_URL_FETCH_ERROR_HINTS)
+
+def _encode_input_profile(h: ImageHandle, profile: InputProfile) -> str:
+    """按输入档位缩放 + 编码生图主图，返回 data URI (在 CPU 线程池里调用)"""
+    data, mime = h.encode_as(profile.max_side, profile.quality, profile.format)
+    t0 = time.time()
+    uri = f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+    h.stats.add("b64", time.time() - t0)
+    return uri
+
 async def async_upload(img_bytes: bytes) -> str:
     if not img_bytes: return ""
-    async with upload_lock:
-        try:
-            b64_str = await asyncio.get_event_loop().run_in_executor(
-                cpu_executor, lambda: base64.b64encode(img_bytes).decode('utf-8')
-            )
-            payload = {"base64Str": f"data:image/jpeg;base64,{b64_str}"}
-            resp = await http_client.post(CONFIG.UPLOAD_API_URL, json=payload, timeout=180)
-            if resp.status_code == 200:
-                d = resp.json()
-                if d.get("success"): return f"{CONFIG.IMG_URL_PREFIX}{d.get('userData', '')}"
-            return ""
-        except Exception as e:
-            logger.error(f"⚠️ Upload Fail: {e}")
-            return ""
+    async with upload_pool.slot():
+        t0 = time.time()
+        url = await uploader.upload(img_bytes)
+        record("cdn_upload", t0, time.time())
+        if url: add_bytes("upload", len(img_bytes))
+        return url
 
 # ================= 6. 核心业务 =================
 
-@dataclass
-class RestoreStrategy:
-    name: str; need_vision: bool; need_ref: bool
-
-STRATEGIES = [
-    RestoreStrategy("静态生成", False, False),
-    RestoreStrategy("视觉分析", True, False),
-    RestoreStrategy("内容锁定", False, True),
-    RestoreStrategy("参考图", False, True)
-]
+# ✅ [修改] 策略改由注册表声明 (strategies.py / strategies.json)，请求可指定只跑部分策略
+strategy_registry = StrategyRegistry.load(CONFIG.STRATEGY_CONFIG_PATH)
 
 # [修改点 3] 核心业务流程重写
 # [修改点] 带有详细计时埋点的核心流程
-async def process_single_workflow(original_url: str, img_bytes: bytes, filename: str):
+async def _gather_with_policy(tasks: List[asyncio.Task], min_success: int,
+                              deadline_at: Optional[float]) -> Tuple[list, List[asyncio.Task]]:
+    """
+    按提前返回策略等待策略任务。
+    返回 (按原顺序排列的结果，未完成的为 None, 未完成的任务列表)
+    """
+    pending, success = set(tasks), 0
+    while pending:
+        if min_success and success >= min_success: break
+        timeout = None if deadline_at is None else deadline_at - time.time()
+        if timeout is not None and timeout <= 0: break
+        done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        success += sum(1 for t in done if not t.cancelled() and t.exception() is None and t.result())
+    results = [t.result() if t.done() and not t.cancelled() and t.exception() is None else None for t in tasks]
+    return results, [t for t in tasks if not t.done()]
+
+_deadline_clamp_warned = set()
+
+def _strategy_deadline(strat: StrategySpec) -> Optional[float]:
+    """策略截止时间 (秒，None=不限)，不低于 生图超时 + 下载/裁切/上传余量"""
+    deadline = strat.deadline_s or CONFIG.STRATEGY_DEADLINE_S.get(strat.name, CONFIG.STRATEGY_DEADLINE_S.get("default"))
+    if not deadline:
+        return None
+    floor = CONFIG.ARK_GEN_TIMEOUT_S + CONFIG.STRATEGY_DEADLINE_MARGIN_S
+    if deadline < floor:
+        if strat.name not in _deadline_clamp_warned:
+            _deadline_clamp_warned.add(strat.name)
+            logger.warning(f"⚠️ [{strat.name}] 截止时间 {deadline}s 低于 生图超时+余量 {floor}s，按 {floor}s 执行")
+        deadline = floor
+    return deadline
+
+async def process_single_workflow(original_url: str, img_bytes: bytes, filename: str,
+                                  on_generation: Optional[Callable[[str, dict], None]] = None,
+                                  on_complete: Optional[Callable[[dict], Any]] = None,
+                                  strategies: Optional[List[StrategySpec]] = None):
+    """
+    on_generation: 每个策略完成时回调 (filename, 生成结果)，供流式接口提前推送
+    on_complete  : 提前返回后，后台策略全部结束时回调完整结果 (用于写缓存；可返回 awaitable)
+    strategies   : 本次要跑的策略，None 时跑注册表里的默认策略
+    """
+    # ✅ [新增] 整个流程挂一个 Trace (contextvar)，各阶段、各资源池排队都记在上面
+    trace = Trace(filename)
+    token = current_trace.set(trace)
+    try:
+        result = await _run_workflow(original_url, img_bytes, filename, on_generation, on_complete, strategies)
+    except Exception:
+        REQUESTS_TOTAL.inc(status="error")
+        raise
+    finally:
+        current_trace.reset(token)
+    record("total", trace.t0, time.time())
+    REQUESTS_TOTAL.inc(status=result.get("status", "unknown"))
+    trace.attrs["status"] = result.get("status")
+    if CONFIG.TRACE_LOG_PATH:
+        try: trace.dump(CONFIG.TRACE_LOG_PATH)
+        except Exception as e: logger.error(f"Trace 写入失败: {e}")
+    if CONFIG.TRACE_IN_RESPONSE or trace_requested.get():
+        result["trace"] = trace.to_dict()
+    return result
+
+async def _run_workflow(original_url: str, img_bytes: bytes, filename: str,
+                        on_generation: Optional[Callable[[str, dict], None]],
+                        on_complete: Optional[Callable[[dict], Any]],
+                        strategies: Optional[List[StrategySpec]]):
+    strategies = strategies or strategy_registry.select()
     t_start_all = time.time()
     logger.info(f"▶️ [处理] {filename} ({len(img_bytes)/1024:.0f}KB) | 开始计时")
 
+    # 交互请求的第一个生图策略插队到所有 bulk 积压之前 (urgent)，保证用户尽快看到首个结果
+    first_gen_urgent = [get_tag().priority == "interactive"]
+    # 每个策略拿到生图名额时置位，策略截止时间从这一刻开始计
+    gen_slot_events = {s.name: asyncio.Event() for s in strategies}
+
+    # ✅ [新增] 图片句柄：同一张图的解码/编码各只做一次，计数器记录本请求的全部编解码
+    codec = CodecStats()
+    src_img = ImageHandle.from_source(img_bytes, codec)   # 用户原图：解码时按 EXIF 转正 (与旧版 cv2.imdecode 一致)
+
     # ---------------- 1. GPU 矫正 (本地) ----------------
     t0 = time.time()
-    async with gpu_lock:
-        def _gpu_task(ib):
-            cv_img = _bytes_to_cv2(ib)
+    async with gpu_pool.slot() as gpu_slot:
+        def _gpu_task(h: ImageHandle):
+            cv_img = h.bgr
             if cv_img is None: return None
             # pil_res = img_processor.process_image_memory(cv_img)
             try:
                 # process_image 支持直接传入 cv2/numpy 数组，返回 PIL Image
                 pil_res = img_processor.process_image(
                     image_input=cv_img, 
-                    model_name="resnet"
+                    model_name="resnet",
+                    proxy_detect=CONFIG.RESNET_PROXY_DETECT,
+                    exif_rotated=h.exif_orientation != 1   # 解码时已按 EXIF 转正，可跳过方向预检测
                 )
-                return _pil_to_bytes(pil_res)
+                corr = ImageHandle.from_pil(pil_res, codec)
+                corr.data  # 在线程池里完成编码，上传 / Base64 直接复用
+                return corr
             except Exception as e:
                 logger.error(f"ResNet Process Error: {e}")
                 return None
         
-        corr_bytes = await asyncio.get_event_loop().run_in_executor(cpu_executor, _gpu_task, img_bytes)
+        if model_pool:
+            try:
+                corr_bytes = await model_pool.correct(img_bytes, CONFIG.RESNET_PROXY_DETECT)
+                corr_img = ImageHandle.from_bytes(corr_bytes, codec) if corr_bytes else None
+            except Exception as e:
+                logger.error(f"ResNet Process Error: {e}")
+                corr_img = None
+        else:
+            corr_img = await asyncio.get_event_loop().run_in_executor(cpu_executor, _gpu_task, src_img)
     t_gpu_end = time.time()
+    record("gpu_correct", t0 + gpu_slot.queue_wait, t_gpu_end)
     
-    if not corr_bytes:
+    if corr_img is None:
         logger.error(f"❌ ResNet Correct Failed: {filename}")
         return {"filename": filename, "status": "failed_correction"}
 
@@ -366,106 +549,207 @@ async def process_single_workflow(original_url: str, img_bytes: bytes, filename:
     
     # [A 路] 后台上传
     logger.info("☁️ [后台] 启动静默上传矫正图...")
-    upload_future = asyncio.create_task(async_upload(corr_bytes))
+    upload_future = asyncio.create_task(async_upload(corr_img.data))
 
     # [B 路] 极速转 Base64 (增加耗时打印)
     t_b64_start = time.time()
-    corr_base64 = await asyncio.get_event_loop().run_in_executor(
-        cpu_executor, _bytes_to_b64_str, corr_bytes
-    )
+    corr_base64 = await asyncio.get_event_loop().run_in_executor(cpu_executor, corr_img.data_uri)
     t_b64_end = time.time()
+    record("b64", t_b64_start, t_b64_end)
+
+    # ✅ [新增] 生图主图输入：url 模式下所有策略共用一次等待 (不取消后台上传，收尾时照常 await upload_future)
+    gen_input_url: List[Optional[asyncio.Task]] = [None]
+
+    async def _wait_corr_url() -> str:
+        t_wait = time.time()
+        done, _ = await asyncio.wait({upload_future}, timeout=CONFIG.GEN_INPUT_URL_WAIT_S)
+        url = upload_future.result() if done and not upload_future.exception() else ""
+        record("gen_input_wait", t_wait, time.time())
+        if not url:
+            logger.warning(f"⚠️ [生图输入] 矫正图上传{'失败' if done else '超时'}，回退内联 Base64")
+        return url
+
+    # ✅ [新增] 非原图档位 (缩小 / 降质量 / WebP) 的主图，同一张卡片每个档位只编码一次
+    gen_input_encoded: Dict[str, asyncio.Task] = {}
+
+    async def _encode_for_profile(profile: InputProfile) -> str:
+        t_enc = time.time()
+        try:
+            uri = await asyncio.get_event_loop().run_in_executor(cpu_executor, _encode_input_profile, corr_img, profile)
+        except Exception as e:
+            logger.warning(f"⚠️ [生图输入] 档位 {profile.name} 编码失败，改用原图: {e}")
+            return corr_base64
+        record("input_encode", t_enc, time.time(), profile=profile.name)
+        logger.info(f"🗜️ [生图输入] 档位 {profile.name}: {len(corr_base64)/1024:.0f}KB -> {len(uri)/1024:.0f}KB")
+        return uri
+
+    async def gen_main_input(profile: InputProfile) -> Tuple[str, str]:
+        """返回 (输入方式, 主图输入)：url 模式且上传成功时为 CDN URL，否则为内联 data URI"""
+        if not profile.is_original:
+            # 已上传的 URL 是原图，缩小档位只能内联发送
+            if profile.name not in gen_input_encoded:
+                gen_input_encoded[profile.name] = asyncio.ensure_future(_encode_for_profile(profile))
+            return "inline", await asyncio.shield(gen_input_encoded[profile.name])
+        if CONFIG.GEN_INPUT_MODE != "url" or time.time() < _url_input_disabled_until[0]:
+            return "inline", corr_base64
+        if gen_input_url[0] is None:
+            gen_input_url[0] = asyncio.ensure_future(_wait_corr_url())
+        url = await asyncio.shield(gen_input_url[0])
+        return ("url", url) if url else ("inline", corr_base64)
     
     # [优化] 生成缩略图 Base64 给 Vision 用 (大幅加速视觉分析)
-    def _make_low_res_b64(ib):
+    # 顺带在缩略图上算视觉缓存签名 (pHash + 颜色) 和本地背景检测；缩略图直接从矫正结果的像素缩放，不再解码
+    def _make_low_res_b64(h: ImageHandle):
         try:
-            with Image.open(io.BytesIO(ib)) as img:
-                img.thumbnail((1024, 1024)) 
-                buff = io.BytesIO()
-                img.save(buff, format="JPEG", quality=85)
-                return _bytes_to_b64_str(buff.getvalue())
-        except: return corr_base64
+            # 先取全尺寸像素再缩：与 app.py 对矫正图文件取签名的输入一致 (不走 DCT 缩放解码)
+            if h.bgr is None: raise ValueError("矫正图解码失败")
+            thumb = h.thumbnail(VISION_THUMB_SIDE, quality=85)
+            sig = vision_signature(thumb.bgr)
+            bg_local = analyze_background(thumb.bgr) if CONFIG.BG_LOCAL_ENABLED else None
+            return thumb.data_uri(), sig, bg_local
+        except: return corr_base64, None, None
     
-    corr_base64_small = await asyncio.get_event_loop().run_in_executor(
-        cpu_executor, _make_low_res_b64, corr_bytes
-    )
+    t_thumb = time.time()
+    if model_pool:
+        # 多进程模式：缩略图 / 签名 / 背景检测都在模型副本里做，API 进程不解码矫正图
+        try:
+            thumb_bytes, info = await model_pool.thumb(corr_img.data, CONFIG.BG_LOCAL_ENABLED)
+            corr_base64_small = ImageHandle.from_bytes(thumb_bytes, codec).data_uri()
+            thumb_sig, bg_local = (info["phash"], info["color"]), info.get("bg")
+        except Exception as e:
+            logger.error(f"Thumbnail Error: {e}")
+            corr_base64_small, thumb_sig, bg_local = corr_base64, None, None
+    else:
+        corr_base64_small, thumb_sig, bg_local = await asyncio.get_event_loop().run_in_executor(
+            cpu_executor, _make_low_res_b64, corr_img
+        )
+    record("thumbnail", t_thumb, time.time())
 
     logger.info(f"📊 [准备阶段] GPU矫正:{t_gpu_end-t0:.2f}s | 转Base64:{t_b64_end-t_b64_start:.2f}s | 原图大小:{len(corr_base64)/1024/1024:.1f}MB")
 
     # ---------------- 3. AI 调用封装 (增加详细计时) ----------------
 
     async def call_vision(p, img_input, is_bg_check=False):
+        check_type = "背景检测" if is_bg_check else "布局分析"
+        # 视觉缓存：命中直接返回，不占并发名额
+        cache_prompt = f"{CONFIG.MODEL_VISION}\n{p}"
+        if CONFIG.VISION_CACHE_ENABLED and thumb_sig is not None:
+            # SQLite 查询 (含近似扫描) 放到线程池，不阻塞事件循环
+            cached = await asyncio.get_event_loop().run_in_executor(
+                cpu_executor, vision_cache.get, thumb_sig[0], thumb_sig[1], cache_prompt
+            )
+            if cached:
+                logger.info(f"♻️ [{check_type}] 视觉缓存命中，跳过 API 调用")
+                return cached
+
         t_req_start = time.time()
-        async with api_lock: 
-            t_lock_got = time.time() # 拿到锁的时间
+        async with vision_limiter.slot() as slot:
+            t_lock_got = time.time() # 拿到名额的时间
             try:
                 content_list = [{"type": "text", "text": p}, {"type": "image_url", "image_url": {"url": img_input}}]
-                resp = await asyncio.get_event_loop().run_in_executor(
-                    cpu_executor, 
-                    lambda: ark_client.chat.completions.create(
-                        model=CONFIG.MODEL_VISION,
-                        messages=[{"role":"user","content": content_list}]
-                    ).choices[0].message.content
+                resp = await ark_async.chat_completion(
+                    model=CONFIG.MODEL_VISION,
+                    messages=[{"role":"user","content": content_list}],
+                    timeout=CONFIG.ARK_VISION_TIMEOUT_S
                 )
                 t_req_end = time.time()
                 # 打印视觉分析耗时
-                check_type = "背景检测" if is_bg_check else "布局分析"
                 logger.info(f"👁️ [{check_type}] 排队:{t_lock_got-t_req_start:.2f}s | API传输+推理:{t_req_end-t_lock_got:.2f}s")
+                record("vision_bg" if is_bg_check else "vision_layout", t_lock_got, t_req_end)
+                add_bytes("ark_inline", len(img_input))
                 
-                if is_bg_check: return _extract_json(resp)
-                return resp
+                result = _extract_json(resp) if is_bg_check else resp
+                if result and CONFIG.VISION_CACHE_ENABLED and thumb_sig is not None:
+                    # 写缓存不阻塞返回；持有 future 引用，失败时在回调里记日志
+                    fut = asyncio.get_event_loop().run_in_executor(
+                        cpu_executor, vision_cache.set, thumb_sig[0], thumb_sig[1], cache_prompt, result
+                    )
+                    background_tasks.add(fut)
+                    fut.add_done_callback(_log_vision_cache_write)
+                return result
             except Exception as e:
+                slot.fail(e)
                 logger.error(f"Vision Error: {e}")
                 return {} if is_bg_check else ""
 
-    async def call_gen(p, main_img_input, use_ref, strat_name):
+    async def call_gen(p, use_ref, strat_name, profile: InputProfile):
+        input_mode, main_img_input = await gen_main_input(profile)
         t_req_start = time.time()
-        async with api_lock: 
+        urgent, first_gen_urgent[0] = first_gen_urgent[0], False
+        async with gen_limiter.slot(urgent=urgent) as slot:
             t_lock_got = time.time()
+            gen_slot_events[strat_name].set()   # 策略截止时间从这里开始计
             try:
-                def _run():
-                    imgs = CONFIG.REF_IMGS_URLS[:] if use_ref else []
-                    imgs.append(main_img_input) 
-                    return ark_client.images.generate(
-                        model=CONFIG.MODEL_GEN, prompt=p, image=imgs, 
-                        size=CONFIG.FIXED_GEN_SIZE, response_format="url", watermark=False
-                    ).data[0].url
-                
-                url = await asyncio.get_event_loop().run_in_executor(cpu_executor, _run)
+                refs = ref_assets.generation_inputs() if use_ref else []
+                try:
+                    url = await ark_async.generate_image(
+                        model=CONFIG.MODEL_GEN, prompt=p, image=refs + [main_img_input],
+                        size=CONFIG.FIXED_GEN_SIZE, response_format="url", watermark=False,
+                        timeout=CONFIG.ARK_GEN_TIMEOUT_S
+                    )
+                except ArkAPIError as e:
+                    # Ark 拉不到我们的 CDN 图时同一名额内改用内联重发，并在冷却期内让后续请求直接内联；
+                    # 429 / 5xx 照常交给限流器，Prompt / 审核等 400 照常失败
+                    if input_mode != "url" or not _is_image_fetch_error(e): raise
+                    _url_input_disabled_until[0] = time.time() + CONFIG.GEN_INPUT_URL_REJECT_COOLDOWN_S
+                    logger.warning(f"⚠️ [{strat_name}] URL 输入被拒 ({e.status_code} {e.code})，回退内联 Base64，"
+                                   f"{CONFIG.GEN_INPUT_URL_REJECT_COOLDOWN_S}s 内改走内联")
+                    GEN_INPUT_TOTAL.inc(input="url", outcome="fallback")
+                    add_bytes("ark_url", len(main_img_input))
+                    input_mode, main_img_input = "inline", corr_base64
+                    url = await ark_async.generate_image(
+                        model=CONFIG.MODEL_GEN, prompt=p, image=refs + [main_img_input],
+                        size=CONFIG.FIXED_GEN_SIZE, response_format="url", watermark=False,
+                        timeout=CONFIG.ARK_GEN_TIMEOUT_S
+                    )
                 t_req_end = time.time()
                 
                 # [关键] 打印 API 耗时
-                logger.info(f"📡 [{strat_name}] 排队:{t_lock_got-t_req_start:.2f}s | API传输+推理:{t_req_end-t_lock_got:.2f}s")
+                logger.info(f"📡 [{strat_name}] 排队:{t_lock_got-t_req_start:.2f}s | API传输+推理:{t_req_end-t_lock_got:.2f}s | 输入:{input_mode}")
+                record("gen_api", t_lock_got, t_req_end, strat_name, input=input_mode, profile=profile.name)
+                GEN_API_SECONDS.observe(t_req_end - t_lock_got, input=input_mode, profile=profile.name)
+                GEN_INPUT_TOTAL.inc(input=input_mode, outcome="ok")
+                add_bytes("ark_inline" if input_mode == "inline" else "ark_url", len(main_img_input))
                 return url
             except Exception as e:
+                slot.fail(e)
+                GEN_INPUT_TOTAL.inc(input=input_mode, outcome="failed")
                 logger.error(f"Gen Error: {e}")
                 return None
 
     # ---------------- 4. 启动任务 ----------------
     
-    # 视觉任务用缩略图 (small)
-    task_layout = asyncio.create_task(call_vision(CONFIG.PROMPT_DESCRIBE, corr_base64_small))
-    task_bg = asyncio.create_task(call_vision(CONFIG.PROMPT_BG_CHECK, corr_base64_small, is_bg_check=True))
+    # 视觉任务用缩略图 (small)；所选策略都不需要布局分析时不调用
+    task_layout = None
+    if any(s.need_vision for s in strategies):
+        task_layout = asyncio.create_task(call_vision(CONFIG.PROMPT_DESCRIBE, corr_base64_small))
+    # 背景检测优先用本地像素统计，只有置信度不足才走远程视觉模型
+    task_bg = None
+    bg_info_local = None
+    if bg_local and bg_local["confidence"] >= CONFIG.BG_LOCAL_MIN_CONFIDENCE:
+        bg_info_local = {"is_solid": bg_local["is_solid"], "hex_color": bg_local["hex_color"]}
+        logger.info(f"🎨 [背景检测] 本地判定 (置信度 {bg_local['confidence']:.2f}) -> {bg_info_local}")
+    else:
+        if bg_local:
+            logger.info(f"🎨 [背景检测] 本地置信度 {bg_local['confidence']:.2f} 不足，回退视觉模型")
+        task_bg = asyncio.create_task(call_vision(CONFIG.PROMPT_BG_CHECK, corr_base64_small, is_bg_check=True))
 
     async def run_strat(strat, layout_desc=""):
         try:
             t_step0 = time.time()
-            prompt = ""
-            if strat.name == "视觉分析": prompt = f"{CONFIG.PROMPT_Gen_BASE}\n视觉参考：{layout_desc}"
-            elif strat.name == "静态生成": prompt = CONFIG.PROMPT_WithoutVison
-            elif strat.name == "内容锁定": prompt = CONFIG.PROMPT_V2STRICT
-            elif strat.name == "参考图": prompt = CONFIG.PROMPT_V2SIMPLE
-            else: prompt = CONFIG.PROMPT_Gen_BASE
+            prompt = StrategyRegistry.build_prompt(strat, CONFIG, layout_desc)
 
             logger.info(f"🎨 [{strat.name}] 准备请求...")
             
             # 1. 生图 (获取临时 URL)
-            gen_temp_url = await call_gen(prompt, corr_base64, strat.need_ref, strat.name)
+            gen_temp_url = await call_gen(prompt, strat.use_ref, strat.name, strategy_registry.profile(strat))
             if not gen_temp_url: return None
             t_step1 = time.time() # 生图结束
 
             # 2. 下载 (获取二进制数据)
             gen_bytes = await async_download(gen_temp_url)
             if not gen_bytes: return None
+            gen_img = ImageHandle.from_bytes(gen_bytes, codec)
             t_step2 = time.time() # 下载结束
 
             # =========== 【新增修改 1】启动生成图转存 ===========
@@ -474,29 +758,45 @@ async def process_single_workflow(original_url: str, img_bytes: bytes, filename:
             task_upload_gen = asyncio.create_task(async_upload(gen_bytes))
             # =================================================
 
-            # 3. 裁切 (耗时操作)
-            final_crop_bytes = None
-            if strat.name in ["内容锁定", "参考图"]:
-                final_crop_bytes = await asyncio.get_event_loop().run_in_executor(
-                    cpu_executor, _try_red_frame_crop_memory, gen_bytes
-                )
+            # 3. 裁切 (耗时操作)：红框与兜底裁切共用同一次解码，裁切结果只编码一次
+            final_crop = gen_img if strat.crop == "none" else None
+            if strat.crop == "red_frame":
+                if model_pool:
+                    try:
+                        crop_bytes = await model_pool.red_frame(gen_bytes)
+                        if crop_bytes: final_crop = ImageHandle.from_bytes(crop_bytes, codec)
+                    except Exception as e: logger.error(f"Red Frame Error: {e}")
+                else:
+                    def _red_frame_task(h: ImageHandle):
+                        if h.bgr is None: return None
+                        warped = _red_frame_crop(h.bgr)
+                        return ImageHandle.from_bgr(warped, codec) if warped is not None else None
+                    final_crop = await asyncio.get_event_loop().run_in_executor(
+                        cpu_executor, _red_frame_task, gen_img
+                    )
             
-            if final_crop_bytes is None:
-                async with gpu_lock:
-                    def _gpu_crop_task(ib):
-                        cv_img = _bytes_to_cv2(ib)
+            if final_crop is None:
+                async with gpu_pool.slot():
+                    def _gpu_crop_task(h: ImageHandle):
+                        cv_img = h.bgr
                         if cv_img is None:
-                            return ib
+                            return h
                         try:
-                            pil_res = img_processor.process_image(cv_img, model_name="resnet")
-                            return _pil_to_bytes(pil_res)
+                            # ✅ [修改] 生成图只做检测 + 透视，不走 EXIF / OSD；只有竖版四边形才做方向分类 (见 ImageProcessor.crop_generated)
+                            warped = img_processor.crop_generated(cv_img, proxy_detect=CONFIG.RESNET_PROXY_DETECT)
+                            return ImageHandle.from_bgr(warped, codec) if warped is not None else h
                         except:
-                            return ib
+                            return h
 
-                    final_crop_bytes = await asyncio.get_event_loop().run_in_executor(
-                    cpu_executor, _gpu_crop_task, gen_bytes
-                        )
+                    if model_pool:
+                        try: final_crop = ImageHandle.from_bytes(await model_pool.crop(gen_bytes, CONFIG.RESNET_PROXY_DETECT) or gen_bytes, codec)
+                        except: final_crop = gen_img
+                    else:
+                        final_crop = await asyncio.get_event_loop().run_in_executor(
+                        cpu_executor, _gpu_crop_task, gen_img
+                            )
 
+            final_crop_bytes = await asyncio.get_event_loop().run_in_executor(cpu_executor, lambda: final_crop.data)
             t_step3 = time.time() # 裁切结束
             
             # 4. 上传裁切图
@@ -521,48 +821,83 @@ async def process_single_workflow(original_url: str, img_bytes: bytes, filename:
             up_t = t_step4 - t_step3
             
             logger.info(f"✅ [{strat.name}] 总:{total_t:.1f}s | API:{api_t:.1f}s | 下载:{dl_t:.1f}s | 裁切:{crop_t:.1f}s | 上传:{up_t:.1f}s")
+            record("download", t_step1, t_step2, strat.name)
+            record("crop", t_step2, t_step3, strat.name, method=strat.crop)
+            record("upload", t_step3, t_step4, strat.name)
+            record("strategy", t_step0, t_step4, strat.name)
             
-            return {
+            gen_result = {
                 "strategy_name": strat.name,
                 "crop_image_url": u_crop,      # 裁切后的永久链接
                 "gen_image_url": final_gen_url # 【已修改】生成图的永久链接
             }
+            if on_generation:
+                try: on_generation(filename, gen_result)
+                except Exception as e: logger.error(f"on_generation 回调异常: {e}")
+            return gen_result
         except Exception as e:
             logger.error(f"Strat Error {strat.name}: {e}")
             return None
 
     # ================= 🚀 修正后的调度逻辑 =================
-    
-    running_tasks = []
 
-    # 1. 第一梯队：【不需要】视觉分析的任务，立刻 create_task 发车！
-    for s in STRATEGIES:
-        if not s.need_vision: 
-            running_tasks.append(asyncio.create_task(run_strat(s)))
-    
-    # 2. 中间卡点：等待 Layout 结果
-    layout_res = ""
-    try: 
-        layout_res = await task_layout
-    except: pass
-        
-    # 3. 第二梯队：【需要】视觉分析的任务，拿到结果后发车
-    for s in STRATEGIES:
-        if s.need_vision: 
-            running_tasks.append(asyncio.create_task(run_strat(s, layout_res)))
-
-    gen_results = await asyncio.gather(*running_tasks)
+    async def run_with_deadline(strat):
+        # 需要视觉的策略先等 Layout 结果 (不计入该策略的截止时间)
+        layout_desc = ""
+        if strat.need_vision and task_layout is not None:
+            try: layout_desc = await task_layout
+            except: pass
+        deadline = _strategy_deadline(strat)
+        task = asyncio.create_task(run_strat(strat, layout_desc))
+        slot_wait = asyncio.create_task(gen_slot_events[strat.name].wait())
+        try:
+            if deadline:
+                # 排队等生图名额不计时：拿到名额 (或策略提前结束) 后才开始倒计时
+                await asyncio.wait({task, slot_wait}, return_when=asyncio.FIRST_COMPLETED)
+                done, _ = await asyncio.wait({task}, timeout=deadline)
+                if not done:
+                    task.cancel()
+                    logger.error(f"⏰ [{strat.name}] 拿到生图名额后超过截止时间 {deadline}s，已取消")
+                    STRATEGY_TOTAL.inc(strategy=strat.name, status="timeout")
+                    return None
+            res = await task
+        except asyncio.CancelledError:
+            task.cancel()
+            STRATEGY_TOTAL.inc(strategy=strat.name, status="cancelled")
+            raise
+        finally:
+            slot_wait.cancel()
+        STRATEGY_TOTAL.inc(strategy=strat.name, status="success" if res else "failed")
+        return res
+
+    # 不需要视觉的策略立刻发车；需要视觉的策略在任务内部等 Layout，拿到结果后发车
+    ordered = [s for s in strategies if not s.need_vision] + [s for s in strategies if s.need_vision]
+    strat_tasks = [asyncio.create_task(run_with_deadline(s)) for s in ordered]
+
+    deadline_at = t_start_all + CONFIG.EARLY_RETURN_AFTER_S if CONFIG.EARLY_RETURN_AFTER_S else None
+    gen_results, leftover = await _gather_with_policy(strat_tasks, CONFIG.EARLY_RETURN_MIN_SUCCESS, deadline_at)
+    leftover_names = [ordered[strat_tasks.index(t)].name for t in leftover]
+    if leftover:
+        logger.info(f"⏩ [提前返回] {filename} | 已完成 {len([r for r in gen_results if r])} 个策略，"
+                    f"{'后台继续' if CONFIG.EARLY_RETURN_BACKGROUND else '取消'}: {leftover_names}")
+        if not CONFIG.EARLY_RETURN_BACKGROUND:
+            for t in leftover: t.cancel()
     
     # ---------------- 5. 收尾同步 ----------------
     logger.info("⏳ 正在回收后台上传任务...")
     corr_url_final = await upload_future 
     
-    try: bg_info = await task_bg
-    except: bg_info = {"is_solid": False, "hex_color": ""}
+    if bg_info_local is not None:
+        bg_info = bg_info_local
+    else:
+        try: bg_info = await task_bg
+        except: bg_info = {"is_solid": False, "hex_color": ""}
 
     logger.info(f"🎉 [结束] {filename} 处理完毕 | 全程耗时: {time.time()-t_start_all:.1f}s")
+    logger.info(f"🧮 [编解码] {filename} | {codec.summary()}")
+    add_codec(codec.snapshot())
     
-    return {
+    result = {
         "filename": filename,
         "status": "success",
         "original_image_url": original_url,
@@ -570,63 +905,398 @@ async def process_single_workflow(original_url: str, img_bytes: bytes, filename:
         "background_info": bg_info, 
         "generations": [r for r in gen_results if r]
     }
+    if leftover and not CONFIG.EARLY_RETURN_BACKGROUND:
+        result["cancelled_strategies"] = leftover_names
+    elif leftover:
+        result["pending_strategies"] = leftover_names
+
+        async def _finish_in_background():
+            all_results = await asyncio.gather(*strat_tasks, return_exceptions=True)
+            full = {k: v for k, v in result.items() if k != "pending_strategies"}
+            full["generations"] = [r for r in all_results if r and not isinstance(r, BaseException)]
+            logger.info(f"🏁 [后台补全] {filename} | 共 {len(full['generations'])} 个策略结果，全程耗时: {time.time()-t_start_all:.1f}s")
+            if on_complete:
+                try:
+                    ret = on_complete(full)
+                    if inspect.isawaitable(ret): await ret   # 回调可以是异步的 (如写缓存)
+                except Exception as e: logger.error(f"on_complete 回调异常: {e}")
+
+        _spawn_background(_finish_in_background())
+    return result
+
+# ================= 6.1 结果缓存 =================
+
+def _prompt_version() -> str:
+    """所有 Prompt 的指纹，任何一个 Prompt 改动都会让旧缓存失效"""
+    prompts = [getattr(CONFIG, k) for k in sorted(dir(CONFIG)) if k.startswith("PROMPT_")]
+    return hashlib.sha1("\n".join(prompts).encode("utf-8")).hexdigest()[:12]
+
+def _cache_namespace(strategies: Optional[List[StrategySpec]] = None) -> str:
+    """策略组合 (含各自 Prompt / 裁切方式) 也参与 key：只跑一个策略的结果不会被当成四个策略的结果返回"""
+    specs = strategies or strategy_registry.select()
+    names = ",".join(s.key for s in specs)
+    return f"{names}|{StrategyRegistry.fingerprint(specs, CONFIG, strategy_registry.profiles)}|{_prompt_version()}|{CONFIG.MODEL_GEN}|{CONFIG.MODEL_VISION}|{CONFIG.FIXED_GEN_SIZE}"
+
+def _result_cache_key(img_bytes: bytes, strategies: Optional[List[StrategySpec]] = None) -> str:
+    return "img:" + hashlib.sha256(f"{hashlib.sha256(img_bytes).hexdigest()}|{_cache_namespace(strategies)}".encode("utf-8")).hexdigest()
+
+def _url_cache_key(url: str, strategies: Optional[List[StrategySpec]] = None) -> str:
+    return "url:" + hashlib.sha256(f"{url}|{_cache_namespace(strategies)}".encode("utf-8")).hexdigest()
+
+async def _cache_lookup(key: str, filename: str, original_url: str = "") -> Optional[dict]:
+    if not CONFIG.RESULT_CACHE_ENABLED: return None
+    # SQLite 读 + 整条结果的 JSON 反序列化放到线程池
+    hit = await asyncio.get_event_loop().run_in_executor(cpu_executor, result_cache.get, key)
+    if not hit: return None
+    logger.info(f"♻️ [缓存命中] {filename} -> 直接返回已存结果")
+    hit["filename"] = filename
+    if original_url: hit["original_image_url"] = original_url
+    return hit
+
+async def _cache_store(result: dict, *keys: str):
+    """只缓存成功且策略齐全的记录，失败的、提前返回的留给下次重试 / 后台补全 (写库在线程池里)"""
+    if not CONFIG.RESULT_CACHE_ENABLED: return
+    if result.get("status") != "success" or not result.get("generations"): return
+    if result.get("pending_strategies") or result.get("cancelled_strategies"): return
+    result = {k: v for k, v in result.items() if k != "trace"}   # trace 只属于本次请求
+    for k in keys:
+        if k: await asyncio.get_event_loop().run_in_executor(cpu_executor, result_cache.set, k, result)
+
+async def cached_workflow(original_url: str, img_bytes: bytes, filename: str, cache_key: Optional[str] = None,
+                          on_generation: Optional[Callable[[str, dict], None]] = None,
+                          alias_keys: tuple = (), strategies: Optional[List[StrategySpec]] = None) -> dict:
+    """
+    带缓存的 process_single_workflow：命中直接返回；同图并发只算一次 (single-flight)。
+    注意：共享计算时只有发起者收到 on_generation 回调，其余调用方只拿最终结果。
+    alias_keys: 额外写入的缓存 key (如 URL key)；提前返回的结果由后台补全后统一写入。
+    """
+    if not CONFIG.RESULT_CACHE_ENABLED:
+        return await process_single_workflow(original_url, img_bytes, filename, on_generation, strategies=strategies)
+
+    key = cache_key or _result_cache_key(img_bytes, strategies)
+    keys = (key,) + tuple(alias_keys)
+    hit = await _cache_lookup(key, filename, original_url)
+    if hit: return hit
+
+    if workflow_flight.is_running(key):
+        logger.info(f"🔗 [合并] {filename} 与进行中的同图任务共享结果")
+
+    async def _compute():
+        res = await process_single_workflow(original_url, img_bytes, filename, on_generation,
+                                            on_complete=lambda full: _cache_store(full, *keys), strategies=strategies)
+        await _cache_store(res, *keys)
+        return res
+
+    res = await workflow_flight.do(key, _compute)
+    # 共享结果各自拷贝一份，避免调用方回填字段时互相覆盖
+    res = json.loads(json.dumps(res, ensure_ascii=False))
+    res["filename"] = filename
+    if original_url: res["original_image_url"] = original_url
+    return res
 
 # ================= 7. API 路由 =================
 
 class UrlBatchRequest(BaseModel):
     urls: List[str]
+    strategies: Optional[List[str]] = None   # 只跑指定策略 (名称或代码标识)，不传跑默认策略
+
+def _select_strategies(names) -> List[StrategySpec]:
+    """请求里的策略名 (列表或逗号分隔字符串) -> 策略列表，未知策略返回 400"""
+    try:
+        return strategy_registry.select(names)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.get("/strategies")
+async def list_strategies():
+    """注册表中的全部策略 (default=true 的为未指定时默认运行的策略)"""
+    return {"strategies": strategy_registry.describe(), "input_profiles": strategy_registry.describe_profiles()}
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """缓存命中统计 (整体结果缓存 + 视觉分析缓存)，以及方向预检测的次数 / 耗时 / 相对 Tesseract 省下的时间"""
+    if model_pool:
+        orientation = await model_pool.orientation_stats()   # 多进程模式：按副本地址分开
+    else:
+        orientation = img_processor.get_orientation_stats() if img_processor else {}
+    return {"workflow": result_cache.stats(), "vision": vision_cache.stats(), "orientation": orientation}
+
+@app.get("/ref_assets")
+async def ref_assets_status():
+    """参考图资产：当前 URL、本地内容哈希、探活 / 重传次数"""
+    return ref_assets.describe()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标 (text format 0.0.4)：分阶段耗时、各资源池排队/占用时间、传输字节数等"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/limits")
+async def limits():
+    """各资源池的实时并发限制与排队情况 (Ark 两个池为自适应调整后的当前值)"""
+    return {
+        "gen": gen_limiter.stats(), "vision": vision_limiter.stats(),
+        "gpu": gpu_pool.stats(), "upload": upload_pool.stats(), "workflow": workflow_pool.stats(),
+    }
+
+def _mark_bulk_if_large(n: int):
+    """大批量请求且未显式指定优先级时，降为 bulk"""
+    tag = get_tag()
+    if not tag.explicit and n > CONFIG.BULK_BATCH_THRESHOLD:
+        set_tag(tag.tenant, "bulk")
+
+async def _restore_url_item(url: str, idx: int, on_generation=None,
+                            strategies: Optional[List[StrategySpec]] = None) -> dict:
+    # 同样加锁，限制同时下载的图片数量
+    async with workflow_pool.slot():
+        # 同一下载链接重复提交：连下载都省掉
+        url_key = _url_cache_key(url, strategies)
+        hit = await _cache_lookup(url_key, f"url_{idx}", url)
+        if hit: return hit
+
+        ib = await async_download(url)
+        if not ib: return {"filename": url, "status": "failed_download"}
+        result = await cached_workflow(url, ib, f"url_{idx}", on_generation=on_generation, alias_keys=(url_key,),
+                                       strategies=strategies)
+        await _cache_store(result, url_key)
+        return result
+
+async def _restore_file_item(filename: str, read_content: Callable[[], Awaitable[bytes]], on_generation=None,
+                             strategies: Optional[List[StrategySpec]] = None) -> dict:
+    # [关键] 在读取文件内容之前，先申请“准入证”
+    # 只有拿到锁的任务，才允许把文件读入内存，防止 OOM
+    async with workflow_pool.slot():
+        # 1. 读取文件内容 (只有 15 个任务能同时运行到这里)
+        content = await read_content()
+
+        # 同图重复提交：原图上传和整条流水线都省掉
+        cache_key = _result_cache_key(content, strategies)
+        hit = await _cache_lookup(cache_key, filename)
+        if hit:
+            # 后台补全写入的缓存没有原图链接，补传一次
+            if not hit.get("original_image_url"):
+                hit["original_image_url"] = await async_upload(content)
+                await _cache_store(hit, cache_key)
+            return hit
+        
+        # 2. 启动后台上传
+        logger.info(f"⬆️ [后台] 原图开始静默上传: {filename}")
+        task_upload_src = asyncio.create_task(async_upload(content))
+        
+        # 3. 启动 AI 处理
+        process_task = asyncio.create_task(cached_workflow("", content, filename, cache_key, on_generation=on_generation,
+                                                           strategies=strategies))
+        
+        # 4. 等待完成
+        result = await process_task
+        real_src_url = await task_upload_src
+        
+        # 5. 填补 URL (连同原图链接一起写回缓存)
+        if result["status"] == "success":
+            result["original_image_url"] = real_src_url
+            await _cache_store(result, cache_key)
+        
+        return result
 
 @app.post("/restore_batch_url")
 async def restore_batch_url(req: UrlBatchRequest):
     logger.info(f"📨 收到 URL 批量请求: {len(req.urls)} 个")
     if not req.urls: raise HTTPException(400, "No URLs")
-    
-    async def _worker(url, idx):
-        # 同样加锁，限制同时下载的图片数量
-        async with workflow_lock:
-            ib = await async_download(url)
-            if not ib: return {"filename": url, "status": "failed_download"}
-            return await process_single_workflow(url, ib, f"url_{idx}")
+    specs = _select_strategies(req.strategies)
+    _mark_bulk_if_large(len(req.urls))
             
-    tasks = [_worker(u, i) for i, u in enumerate(req.urls)]
+    tasks = [_restore_url_item(u, i, strategies=specs) for i, u in enumerate(req.urls)]
     results = await asyncio.gather(*tasks)
     return {"total": len(req.urls), "success": len([r for r in results if r['status']=='success']), "results": results}
 
 @app.post("/restore_batch_file")
-async def restore_batch_file(files: List[UploadFile] = File(...)):
+async def restore_batch_file(files: List[UploadFile] = File(...), strategies: Optional[str] = Form(None)):
     logger.info(f"📂 收到文件批量请求: {len(files)} 个")
-    
-    async def _worker(file):
-        # [关键] 在读取文件内容之前，先申请“准入证”
-        # 只有拿到锁的任务，才允许把文件读入内存，防止 OOM
-        async with workflow_lock:
-            # 1. 读取文件内容 (只有 15 个任务能同时运行到这里)
-            content = await file.read()
-            
-            # 2. 启动后台上传
-            logger.info(f"⬆️ [后台] 原图开始静默上传: {file.filename}")
-            task_upload_src = asyncio.create_task(async_upload(content))
-            
-            # 3. 启动 AI 处理
-            process_task = asyncio.create_task(process_single_workflow("", content, file.filename))
-            
-            # 4. 等待完成
-            result = await process_task
-            real_src_url = await task_upload_src
-            
-            # 5. 填补 URL
-            if result["status"] == "success":
-                result["original_image_url"] = real_src_url
-            
-            return result
+    specs = _select_strategies(strategies)
+    _mark_bulk_if_large(len(files))
 
-    # 这里虽然创建了所有 task，但它们会在 `async with workflow_lock` 处排队
+    # 这里虽然创建了所有 task，但它们会在 `async with workflow_pool` 处排队
     # 不会消耗内存去 read() 文件
-    tasks = [_worker(f) for f in files]
+    tasks = [_restore_file_item(f.filename, f.read, strategies=specs) for f in files]
     results = await asyncio.gather(*tasks)
     return {"total": len(files), "success": len([r for r in results if r['status']=='success']), "results": results}
 
+# ================= 7.1 流式接口 (NDJSON) =================
+# 每行一个 JSON 事件，谁先完成先推谁：
+#   {"event": "generation", "index": i, "filename": ..., "data": {单个策略结果}}
+#   {"event": "result",     "index": i, "data": {单图完整结果}}
+#   {"event": "done",       "total": N, "success": k}
+
+async def _stream_ndjson(items: list):
+    """items: [(标识, job)]，job(on_generation) -> 单图结果"""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def _run(idx, name, job):
+        def _on_gen(filename, gen):
+            queue.put_nowait({"event": "generation", "index": idx, "filename": filename, "data": gen})
+        try:
+            res = await job(_on_gen)
+        except Exception as e:
+            logger.error(f"Stream Item Error {name}: {e}")
+            res = {"filename": name, "status": "failed", "error_msg": str(e)}
+        queue.put_nowait({"event": "result", "index": idx, "data": res})
+
+    tasks = [asyncio.create_task(_run(i, name, job)) for i, (name, job) in enumerate(items)]
+    done, success = 0, 0
+    try:
+        while done < len(tasks):
+            ev = await queue.get()
+            if ev["event"] == "result":
+                done += 1
+                if ev["data"].get("status") == "success": success += 1
+            yield json.dumps(ev, ensure_ascii=False) + "\n"
+        yield json.dumps({"event": "done", "total": len(tasks), "success": success}, ensure_ascii=False) + "\n"
+    finally:
+        # 客户端断开时取消剩余任务，避免白跑
+        for t in tasks:
+            if not t.done(): t.cancel()
+
+@app.post("/restore_batch_url_stream")
+async def restore_batch_url_stream(req: UrlBatchRequest):
+    logger.info(f"📨 收到 URL 流式请求: {len(req.urls)} 个")
+    if not req.urls: raise HTTPException(400, "No URLs")
+    specs = _select_strategies(req.strategies)
+    _mark_bulk_if_large(len(req.urls))
+
+    items = [(u, lambda cb, u=u, i=i: _restore_url_item(u, i, cb, specs)) for i, u in enumerate(req.urls)]
+    return StreamingResponse(_stream_ndjson(items), media_type="application/x-ndjson")
+
+@app.post("/restore_batch_file_stream")
+async def restore_batch_file_stream(files: List[UploadFile] = File(...), strategies: Optional[str] = Form(None)):
+    logger.info(f"📂 收到文件流式请求: {len(files)} 个")
+    if not files: raise HTTPException(400, "No files")
+    specs = _select_strategies(strategies)
+    _mark_bulk_if_large(len(files))
+
+    # StreamingResponse 在路由函数返回后才开始迭代，届时 UploadFile 可能已被关闭，
+    # 所以这里先把内容读出来 (文件本身已在服务端落地，额外内存开销有限)
+    loaded = [(f.filename, await f.read()) for f in files]
+
+    def _job(name, content):
+        async def _read(): return content
+        return lambda cb: _restore_file_item(name, _read, cb, specs)
+
+    items = [(name, _job(name, content)) for name, content in loaded]
+    return StreamingResponse(_stream_ndjson(items), media_type="application/x-ndjson")
+
+# ================= 7.2 异步 Job 接口 =================
+# POST /jobs 入队立即返回 job_id，GET /jobs/{id} 查进度与部分结果，
+# 可选 callback_url：整个 Job 完成后 POST 完整结果 (失败重试 JOB_CALLBACK_RETRIES 次)
+
+class JobRequest(BaseModel):
+    urls: List[str]
+    callback_url: Optional[str] = None
+    strategies: Optional[List[str]] = None
+
+async def _job_db(fn, *args):
+    """JobStore 的 SQLite 调用 (含 BEGIN IMMEDIATE 忙等、几 MB 的 content BLOB) 放到线程池，不阻塞事件循环"""
+    return await asyncio.get_event_loop().run_in_executor(cpu_executor, fn, *args)
+
+async def _fire_job_callback(job_id: str):
+    job = await _job_db(job_store.get_job, job_id)
+    if not job or not job.get("callback_url"): return
+    for attempt in range(CONFIG.JOB_CALLBACK_RETRIES):
+        try:
+            resp = await http_client.post(job["callback_url"], json=job, timeout=30)
+            if resp.status_code < 300:
+                await _job_db(job_store.set_callback_status, job_id, "ok")
+                logger.info(f"📮 [Job] {job_id} 回调成功")
+                return
+            logger.warning(f"⚠️ [Job] {job_id} 回调 HTTP {resp.status_code} (第 {attempt+1} 次)")
+        except Exception as e:
+            logger.warning(f"⚠️ [Job] {job_id} 回调异常: {e} (第 {attempt+1} 次)")
+        await asyncio.sleep(2 ** attempt)
+    await _job_db(job_store.set_callback_status, job_id, "failed")
+
+async def _job_heartbeat(item: dict):
+    while True:
+        await asyncio.sleep(CONFIG.JOB_LEASE_S / 3)
+        if not await _job_db(job_store.renew, item["job_id"], item["idx"], item["lease"]):
+            logger.warning(f"⚠️ [Job] {item['job_id']}#{item['idx']} 租约已被其他 Worker 接手")
+            return
+
+async def _job_worker(wid: int):
+    while True:
+        try:
+            item = await _job_db(job_store.claim)
+            for jid in job_store.drain_completed():   # 只读内存列表，不碰 SQLite
+                _spawn_background(_fire_job_callback(jid))
+            if item is None:
+                job_wakeup.clear()
+                try: await asyncio.wait_for(job_wakeup.wait(), CONFIG.JOB_POLL_S)
+                except asyncio.TimeoutError: pass
+                continue
+
+            logger.info(f"📦 [Job-{wid}] 领取 {item['job_id']}#{item['idx']} (第 {item['attempt']} 次)")
+            # 异步 Job 一律按 bulk 调度，每个 Job 视为一个租户，多个 Job 之间公平轮转
+            set_tag(f"job:{item['job_id']}", "bulk")
+            heartbeat = asyncio.create_task(_job_heartbeat(item))
+            try:
+                # 入队时已校验过策略名；注册表若在重启后改动，未知策略按失败处理
+                specs = strategy_registry.select(item["options"].get("strategies"))
+                if item["content"] is not None:
+                    content = bytes(item["content"])
+                    async def _read(): return content
+                    res = await _restore_file_item(item["source"], _read, strategies=specs)
+                else:
+                    res = await _restore_url_item(item["source"], item["idx"], strategies=specs)
+            except asyncio.CancelledError:
+                # 进程退出：不写结果，租约过期后由下一个进程接着跑
+                raise
+            except Exception as e:
+                logger.error(f"Job Item Error {item['job_id']}#{item['idx']}: {e}")
+                res = {"filename": item["source"], "status": "failed", "error_msg": str(e)}
+            finally:
+                heartbeat.cancel()
+
+            if await _job_db(job_store.finish, item["job_id"], item["idx"], item["lease"], res):
+                logger.info(f"🎉 [Job] {item['job_id']} 全部完成")
+                _spawn_background(_fire_job_callback(item["job_id"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job Worker Error: {e}")
+            await asyncio.sleep(CONFIG.JOB_POLL_S)
+
+@app.post("/jobs")
+async def create_job(req: JobRequest):
+    if not req.urls: raise HTTPException(400, "No URLs")
+    specs = _select_strategies(req.strategies)
+    job_id = await _job_db(job_store.create_job, [{"source": u} for u in req.urls], req.callback_url,
+                           {"strategies": [s.key for s in specs]})
+    job_wakeup.set()
+    logger.info(f"📥 [Job] 新任务 {job_id}: {len(req.urls)} 个 URL")
+    return {"job_id": job_id, "status": "queued", "total": len(req.urls)}
+
+@app.post("/jobs/files")
+async def create_file_job(files: List[UploadFile] = File(...), callback_url: Optional[str] = Form(None),
+                          strategies: Optional[str] = Form(None)):
+    if not files: raise HTTPException(400, "No files")
+    specs = _select_strategies(strategies)
+    items = [{"source": f.filename, "content": await f.read()} for f in files]
+    # 文件内容整块写入 SQLite (可能几十 MB)，放到线程池
+    job_id = await _job_db(job_store.create_job, items, callback_url, {"strategies": [s.key for s in specs]})
+    job_wakeup.set()
+    logger.info(f"📥 [Job] 新任务 {job_id}: {len(files)} 个文件")
+    return {"job_id": job_id, "status": "queued", "total": len(files)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await _job_db(job_store.get_job, job_id)
+    if job is None: raise HTTPException(404, "Job not found")
+    return job
+
 if __name__ == "__main__":
     import uvicorn
     # 统一使用 6003 端口
+    if CONFIG.API_WORKERS > 1:
+        # 限流器 / Job worker / 参考图保活 / SingleFlight 都是进程内单例，多 worker 会各跑一份
+        logger.error(f"❌ RESTORE_API_WORKERS={CONFIG.API_WORKERS} 不支持：进程内单例会被复制 "
+                     f"(并发上限 x{CONFIG.API_WORKERS}、Job 重复领取、去重失效)，请设为 1")
+        sys.exit(1)
     uvicorn.run(app, host="0.0.0.0", port=6003, workers=1)
\ No newline at end of file
@@ -20,12 +20,10 @@ import requests
 import cv2
 import time
 import numpy as np
-from typing import List, Optional, Callable
+from typing import List, Optional
 from concurrent.futures import ThreadPoolExecutor, wait, ALL_COMPLETED
-from enum import Enum
-from dataclasses import dataclass
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from volcenginesdkarkruntime import Ark
@@ -33,6 +31,12 @@ from volcenginesdkarkruntime import Ark
 # === 本地矫正模块 ===
 
 from test import processor as img_processor
+from cache_store import VisionCache, vision_signature
+from bg_detect import analyze_background
+from uploader import CdnUploader
+from strategies import StrategyRegistry, StrategySpec
+from red_frame import red_frame_crop
+from ref_assets import RefAssetManager
 
 CORRECTION_LOCK = threading.Lock()
 
@@ -52,11 +56,19 @@ class CONFIG:
     # === 测试上传接口配置 ===
     UPLOAD_API_URL = "https://tt.36588.com.cn/acard/common/commonUpload"
     IMG_URL_PREFIX = "https://tt.36588.com.cn/acard/assets/resource/imgs/normal/"
+    # 上传方式: multipart / binary / base64 (二进制方式失败会自动回退 base64)
+    UPLOAD_TRANSPORT = os.environ.get("RESTORE_UPLOAD_TRANSPORT", "base64")
     
     REF_IMG_PATHS = [
         "ref_imgs/1.png", "ref_imgs/2.png", "ref_imgs/3.png", "ref_imgs/4.png"
     ]
 
+    # 本地纯色背景检测置信度达到该值才直接采用，否则回退 PROMPT_BG_CHECK 远程调用 (与 api.py 一致)
+    BG_LOCAL_MIN_CONFIDENCE = 0.75
+
+    # 策略注册表配置文件 (与 api.py 的 CONFIG.STRATEGY_CONFIG_PATH 同一个环境变量)
+    STRATEGY_CONFIG_PATH = os.environ.get("RESTORE_STRATEGY_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "strategies.json"))
+
     PROMPT_DESCRIBE = """
     平面设计还原专家：透过图像分析原始数字布局，按【背景 / 填充 / 色块 / 排版 / 图标 / 干扰 / 风格】7 部分输出。
     注意：这是对一张已经过矫正的平面图进行分析。
@@ -100,12 +112,16 @@ class CONFIG:
     """
 
 client = Ark(api_key=CONFIG.VOLC_API_KEY, base_url=CONFIG.VOLC_BASE_URL)
+# 视觉分析缓存 (与 api.py 共用同一个 SQLite 文件)
+uploader = CdnUploader(CONFIG.UPLOAD_API_URL, CONFIG.IMG_URL_PREFIX, CONFIG.UPLOAD_TRANSPORT, timeout=120)
+vision_cache = VisionCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "vision_cache.sqlite3"))
+ref_assets = RefAssetManager(CONFIG.REF_IMG_PATHS)   # 参考图预编码 (app.py 直接传 data URI，不涉及 URL 保活)
 app = FastAPI(title="Smart Card Restore V14 Upload", description="并发4路极速+自动上传返回URL")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
 # === 工具函数 ===
 def _file_to_base64_str(file_path):
-    """仅用于构造上传接口的请求体"""
+    """读取文件返回纯 Base64 字符串 (不带 data: 前缀，需要 data URI 的调用方自行拼接)"""
     if not os.path.exists(file_path): return ""
     with open(file_path, "rb") as f:
         return base64.b64encode(f.read()).decode('utf-8')
@@ -118,31 +134,9 @@ def upload_to_cdn(file_path: str) -> str:
         return ""
     
     try:
-        # 1. 转Base64用于上传
-        raw_b64 = _file_to_base64_str(file_path)
-        if not raw_b64: return ""
-
-        b64_with_header = f"data:image/jpeg;base64,{raw_b64}"
-
-        # 2. 构造请求
-        payload = {"base64Str": b64_with_header}
-        headers = {"Content-Type": "application/json"}
-        
-        # 3. 发送请求 (设置超时)
-        resp = requests.post(CONFIG.UPLOAD_API_URL, json=payload, headers=headers, timeout=120)
-        
-        # 4. 解析结果
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get("success"):
-                user_data = data.get("userData", "")
-                # 拼接完整 URL
-                return f"{CONFIG.IMG_URL_PREFIX}{user_data}"
-            else:
-                print(f"⚠️ Upload Failed: {data}")
-        else:
-            print(f"⚠️ Upload HTTP Error: {resp.status_code}")
-            
+        with open(file_path, "rb") as f:
+            data = f.read()
+        return uploader.upload_sync(data, filename=os.path.basename(file_path))
     except Exception as e:
         print(f"❌ Upload Exception: {e}")
     
@@ -165,66 +159,24 @@ def _crop_resnet_post(image_path, output_path):
     return perform_correction_safe(image_path, output_path)
 
 def _crop_red_frame(image_path, output_path):
-    def order_points(pts):
-        rect = np.zeros((4, 2), dtype="float32")
-        s = pts.sum(axis=1)
-        rect[0], rect[2] = pts[np.argmin(s)], pts[np.argmax(s)]
-        diff = np.diff(pts, axis=1)
-        rect[1], rect[3] = pts[np.argmin(diff)], pts[np.argmax(diff)]
-        return rect
+    # ✅ [修改] 检测逻辑统一走 red_frame 模块 (缩图粗定位 + 全分辨率精修，支持切角/圆角)
     try:
         img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
         if img is None: return False
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        mask = cv2.bitwise_or(cv2.inRange(hsv, np.array([0, 70, 50]), np.array([10, 255, 255])),
-                              cv2.inRange(hsv, np.array([170, 70, 50]), np.array([180, 255, 255])))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5,5),np.uint8))
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours: return False
-        c = max(contours, key=cv2.contourArea)
-        if cv2.contourArea(c) < 2000: return False
-        approx = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
-        if len(approx) == 4:
-            pts = order_points(approx.reshape(4, 2))
-            dst = np.array([[0, 0], [3000-1, 0], [3000-1, 1824-1], [0, 1824-1]], dtype="float32") 
-            warped = cv2.warpPerspective(img, cv2.getPerspectiveTransform(pts, dst), (3000, 1824))
-            cv2.imencode('.jpg', warped)[1].tofile(output_path)
-            return True
-        return False
+        warped = red_frame_crop(img)
+        if warped is None: return False
+        cv2.imencode('.jpg', warped)[1].tofile(output_path)
+        return True
     except: return False
 
-# === 策略定义 ===
-class StrategyType(Enum):
-    V7_STATIC = "v7_static"
-    V7_DYNAMIC = "v7_dynamic"
-    V8_STRICT = "v8_strict"
-    V8_SIMPLE = "v8_simple"
-
-@dataclass
-class RestoreStrategy:
-    name: str
-    type: StrategyType
-    use_layout_analysis: bool
-    use_ref_images: bool
-    crop_func: Callable
-
-    def get_prompt(self, layout_desc: str = "") -> str:
-        if self.type == StrategyType.V7_DYNAMIC:
-            return f"{CONFIG.PROMPT_Gen_BASE}\n视觉参考：{layout_desc}"
-        elif self.type == StrategyType.V7_STATIC:
-            return CONFIG.PROMPT_WithoutVison
-        elif self.type == StrategyType.V8_SIMPLE:
-            return CONFIG.PROMPT_V2SIMPLE
-        elif self.type == StrategyType.V8_STRICT:
-            return CONFIG.PROMPT_V2STRICT
-        return ""
+# === 策略定义 (✅ [修改] 改由 strategies.json 注册表声明，与 api.py 共用) ===
+strategy_registry = StrategyRegistry.load(CONFIG.STRATEGY_CONFIG_PATH)
 
-PARALLEL_STRATEGIES = [
-    RestoreStrategy(name="静态生成", type=StrategyType.V7_STATIC, use_layout_analysis=False, use_ref_images=False, crop_func=_crop_resnet_post),
-    RestoreStrategy(name="视觉分析", type=StrategyType.V7_DYNAMIC, use_layout_analysis=True, use_ref_images=False, crop_func=_crop_resnet_post),
-    RestoreStrategy(name="内容锁定", type=StrategyType.V8_STRICT, use_layout_analysis=False, use_ref_images=True, crop_func=_crop_red_frame),
-    RestoreStrategy(name="参考图", type=StrategyType.V8_SIMPLE, use_layout_analysis=False, use_ref_images=True, crop_func=_crop_red_frame)
-]
+CROP_FUNCS = {
+    "resnet": _crop_resnet_post,
+    "red_frame": _crop_red_frame,
+    "none": lambda image_path, output_path: False,   # 不裁切：下面会直接复制生成图
+}
 
 # === 数据模型 (保持字段名不变，内容改为URL) ===
 class GenerationResult(BaseModel):
@@ -248,6 +200,7 @@ class BatchRestoreResponse(BaseModel):
     total_requested: int; total_success: int; batch_results: List[SingleInputResult]
 class UrlBatchRequest(BaseModel):
     urls: List[str]
+    strategies: Optional[List[str]] = None
 
 # === 基础功能 ===
 def _extract_json(c):
@@ -263,31 +216,64 @@ def download_file(url, p):
     except: pass
     return False
 
+def _image_signature(p):
+    # 与 api.py 同一输入：全尺寸矫正图缩到长边 1024 后取 pHash + 颜色签名
+    try:
+        img = cv2.imdecode(np.fromfile(p, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return vision_signature(img) if img is not None else None
+    except: return None
+
+def _cached_vision(prompt, p, fn):
+    """按 (缩略图 pHash + 颜色签名, Prompt) 查缓存，未命中才调用视觉模型"""
+    sig = _image_signature(p)
+    cache_prompt = f"{CONFIG.MODEL_VISION}\n{prompt}"
+    if sig is not None:
+        cached = vision_cache.get(sig[0], sig[1], cache_prompt)
+        if cached: return cached
+    res = fn(p)
+    if res and sig is not None: vision_cache.set(sig[0], sig[1], cache_prompt, res)
+    return res
+
 def analyze_layout(p):
+    return _cached_vision(CONFIG.PROMPT_DESCRIBE, p, _analyze_layout_remote)
+
+def check_background(p):
+    # 先用本地像素统计判断，置信度足够就不调用视觉模型
+    try:
+        img = cv2.imdecode(np.fromfile(p, dtype=np.uint8), cv2.IMREAD_REDUCED_COLOR_4)
+        if img is not None:
+            local = analyze_background(img)
+            if local["confidence"] >= CONFIG.BG_LOCAL_MIN_CONFIDENCE:
+                return {"is_solid": local["is_solid"], "hex_color": local["hex_color"]}
+    except: pass
+    return _cached_vision(CONFIG.PROMPT_BG_CHECK, p, _check_background_remote) or {"is_solid": False, "hex_color": ""}
+
+def _analyze_layout_remote(p):
     try: return client.chat.completions.create(model=CONFIG.MODEL_VISION, messages=[{"role":"user","content":[{"type":"text","text":CONFIG.PROMPT_DESCRIBE},{"type":"image_url","image_url":{"url":f"data:image/jpeg;base64,{_file_to_base64_str(p)}"}}]} ]).choices[0].message.content
     except: return ""
 
-def check_background(p):
+def _check_background_remote(p):
     try:
         data = _extract_json(client.chat.completions.create(model=CONFIG.MODEL_VISION, temperature=0.1, messages=[{"role":"user","content":[{"type":"text","text":CONFIG.PROMPT_BG_CHECK},{"type":"image_url","image_url":{"url":f"data:image/jpeg;base64,{_file_to_base64_str(p)}"}}]} ]).choices[0].message.content)
         if data: 
             hex_val = data.get("hex_color")
             return {"is_solid": data.get("is_solid", False), "hex_color": hex_val if hex_val else ""}
     except: pass
-    return {"is_solid": False, "hex_color": ""}
+    return None
 
 def generate_image_wrapper(prompt, main_p, use_ref):
     try:
         imgs = []
-        if use_ref: 
-            for p in CONFIG.REF_IMG_PATHS: 
-                if os.path.exists(p): imgs.append(f"data:image/jpeg;base64,{_file_to_base64_str(p)}")
+        # ✅ [修改] 参考图预编码缓存在内存里 (文件变化时才重新读盘)，不再每张卡片都读盘 + Base64
+        if use_ref: imgs.extend(ref_assets.data_uris())
         imgs.append(f"data:image/jpeg;base64,{_file_to_base64_str(main_p)}")
         return client.images.generate(model=CONFIG.MODEL_GEN, prompt=prompt, image=imgs, size=CONFIG.FIXED_GEN_SIZE, response_format="url", watermark=False).data[0].url
     except Exception as e: print(f"Gen Error: {e}"); return None
 
 # === 核心处理 (并发+上传) ===
-def _core_process(local_source_path: str, original_filename: str, temp_root_dir: str) -> SingleInputResult:
+def _core_process(local_source_path: str, original_filename: str, temp_root_dir: str,
+                  strategies: Optional[List[StrategySpec]] = None) -> SingleInputResult:
+    strategies = strategies or strategy_registry.select()
     print(f"▶️ [处理] {original_filename}")
     work_dir = os.path.join(temp_root_dir, uuid.uuid4().hex); os.makedirs(work_dir, exist_ok=True)
     
@@ -308,7 +294,7 @@ def _core_process(local_source_path: str, original_filename: str, temp_root_dir:
     fut_bg = executor.submit(check_background, corr_p)
     
     # 2.2 视觉分析 (异步)
-    fut_layout = executor.submit(analyze_layout, corr_p)
+    fut_layout = executor.submit(analyze_layout, corr_p) if any(st.need_vision for st in strategies) else None
 
     # 2.3 定义生图+裁切+上传 任务 (✅ 已添加详细计时)
     def run_strategy(strategy, layout_desc_input=None):
@@ -316,18 +302,18 @@ def _core_process(local_source_path: str, original_filename: str, temp_root_dir:
             import time # 引入计时
             t0 = time.time() # 计时开始
             
-            prompt = strategy.get_prompt(layout_desc_input)
-            tid = f"{strategy.type.value}_{uuid.uuid4().hex[:4]}"
+            prompt = StrategyRegistry.build_prompt(strategy, CONFIG, layout_desc_input or "")
+            tid = f"{strategy.key.lower()}_{uuid.uuid4().hex[:4]}"
             raw_p = os.path.join(work_dir, f"{tid}_raw.jpg")
             
             # 生图 + 下载
-            url = generate_image_wrapper(prompt, corr_p, strategy.use_ref_images)
+            url = generate_image_wrapper(prompt, corr_p, strategy.use_ref)
             if not url or not download_file(url, raw_p): return None
             t1 = time.time() # 生图结束
 
             # 裁切
             crop_p = os.path.join(work_dir, f"{tid}_crop.jpg")
-            ok = strategy.crop_func(raw_p, crop_p)
+            ok = CROP_FUNCS[strategy.crop](raw_p, crop_p)
             fin_p = crop_p if ok else raw_p
             if not ok: shutil.copy(raw_p, crop_p)
             t2 = time.time() # 裁切结束
@@ -355,18 +341,18 @@ def _core_process(local_source_path: str, original_filename: str, temp_root_dir:
     gen_futures = []
 
     # 立即提交不依赖视觉分析的任务
-    for st in PARALLEL_STRATEGIES:
-        if not st.use_layout_analysis:
+    for st in strategies:
+        if not st.need_vision:
             gen_futures.append(executor.submit(run_strategy, st, None))
 
     # 等待视觉分析结果后提交剩余任务
     try:
-        layout_res = fut_layout.result(timeout=30)
+        layout_res = fut_layout.result(timeout=30) if fut_layout else ""
     except:
         layout_res = ""
     
-    for st in PARALLEL_STRATEGIES:
-        if st.use_layout_analysis:
+    for st in strategies:
+        if st.need_vision:
             gen_futures.append(executor.submit(run_strategy, st, layout_res))
 
     # 4. 收集结果
@@ -398,9 +384,17 @@ def _core_process(local_source_path: str, original_filename: str, temp_root_dir:
     )
 
 # === API 路由 ===
+def _select_strategies(names) -> List[StrategySpec]:
+    """请求里的策略名 (列表或逗号分隔字符串) -> 策略列表，未知策略返回 400"""
+    try:
+        return strategy_registry.select(names)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
 @app.post("/restore_batch_file", response_model=BatchRestoreResponse)
-def restore_batch_file(files: List[UploadFile] = File(...)):
+def restore_batch_file(files: List[UploadFile] = File(...), strategies: Optional[str] = Form(None)):
     if not files: raise HTTPException(400, "No files")
+    specs = _select_strategies(strategies)
     with tempfile.TemporaryDirectory() as td:
         tasks = []
         for f in files:
@@ -410,7 +404,7 @@ def restore_batch_file(files: List[UploadFile] = File(...)):
         
         res = []
         with ThreadPoolExecutor(max_workers=5) as ex:
-            futures = [ex.submit(_core_process, p, n, td) for p, n in tasks]
+            futures = [ex.submit(_core_process, p, n, td, specs) for p, n in tasks]
             for f in futures: res.append(f.result())
             
     return BatchRestoreResponse(total_requested=len(files), total_success=len([r for r in res if r.status=="success"]), batch_results=res)
@@ -418,10 +412,11 @@ def restore_batch_file(files: List[UploadFile] = File(...)):
 @app.post("/restore_batch_url", response_model=BatchRestoreResponse)
 def restore_batch_url(p: UrlBatchRequest):
     if not p.urls: raise HTTPException(400, "No URLs")
+    specs = _select_strategies(p.strategies)
     with tempfile.TemporaryDirectory() as td:
         def dl_and_process(iu): 
             i,u=iu; path=os.path.join(td,f"{i}.jpg")
-            return _core_process(path,f"u_{i}",td) if download_file(u,path) else SingleInputResult(filename=u,status="failed")
+            return _core_process(path,f"u_{i}",td,specs) if download_file(u,path) else SingleInputResult(filename=u,status="failed")
         
         res = []
         with ThreadPoolExecutor(max_workers=5) as ex:
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : ark_async.py
+@Description: 方舟 (Ark) 接口的原生 async 调用，直接复用 api.py 共享的 httpx.AsyncClient 连接池
+@Logic      :
+    1. 原来用同步 Ark SDK + run_in_executor，每个在途生图要占一个线程几十秒，线程池就是在途上限。
+       改成 httpx 异步请求后，在途数量只受限流器 (adaptive_limiter) 和连接池约束，线程池留给真正的计算。
+    2. 只实现用到的两个接口：
+       - POST {base_url}/chat/completions   (视觉分析)
+       - POST {base_url}/images/generations (生图)
+    3. HTTP 错误统一抛 ArkAPIError，带 status_code / code / request_id，限流器据此区分 429 与 5xx。
+    4. 少量退避重试，按接口是否幂等区分：
+       - 视觉分析 (幂等)：连接失败 / 连接中途断开 / 5xx 都重试
+       - 生图 (按次计费)：只重试 ConnectError (请求肯定没发出去)；中途断开或 5xx 时服务端可能已经在生成，
+         重试会重复计费，直接抛给上层
+       429 一律直接抛出，交给限流器降并发。
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+
+logger = logging.getLogger("SmartCard")
+
+
+class ArkAPIError(Exception):
+    def __init__(self, status_code: int, message: str, code: str = "", request_id: str = ""):
+        super().__init__(f"[{status_code}] {code} {message} (request_id={request_id})")
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+        self.request_id = request_id
+
+
+class AsyncArk:
+    """方舟 REST 接口的最小异步客户端"""
+
+    def __init__(self, api_key: str, base_url: str, client: httpx.AsyncClient,
+                 max_retries: int = 2, retry_backoff_s: float = 1.0):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.client = client
+        self.max_retries = int(max_retries)
+        self.retry_backoff_s = float(retry_backoff_s)
+
+    async def _post(self, path: str, body: Dict[str, Any], timeout: float,
+                    idempotent: bool = True) -> Dict[str, Any]:
+        """idempotent=False (生图) 时只在连接建立失败时重试，避免重复生成、重复计费"""
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        retry_excs = (httpx.ConnectError, httpx.RemoteProtocolError) if idempotent else (httpx.ConnectError,)
+        attempt = 0
+        while True:
+            try:
+                resp = await self.client.post(f"{self.base_url}{path}", json=body, headers=headers, timeout=timeout)
+            except retry_excs as e:
+                if attempt >= self.max_retries: raise
+                logger.warning(f"⚠️ [Ark] {path} 连接失败，重试 {attempt + 1}/{self.max_retries}: {e}")
+            else:
+                if resp.status_code == 200:
+                    return resp.json()
+                error = self._to_error(resp)
+                if resp.status_code < 500 or not idempotent or attempt >= self.max_retries:
+                    raise error
+                logger.warning(f"⚠️ [Ark] {path} 服务端错误，重试 {attempt + 1}/{self.max_retries}: {error}")
+            attempt += 1
+            await asyncio.sleep(self.retry_backoff_s * (2 ** (attempt - 1)))
+
+    @staticmethod
+    def _to_error(resp: httpx.Response) -> ArkAPIError:
+        request_id = resp.headers.get("x-request-id", "")
+        try:
+            err = resp.json().get("error") or {}
+        except Exception:
+            err = {}
+        return ArkAPIError(resp.status_code, err.get("message") or resp.text[:200], err.get("code", ""), request_id)
+
+    # ---------------- 接口 ----------------
+
+    async def chat_completion(self, model: str, messages: List[Dict[str, Any]], timeout: float = 60,
+                              **kwargs) -> str:
+        """返回第一个 choice 的文本内容"""
+        data = await self._post("/chat/completions", {"model": model, "messages": messages, **kwargs}, timeout)
+        return data["choices"][0]["message"]["content"]
+
+    async def generate_image(self, model: str, prompt: str, image: Union[str, List[str], None] = None,
+                             size: Optional[str] = None, response_format: str = "url", watermark: bool = False,
+                             timeout: float = 180, **kwargs) -> str:
+        """返回第一张图的 URL (response_format="url")"""
+        body: Dict[str, Any] = {"model": model, "prompt": prompt, "response_format": response_format,
+                                "watermark": watermark, **kwargs}
+        if image: body["image"] = image
+        if size: body["size"] = size
+        data = await self._post("/images/generations", body, timeout, idempotent=False)
+        item = data["data"][0]
+        return item.get("url") or item.get("b64_json", "")
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : bench_codec.py
+@Description: JPEG 编解码后端微基准 (turbojpeg / cv2 / pil)
+@Logic      :
+    1. 读取 ref_imgs/ 下的样图，统一缩放到生产尺寸 3000x1824 并编码为 q95 JPEG (模拟矫正图 / 生成图)。
+    2. 对每个可用后端分别测：
+       - 全尺寸解码
+       - q95 编码
+       - 1024 缩略图：全尺寸解码 + resize  vs  DCT 缩放解码 + resize
+    3. 每项重复 N 次取中位数 (ms)，最后打印对比表。
+@Usage      :
+    python bench/bench_codec.py [--dir ref_imgs] [--repeat 10]
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import statistics
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jpeg_codec import available_codecs  # noqa: E402
+
+TARGET_SIZE = (3000, 1824)
+THUMB_SIDE = 1024
+
+
+def _median_ms(fn, repeat: int) -> float:
+    costs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        costs.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(costs)
+
+
+def _resize_to(img, side):
+    h, w = img.shape[:2]
+    scale = side / float(max(h, w))
+    if scale >= 1: return img
+    return cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def load_samples(folder: str):
+    """样图 -> 3000x1824 q95 JPEG 字节 + 对应像素"""
+    paths = sorted(glob.glob(os.path.join(folder, "*.png")) + glob.glob(os.path.join(folder, "*.jpg")))
+    samples = []
+    for p in paths:
+        img = cv2.imread(p, cv2.IMREAD_COLOR)
+        if img is None: continue
+        img = cv2.resize(img, TARGET_SIZE, interpolation=cv2.INTER_CUBIC)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        if ok: samples.append((os.path.basename(p), buf.tobytes(), img))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JPEG 编解码后端微基准")
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ref_imgs"))
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    samples = load_samples(args.dir)
+    if not samples:
+        print(f"❌ 没有找到样图: {args.dir}")
+        return
+    codecs = available_codecs()
+    print(f"📂 样图 {len(samples)} 张 ({TARGET_SIZE[0]}x{TARGET_SIZE[1]} q95) | 后端: {', '.join(codecs)} | 每项重复 {args.repeat} 次\n")
+
+    rows = []
+    for name, codec in codecs.items():
+        dec, enc, thumb_full, thumb_scaled = [], [], [], []
+        for _, data, img in samples:
+            dec.append(_median_ms(lambda: codec.decode(data), args.repeat))
+            enc.append(_median_ms(lambda: codec.encode(img, 95), args.repeat))
+            thumb_full.append(_median_ms(lambda: _resize_to(codec.decode(data), THUMB_SIDE), args.repeat))
+            thumb_scaled.append(_median_ms(
+                lambda: _resize_to(codec.decode_for_max_side(data, THUMB_SIDE)[0], THUMB_SIDE), args.repeat
+            ))
+        rows.append((name, statistics.mean(dec), statistics.mean(enc), statistics.mean(thumb_full), statistics.mean(thumb_scaled)))
+
+    header = f"{'后端':<10}{'全尺寸解码':>12}{'q95编码':>12}{'缩略图(全解码)':>16}{'缩略图(缩放解码)':>18}"
+    print(header)
+    print("-" * 72)
+    for name, d, e, tf, ts in rows:
+        print(f"{name:<10}{d:>11.1f}ms{e:>11.1f}ms{tf:>15.1f}ms{ts:>17.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
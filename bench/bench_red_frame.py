@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : bench_red_frame.py
+@Description: 红框检测基准：旧实现 (全分辨率 + 只接受 4 点) vs 缩图粗定位 + 全分辨率直线精修
+@Logic      :
+    1. 用 ref_imgs/ 下的样图合成 3000x1824 "生成图"：浅色背景 + 随机透视的红框 (外边缘即真值角点) + 框内卡片内容，
+       按比例加入切角 (模拟圆角 / 缺角，approxPolyDP 会得到 5~8 点)，再按 q90 JPEG 编解码一次。
+       也可以用 --dir 指向真实的 Seedream 生成图 (无真值，只统计检出率与耗时)。
+    2. 每种实现统计：检出率、角点误差 (4 个角点中的最大偏差，像素)、单张耗时中位数 (ms)。
+    3. 检出失败在线上意味着走 ResNet 兜底 (占 GPU 名额)，所以检出率和耗时同样重要。
+@Usage      :
+    python bench/bench_red_frame.py [--samples 40] [--chamfer 0.3] [--dir 真实生成图目录]
+"""
+
+import os
+import sys
+import glob
+import time
+import random
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from red_frame import detect_red_frame, order_points  # noqa: E402
+
+W, H = 3000, 1824
+
+
+def legacy_detect(img_cv):
+    """旧实现 (改造前的 red_frame_crop)：全分辨率掩膜，approxPolyDP 不是 4 点就放弃"""
+    hsv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2HSV)
+    mask = cv2.bitwise_or(cv2.inRange(hsv, np.array([0, 70, 50]), np.array([10, 255, 255])),
+                          cv2.inRange(hsv, np.array([170, 70, 50]), np.array([180, 255, 255])))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours: return None
+    c = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(c) < 2000: return None
+    approx = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
+    return order_points(approx.reshape(4, 2).astype(np.float32)) if len(approx) == 4 else None
+
+
+def _shrink(quad, d):
+    """四边形各边向内平移 d 像素 (近似：朝中心缩放)"""
+    c = quad.mean(axis=0)
+    return c + (quad - c) * (1 - d / np.linalg.norm(quad - c, axis=1, keepdims=True))
+
+
+def synth_sample(card, rng: random.Random, chamfer: bool):
+    bg = rng.randint(225, 250)
+    canvas = np.full((H, W, 3), bg, dtype=np.uint8)
+    j = lambda v: v + rng.uniform(-120, 120)
+    outer = np.array([[j(250), j(200)], [j(W - 250), j(200)], [j(W - 250), j(H - 200)], [j(250), j(H - 200)]], dtype=np.float32)
+    stroke = rng.uniform(8, 26)
+    red = (rng.randint(0, 40), rng.randint(0, 40), rng.randint(200, 255))
+    cv2.fillConvexPoly(canvas, np.round(outer).astype(np.int32), red, cv2.LINE_AA)
+    inner = _shrink(outer, stroke).astype(np.float32)
+    ch, cw = card.shape[:2]
+    src = np.array([[0, 0], [cw - 1, 0], [cw - 1, ch - 1], [0, ch - 1]], dtype=np.float32)
+    M = cv2.getPerspectiveTransform(src, inner)
+    warped = cv2.warpPerspective(card, M, (W, H))
+    mask = cv2.warpPerspective(np.full((ch, cw), 255, np.uint8), M, (W, H))
+    canvas[mask > 0] = warped[mask > 0]
+    if chamfer:
+        # 1~2 个角做成切角 (框线宽度不变)，approxPolyDP 会得到 5~6 个点；真值仍是两条边延长线的交点
+        for i in rng.sample(range(4), rng.randint(1, 2)):
+            p, a, b = outer[i], outer[(i + 1) % 4], outer[i - 1]
+            k = rng.uniform(60, 150)
+            pa = p + (a - p) / np.linalg.norm(a - p) * k
+            pb = p + (b - p) / np.linalg.norm(b - p) * k
+            cv2.fillConvexPoly(canvas, np.round(np.array([p, pa, pb])).astype(np.int32), (bg, bg, bg))
+            inward = (outer.mean(axis=0) - p) / np.linalg.norm(outer.mean(axis=0) - p) * stroke / 2
+            cv2.line(canvas, tuple(np.round(pa + inward).astype(int)), tuple(np.round(pb + inward).astype(int)),
+                     red, int(round(stroke)), cv2.LINE_AA)
+    ok, buf = cv2.imencode(".jpg", canvas, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR), order_points(outer)
+
+
+def _median_ms(fn, img, repeat):
+    costs, out = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(img)
+        costs.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(costs), out
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="红框检测基准")
+    parser.add_argument("--refs", default=os.path.join(root, "ref_imgs"), help="合成样本用的卡片图")
+    parser.add_argument("--dir", default="", help="真实生成图目录 (无真值)")
+    parser.add_argument("--samples", type=int, default=40)
+    parser.add_argument("--chamfer", type=float, default=0.3, help="带切角样本的比例")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    samples = []
+    if args.dir:
+        for p in sorted(glob.glob(os.path.join(args.dir, "*.jpg")) + glob.glob(os.path.join(args.dir, "*.png"))):
+            img = cv2.imdecode(np.fromfile(p, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is not None: samples.append((img, None))
+    else:
+        cards = [cv2.imread(p) for p in sorted(glob.glob(os.path.join(args.refs, "*.png")))]
+        cards = [c for c in cards if c is not None]
+        if not cards:
+            print(f"❌ 没有找到样图: {args.refs}")
+            return
+        for i in range(args.samples):
+            samples.append(synth_sample(cards[i % len(cards)], rng, rng.random() < args.chamfer))
+
+    impls = [
+        ("旧实现(全分辨率)", legacy_detect),
+        ("缩图粗定位", lambda im: detect_red_frame(im, refine=False)),
+        ("缩图+直线精修", detect_red_frame),
+    ]
+    print(f"📂 样本 {len(samples)} 张 ({'真实生成图' if args.dir else f'合成, 切角比例 {args.chamfer}'}) | 每张重复 {args.repeat} 次\n")
+    print(f"{'实现':<18}{'检出率':>10}{'耗时中位数':>14}{'角点误差均值':>16}{'角点误差最大':>16}")
+    print("-" * 76)
+    for name, fn in impls:
+        found, costs, errs = 0, [], []
+        for img, truth in samples:
+            ms, pts = _median_ms(fn, img, args.repeat)
+            costs.append(ms)
+            if pts is None: continue
+            found += 1
+            if truth is not None:
+                errs.append(float(np.max(np.linalg.norm(pts - truth, axis=1))))
+        err_mean = f"{statistics.mean(errs):.2f}px" if errs else "-"
+        err_max = f"{max(errs):.2f}px" if errs else "-"
+        print(f"{name:<18}{found / len(samples):>9.0%}{statistics.median(costs):>12.1f}ms{err_mean:>16}{err_max:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : eval_input_profiles.py
+@Description: 生图输入档位评估：主图缩放 / 质量 / 格式 对 体积、编码耗时、请求延迟、输出保真度的影响
+@Logic      :
+    1. 离线部分 (默认)：把样图当作 3000x1824 的矫正图，按每个档位 (strategies.json 的 input_profiles + 内置档位)
+       编码成 data URI，统计：
+       - payload: data URI 字节数 (即每个策略发给 Ark 的主图体积) 与相对 full 的比例
+       - encode : 缩放 + 编码 + Base64 耗时
+       - upload : 按 --uplink-mbps 估算的发送耗时
+       - 输入保真度: 解码后放大回 3000x1824，与原图比 PSNR / SSIM (灰度)
+    2. 在线部分 (--ark-base-url)：每个档位对每张样图真实调用一次 images/generations，记录请求延迟；
+       下载生成图，与同一张样图 full 档位的生成图比 SSIM (输出保真度)。生图本身有随机性，
+       full 自己重复一次得到的 SSIM 就是噪声底线 (--repeat-full)，其他档位和它比才有意义。
+       也可以指向 bench/fake_ark_server.py 只看延迟 / 体积链路。
+@Usage      :
+    python bench/eval_input_profiles.py --dir ref_imgs --uplink-mbps 50
+    RESTORE_VOLC_API_KEY=xxx python bench/eval_input_profiles.py --ark-base-url https://ark.cn-beijing.volces.com/api/v3 \\
+        --profiles full,2k_q90,2k_webp --limit 3 --out profiles.json
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import base64
+import argparse
+import statistics
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_handle import ImageHandle  # noqa: E402
+from strategies import StrategyRegistry, InputProfile, DEFAULT_INPUT_PROFILE  # noqa: E402
+
+CORRECTED_SIZE = (3000, 1824)
+DEFAULT_PROMPT = "参考输入图片，还原为一张干净的平面名片设计稿：保持原有排版、文字与配色，去除反光、阴影与纹理。"
+
+
+def ssim_gray(a: np.ndarray, b: np.ndarray) -> float:
+    """灰度 SSIM (高斯窗 11x11, sigma 1.5)，两图需同尺寸"""
+    a = cv2.cvtColor(a, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a, var_b, cov = blur(a * a) - mu_a ** 2, blur(b * b) - mu_b ** 2, blur(a * b) - mu_a * mu_b
+    s = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(s.mean())
+
+
+def encode_profile(img: np.ndarray, profile: InputProfile) -> Dict:
+    t0 = time.perf_counter()
+    data, mime = ImageHandle.from_bgr(img).encode_as(profile.max_side, profile.quality, profile.format)
+    uri = f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+    cost = time.perf_counter() - t0
+    decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    h, w = decoded.shape[:2]
+    restored = decoded if (w, h) == CORRECTED_SIZE else cv2.resize(decoded, CORRECTED_SIZE, interpolation=cv2.INTER_CUBIC)
+    return {"uri": uri, "encode_s": cost, "size": (w, h),
+            "psnr": float(cv2.PSNR(img, restored)), "ssim": ssim_gray(img, restored)}
+
+
+def load_samples(folder: str, limit: int) -> List[tuple]:
+    paths = sorted(glob.glob(os.path.join(folder, "*.png")) + glob.glob(os.path.join(folder, "*.jpg")))
+    out = []
+    for p in paths[:limit or None]:
+        img = cv2.imdecode(np.fromfile(p, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None: continue
+        if (img.shape[1], img.shape[0]) != CORRECTED_SIZE:
+            img = cv2.resize(img, CORRECTED_SIZE, interpolation=cv2.INTER_CUBIC)
+        # 与线上一致：矫正图先经过一次 q95 JPEG
+        img = cv2.imdecode(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 95])[1], cv2.IMREAD_COLOR)
+        out.append((os.path.basename(p), img))
+    return out
+
+
+class ArkProbe:
+    """直接调 images/generations (与 ark_async.py 请求体一致)，记录延迟并下载生成图"""
+
+    def __init__(self, base_url: str, api_key: str, model: str, size: str, timeout: float):
+        import httpx
+        self.client = httpx.Client(timeout=timeout, headers={"Authorization": f"Bearer {api_key}"})
+        self.url = f"{base_url.rstrip('/')}/images/generations"
+        self.model, self.size = model, size
+
+    def generate(self, prompt: str, image_uri: str) -> tuple:
+        body = {"model": self.model, "prompt": prompt, "image": [image_uri], "size": self.size,
+                "response_format": "url", "watermark": False}
+        t0 = time.perf_counter()
+        resp = self.client.post(self.url, json=body)
+        latency = time.perf_counter() - t0
+        resp.raise_for_status()
+        gen_url = resp.json()["data"][0]["url"]
+        img = cv2.imdecode(np.frombuffer(self.client.get(gen_url).content, np.uint8), cv2.IMREAD_COLOR)
+        if img is not None and (img.shape[1], img.shape[0]) != CORRECTED_SIZE:
+            img = cv2.resize(img, CORRECTED_SIZE, interpolation=cv2.INTER_AREA)
+        return latency, img
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="生图输入档位评估")
+    parser.add_argument("--dir", default=os.path.join(root, "ref_imgs"), help="样图目录 (当作矫正图)")
+    parser.add_argument("--strategy-config", default=os.path.join(root, "strategies.json"))
+    parser.add_argument("--profiles", default="", help="只评估这些档位，逗号分隔 (默认全部)")
+    parser.add_argument("--limit", type=int, default=0, help="最多用几张样图 (0 = 全部)")
+    parser.add_argument("--uplink-mbps", type=float, default=50.0, help="估算发送耗时用的出口带宽")
+    parser.add_argument("--ark-base-url", default="", help="非空时真实调用生图接口 (可指向 fake_ark_server)")
+    parser.add_argument("--api-key", default=os.environ.get("RESTORE_VOLC_API_KEY", ""))
+    parser.add_argument("--model", default="doubao-seedream-4-5-251128")
+    parser.add_argument("--size", default="3000x1824")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--repeat-full", action="store_true", help="full 档位额外再生成一次，作为输出 SSIM 的噪声底线")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--out", default="", help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    registry = StrategyRegistry.load(args.strategy_config)
+    names = [n.strip() for n in args.profiles.split(",") if n.strip()] or list(registry.profiles)
+    unknown = [n for n in names if n not in registry.profiles]
+    if unknown:
+        print(f"❌ 未知档位: {unknown}. 可选: {list(registry.profiles)}")
+        return
+    if DEFAULT_INPUT_PROFILE not in names: names.insert(0, DEFAULT_INPUT_PROFILE)
+    profiles = [registry.profiles[n] for n in names]
+
+    samples = load_samples(args.dir, args.limit)
+    if not samples:
+        print(f"❌ 没有找到样图: {args.dir}")
+        return
+    probe = ArkProbe(args.ark_base_url, args.api_key, args.model, args.size, args.timeout) if args.ark_base_url else None
+    print(f"📂 样图 {len(samples)} 张 | 档位 {names} | 出口带宽 {args.uplink_mbps} Mbps"
+          f"{' | 在线生图: ' + args.ark_base_url if probe else ''}\n")
+
+    rows: Dict[str, Dict[str, List[float]]] = {p.name: {} for p in profiles}
+    add = lambda name, key, v: rows[name].setdefault(key, []).append(v)
+    for fname, img in samples:
+        full_out: Optional[np.ndarray] = None
+        for p in profiles:
+            enc = encode_profile(img, p)
+            add(p.name, "payload_kb", len(enc["uri"]) / 1024)
+            add(p.name, "encode_ms", enc["encode_s"] * 1000)
+            add(p.name, "upload_s", len(enc["uri"]) * 8 / (args.uplink_mbps * 1e6))
+            add(p.name, "psnr", enc["psnr"])
+            add(p.name, "ssim_in", enc["ssim"])
+            if probe is None: continue
+            try:
+                latency, out = probe.generate(args.prompt, enc["uri"])
+            except Exception as e:
+                print(f"   ❌ {fname} [{p.name}] 生图失败: {e}")
+                continue
+            add(p.name, "gen_s", latency)
+            if out is None: continue
+            if p.name == DEFAULT_INPUT_PROFILE:
+                full_out = out
+                if args.repeat_full:
+                    try:
+                        latency2, out2 = probe.generate(args.prompt, enc["uri"])
+                        add(p.name, "gen_s", latency2)
+                        if out2 is not None: add(p.name, "ssim_out", ssim_gray(full_out, out2))
+                    except Exception as e:
+                        print(f"   ❌ {fname} [full 重复] 生图失败: {e}")
+            elif full_out is not None:
+                add(p.name, "ssim_out", ssim_gray(full_out, out))
+        print(f"   ✅ {fname}")
+
+    mean = lambda v: statistics.mean(v) if v else None
+    base_kb = mean(rows[DEFAULT_INPUT_PROFILE]["payload_kb"])
+    summary = []
+    for p in profiles:
+        r = rows[p.name]
+        summary.append({"profile": p.name, "max_side": p.max_side, "quality": p.quality, "format": p.format,
+                        **{k: round(mean(v), 4) for k, v in r.items() if v}, "n": len(r.get("payload_kb", []))})
+
+    col = lambda v, spec, unit="": f"{format(v, spec)}{unit}" if v is not None else "-"
+    print(f"\n{'档位':<12}{'主图体积':>10}{'相对full':>9}{'编码':>9}{'发送估算':>9}{'PSNR':>8}{'SSIM入':>8}{'生图延迟':>9}{'SSIM出':>8}")
+    print("-" * 90)
+    for row in summary:
+        print(f"{row['profile']:<12}{row['payload_kb']:>8.0f}KB{row['payload_kb'] / base_kb:>9.0%}"
+              f"{row['encode_ms']:>7.0f}ms{row['upload_s']:>8.2f}s{row['psnr']:>8.2f}{row['ssim_in']:>8.4f}"
+              f"{col(row.get('gen_s'), '.1f', 's'):>9}{col(row.get('ssim_out'), '.4f'):>8}")
+    if probe is not None:
+        print("\n注: SSIM出 = 与同一张样图 full 档位生成图的相似度；full 行 (--repeat-full) 是生图随机性的噪声底线。")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 结果已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
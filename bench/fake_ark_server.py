@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : fake_ark_server.py
+@Description: 本地替身方舟 (Ark) 服务，用于离线压测 api.py
+@Logic      :
+    1. 实现 api.py (ark_async.py) 用到的两个接口，返回格式与线上一致：
+       - POST /api/v3/chat/completions   : 背景检测 Prompt 返回 {"is_solid", "hex_color"} JSON，其余返回一段布局描述
+       - POST /api/v3/images/generations : 返回 {"data": [{"url": 替身图床上的生成图}]}
+    2. 延迟按分布采样，生图 / 视觉分别配置：
+       - const:20            固定 20s
+       - uniform:15,30       均匀分布
+       - lognormal:20,0.3    中位数 20s、对数标准差 0.3 (长尾，最接近线上)
+    3. 容量模拟：在途请求超过 --gen-capacity / --vision-capacity 时直接返回 429 (0 = 不限)，
+       另可按比例注入 429 / 500，用来验证 adaptive_limiter 的降并发与恢复。
+    4. GET /stats 查看各接口的请求数、在途峰值、429 / 500 次数。
+@Usage      :
+    python bench/fake_ark_server.py --port 6100 --image-host http://127.0.0.1:6300 \\
+        --gen-latency lognormal:20,0.3 --vision-latency lognormal:3,0.3 --gen-capacity 40
+    RESTORE_VOLC_BASE_URL=http://127.0.0.1:6100/api/v3 python api.py
+"""
+
+import json
+import math
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Callable, Dict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake Ark Server")
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """const:x / uniform:a,b / lognormal:median,sigma -> 采样函数 (秒)"""
+    kind, _, args = spec.partition(":")
+    vals = [float(v) for v in args.split(",") if v.strip()] if args else []
+    if kind == "const":
+        return lambda: vals[0]
+    if kind == "uniform":
+        return lambda: random.uniform(vals[0], vals[1])
+    if kind == "lognormal":
+        mu = math.log(max(vals[0], 1e-6))
+        return lambda: random.lognormvariate(mu, vals[1])
+    raise ValueError(f"不支持的延迟分布: {spec} (const:x / uniform:a,b / lognormal:median,sigma)")
+
+
+class _Endpoint:
+    def __init__(self, latency: str, capacity: int, throttle_rate: float, error_rate: float):
+        self.sample = parse_latency(latency)
+        self.capacity = capacity
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.inflight = 0
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0, "peak_inflight": 0}
+
+    async def serve(self, make_body: Callable[[], Dict]) -> JSONResponse:
+        self.stats["requests"] += 1
+        if (self.capacity and self.inflight >= self.capacity) or random.random() < self.throttle_rate:
+            self.stats["throttled"] += 1
+            return _error(429, "RateLimitExceeded", "Too many requests")
+        self.inflight += 1
+        self.stats["peak_inflight"] = max(self.stats["peak_inflight"], self.inflight)
+        try:
+            await asyncio.sleep(max(0.0, self.sample()))
+            if random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return _error(500, "InternalServiceError", "injected error")
+            self.stats["ok"] += 1
+            return JSONResponse(make_body())
+        finally:
+            self.inflight -= 1
+
+
+def _error(status: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse({"error": {"code": code, "message": message}}, status_code=status,
+                        headers={"x-request-id": uuid.uuid4().hex})
+
+
+ENDPOINTS: Dict[str, _Endpoint] = {}
+IMAGE_HOST = "http://127.0.0.1:6300"
+
+LAYOUT_TEXT = "背景：白色纯色。填充：无。色块：左侧竖条。排版：左对齐三行。图标：右上角 logo。干扰：无。风格：简约商务。"
+
+
+@app.post("/api/v3/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    text = json.dumps(body.get("messages", []), ensure_ascii=False)
+    if "is_solid" in text:
+        content = json.dumps({"is_solid": True, "hex_color": "#FFFFFF"})
+    else:
+        content = LAYOUT_TEXT
+    return await ENDPOINTS["vision"].serve(lambda: {
+        "id": uuid.uuid4().hex, "model": body.get("model", ""),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    })
+
+
+@app.post("/api/v3/images/generations")
+async def images_generations(request: Request):
+    body = await request.json()
+    return await ENDPOINTS["gen"].serve(lambda: {
+        "model": body.get("model", ""),
+        "data": [{"url": f"{IMAGE_HOST}/gen/{uuid.uuid4().hex}.jpg", "size": body.get("size", "")}],
+    })
+
+
+@app.get("/stats")
+async def stats():
+    return {name: {**ep.stats, "inflight": ep.inflight} for name, ep in ENDPOINTS.items()}
+
+
+def main():
+    global IMAGE_HOST
+    parser = argparse.ArgumentParser(description="本地替身方舟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6100)
+    parser.add_argument("--image-host", default=IMAGE_HOST, help="生成图 URL 指向的替身图床 (bench/fake_image_host.py)")
+    parser.add_argument("--gen-latency", default="lognormal:20,0.3")
+    parser.add_argument("--vision-latency", default="lognormal:3,0.3")
+    parser.add_argument("--gen-capacity", type=int, default=0, help="生图在途上限，超出返回 429 (0=不限)")
+    parser.add_argument("--vision-capacity", type=int, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="随机返回 429 的比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 500 的比例")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None: random.seed(args.seed)
+    IMAGE_HOST = args.image_host.rstrip("/")
+    ENDPOINTS["gen"] = _Endpoint(args.gen_latency, args.gen_capacity, args.throttle_rate, args.error_rate)
+    ENDPOINTS["vision"] = _Endpoint(args.vision_latency, args.vision_capacity, args.throttle_rate, args.error_rate)
+    print(f"🚀 Fake Ark server: http://{args.host}:{args.port}/api/v3 | 生图 {args.gen_latency} | 视觉 {args.vision_latency}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : fake_image_host.py
+@Description: 本地替身图床：提供压测用的输入原图 (/restore_batch_url 的 URL) 与替身 Ark 返回的生成图
+@Logic      :
+    1. GET /src/{i}.jpg       : 输入原图 (启动时从 --dir 读样图并编码为 JPEG，全部预编码在内存里)
+       带 ?nonce=xxx 时在 JPEG 结束标记后追加 nonce 字节：解码结果不变，但内容哈希不同，
+       用来绕过 api.py 的结果缓存，模拟"每张都是新图"。
+    2. GET /gen/{name}.jpg    : 生成图 (FIXED_GEN_SIZE 3000x1824，白底 + 红框 + 样图内容)，
+       红框让 "内容锁定 / 参考图" 策略走真实的红框裁切路径。按 name 哈希取预渲染的变体。
+    3. GET /list              : 输入原图 URL 列表，供 loadgen.py 使用
+    4. 可选 --latency 模拟图床下载延迟 (分布格式同 fake_ark_server.py)
+@Usage      :
+    python bench/fake_image_host.py --port 6300 --dir ref_imgs
+"""
+
+import os
+import sys
+import glob
+import zlib
+import asyncio
+import argparse
+from typing import List
+
+import cv2
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ark_server import parse_latency  # noqa: E402
+
+app = FastAPI(title="Fake Image Host")
+
+GEN_SIZE = (3000, 1824)
+SOURCES: List[bytes] = []
+GENERATED: List[bytes] = []
+LATENCY = None
+_stats = {"src": {"count": 0, "bytes": 0}, "gen": {"count": 0, "bytes": 0}}
+
+
+def _encode(img: np.ndarray, quality: int = 92) -> bytes:
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok: raise RuntimeError("JPEG 编码失败")
+    return buf.tobytes()
+
+
+def _render_generated(card: np.ndarray) -> np.ndarray:
+    """白底画布中间放一张 (轻微透视的) 卡片，外围画红框，模拟带红框的生成图"""
+    w, h = GEN_SIZE
+    canvas = np.full((h, w, 3), 245, dtype=np.uint8)
+    quad = np.array([[260, 200], [w - 300, 240], [w - 260, h - 220], [300, h - 180]], dtype=np.float32)
+    ch, cw = card.shape[:2]
+    src = np.array([[0, 0], [cw - 1, 0], [cw - 1, ch - 1], [0, ch - 1]], dtype=np.float32)
+    warped = cv2.warpPerspective(card, cv2.getPerspectiveTransform(src, quad), (w, h))
+    mask = cv2.warpPerspective(np.full((ch, cw), 255, np.uint8), cv2.getPerspectiveTransform(src, quad), (w, h))
+    canvas[mask > 0] = warped[mask > 0]
+    cv2.polylines(canvas, [quad.astype(np.int32)], True, (0, 0, 230), 18)
+    return canvas
+
+
+def load_assets(folder: str):
+    paths = sorted(glob.glob(os.path.join(folder, "*.png")) + glob.glob(os.path.join(folder, "*.jpg")))
+    for p in paths:
+        img = cv2.imread(p, cv2.IMREAD_COLOR)
+        if img is None: continue
+        SOURCES.append(_encode(img))
+        GENERATED.append(_encode(_render_generated(img)))
+    if not SOURCES:
+        raise SystemExit(f"❌ 没有找到样图: {folder}")
+
+
+async def _delay():
+    if LATENCY is not None:
+        await asyncio.sleep(max(0.0, LATENCY()))
+
+
+def _record(kind: str, n: int):
+    _stats[kind]["count"] += 1
+    _stats[kind]["bytes"] += n
+
+
+@app.get("/src/{name}")
+async def get_source(name: str, nonce: str = ""):
+    try: idx = int(os.path.splitext(name)[0]) % len(SOURCES)
+    except ValueError: raise HTTPException(404, "not found")
+    await _delay()
+    data = SOURCES[idx] + (f"nonce:{nonce}".encode("utf-8") if nonce else b"")
+    _record("src", len(data))
+    return Response(data, media_type="image/jpeg")
+
+
+@app.get("/gen/{name}")
+async def get_generated(name: str):
+    await _delay()
+    data = GENERATED[zlib.crc32(name.encode("utf-8")) % len(GENERATED)]
+    _record("gen", len(data))
+    return Response(data, media_type="image/jpeg")
+
+
+@app.get("/list")
+async def list_sources(request: Request):
+    base = str(request.base_url).rstrip("/")
+    return {"urls": [f"{base}/src/{i}.jpg" for i in range(len(SOURCES))]}
+
+
+@app.get("/stats")
+async def stats():
+    return {k: dict(v) for k, v in _stats.items()}
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser(description="本地替身图床")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6300)
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ref_imgs"))
+    parser.add_argument("--latency", default="", help="下载延迟分布，如 lognormal:0.3,0.5 (默认无延迟)")
+    args = parser.parse_args()
+
+    if args.latency: LATENCY = parse_latency(args.latency)
+    load_assets(args.dir)
+    print(f"🚀 Fake image host: http://{args.host}:{args.port} | 原图 {len(SOURCES)} 张 | 生成图 {GEN_SIZE[0]}x{GEN_SIZE[1]}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : fake_upload_server.py
+@Description: 本地替身上传服务 (模拟 CDN commonUpload 接口)，用于测试 / 压测上传链路
+@Logic      :
+    1. POST /common/commonUpload 同时支持三种请求体 (与 uploader.py 的 transport 对应)：
+       - application/json      : {"base64Str": "data:image/jpeg;base64,..."}
+       - multipart/form-data   : 字段 file
+       - image/* 等其他类型    : 请求体即图片字节
+    2. 返回格式与线上一致：{"success": true, "userData": "相对路径"}
+    3. GET /assets/resource/imgs/normal/{name} 返回已上传的图片 (即 IMG_URL_PREFIX)
+    4. GET /stats 查看各方式的请求数与线上字节数 (用于对比 base64 与二进制的流量)
+@Usage      :
+    python bench/fake_upload_server.py --port 6200
+    RESTORE_UPLOAD_API_URL=http://127.0.0.1:6200/common/commonUpload \\
+    RESTORE_IMG_URL_PREFIX=http://127.0.0.1:6200/assets/resource/imgs/normal/ \\
+    RESTORE_UPLOAD_TRANSPORT=multipart python api.py
+"""
+
+import os
+import uuid
+import base64
+import argparse
+import tempfile
+import threading
+
+import uvicorn
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import FileResponse
+
+app = FastAPI(title="Fake Upload Server")
+
+STORE_DIR = os.path.join(tempfile.gettempdir(), "fake_upload_store")
+_stats_lock = threading.Lock()
+_stats = {"base64": {"count": 0, "wire_bytes": 0}, "multipart": {"count": 0, "wire_bytes": 0},
+          "binary": {"count": 0, "wire_bytes": 0}}
+
+
+def _save(data: bytes) -> str:
+    os.makedirs(STORE_DIR, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.jpg"
+    with open(os.path.join(STORE_DIR, name), "wb") as f:
+        f.write(data)
+    return name
+
+
+def _record(kind: str, wire_bytes: int):
+    with _stats_lock:
+        _stats[kind]["count"] += 1
+        _stats[kind]["wire_bytes"] += wire_bytes
+
+
+@app.post("/common/commonUpload")
+async def common_upload(request: Request):
+    ctype = request.headers.get("content-type", "")
+    wire_bytes = int(request.headers.get("content-length", 0) or 0)
+    try:
+        if ctype.startswith("application/json"):
+            payload = await request.json()
+            b64 = payload.get("base64Str", "")
+            data = base64.b64decode(b64.split(",", 1)[-1])
+            kind = "base64"
+        elif ctype.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None: return {"success": False, "message": "缺少 file 字段"}
+            data = await upload.read()
+            kind = "multipart"
+        else:
+            data = await request.body()
+            kind = "binary"
+    except Exception as e:
+        return {"success": False, "message": f"请求解析失败: {e}"}
+
+    if not data: return {"success": False, "message": "空文件"}
+    _record(kind, wire_bytes or len(data))
+    return {"success": True, "userData": _save(data)}
+
+
+@app.get("/assets/resource/imgs/normal/{name}")
+async def get_asset(name: str):
+    path = os.path.join(STORE_DIR, os.path.basename(name))
+    if not os.path.exists(path): raise HTTPException(404, "not found")
+    return FileResponse(path, media_type="image/jpeg")
+
+
+@app.get("/stats")
+async def stats():
+    with _stats_lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+
+def main():
+    global STORE_DIR
+    parser = argparse.ArgumentParser(description="本地替身上传服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6200)
+    parser.add_argument("--store", default=STORE_DIR, help="上传文件保存目录")
+    args = parser.parse_args()
+
+    STORE_DIR = args.store
+    os.makedirs(STORE_DIR, exist_ok=True)
+    print(f"🚀 Fake upload server: http://{args.host}:{args.port}/common/commonUpload  (store={STORE_DIR})")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
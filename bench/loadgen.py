@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : loadgen.py
+@Description: api.py 压测负载生成器 (固定 RPS 开环压测)
+@Logic      :
+    1. 按固定速率 (--rps) 发请求，不等上一个返回 (开环)：服务变慢时请求会堆积，暴露真实的排队延迟。
+       每个请求带 --batch 张图，打 /restore_batch_url (图片来自替身图床) 或 /restore_batch_file。
+    2. 默认给每张图加随机 nonce (URL 参数 / 文件尾部字节)，绕过结果缓存；--no-unique 测缓存命中路径。
+    3. 请求头带 X-Trace: 1，汇总返回的单图 trace 得到分阶段耗时 (含各资源池排队 wait:*)；
+       同时在压测前后各抓一次 /metrics，输出各资源池排队 / 占用时间的均值。
+    4. 报告：吞吐 (请求/秒、图/秒)、请求延迟 p50 / p95 / p99、成功率、分阶段耗时，可选写 JSON (--out)。
+@Usage      :
+    # 1. 替身服务
+    python bench/fake_image_host.py --port 6300
+    python bench/fake_ark_server.py --port 6100 --image-host http://127.0.0.1:6300 --gen-capacity 40
+    python bench/fake_upload_server.py --port 6200
+    # 2. 指向替身服务启动 api.py
+    RESTORE_VOLC_BASE_URL=http://127.0.0.1:6100/api/v3 \\
+    RESTORE_UPLOAD_API_URL=http://127.0.0.1:6200/common/commonUpload \\
+    RESTORE_IMG_URL_PREFIX=http://127.0.0.1:6200/assets/resource/imgs/normal/ \\
+    RESTORE_REF_LOCAL_DIR=ref_imgs python api.py
+    # 3. 压测
+    python bench/loadgen.py --mode url --rps 0.5 --duration 120 --batch 1
+"""
+
+import os
+import json
+import time
+import uuid
+import glob
+import random
+import asyncio
+import argparse
+import statistics
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values: return None
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """Prometheus 文本 -> {"name{labels}": value} (只取 _sum / _count 样本)"""
+    out = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"): continue
+        name, _, value = line.rpartition(" ")
+        if "_sum{" in name or "_count{" in name:
+            try: out[name] = float(value)
+            except ValueError: pass
+    return out
+
+
+class LoadGen:
+    def __init__(self, args):
+        self.args = args
+        self.target = args.target.rstrip("/")
+        self.client = httpx.AsyncClient(timeout=args.timeout, limits=httpx.Limits(max_connections=1000))
+        self.records: List[dict] = []
+        self.spans: Dict[str, List[float]] = defaultdict(list)
+        self.src_urls: List[str] = []
+        self.files: List[tuple] = []
+
+    # ---------------- 输入准备 ----------------
+
+    async def prepare(self):
+        if self.args.mode == "url":
+            resp = await self.client.get(f"{self.args.image_host.rstrip('/')}/list")
+            self.src_urls = resp.json()["urls"]
+            if not self.src_urls: raise SystemExit("❌ 替身图床没有原图")
+        else:
+            paths = sorted(glob.glob(os.path.join(self.args.dir, "*.png")) + glob.glob(os.path.join(self.args.dir, "*.jpg")))
+            self.files = [(os.path.basename(p), open(p, "rb").read()) for p in paths]
+            if not self.files: raise SystemExit(f"❌ 没有找到样图: {self.args.dir}")
+
+    def _build_request(self) -> dict:
+        headers = {"X-Trace": "1"}
+        if self.args.priority: headers["X-Priority"] = self.args.priority
+        if self.args.tenant: headers["X-Tenant-Id"] = self.args.tenant
+        n = self.args.batch
+        if self.args.mode == "url":
+            urls = []
+            for _ in range(n):
+                u = random.choice(self.src_urls)
+                urls.append(f"{u}?nonce={uuid.uuid4().hex}" if self.args.unique else u)
+            body = {"urls": urls}
+            if self.args.strategies: body["strategies"] = self.args.strategies.split(",")
+            return {"url": f"{self.target}/restore_batch_url", "json": body, "headers": headers}
+        files = []
+        for _ in range(n):
+            name, data = random.choice(self.files)
+            if self.args.unique: data = data + uuid.uuid4().bytes
+            files.append(("files", (name, data, "image/jpeg")))
+        data = {"strategies": self.args.strategies} if self.args.strategies else None
+        return {"url": f"{self.target}/restore_batch_file", "files": files, "data": data, "headers": headers}
+
+    # ---------------- 发压 ----------------
+
+    async def _one(self, seq: int):
+        req = self._build_request()
+        t0 = time.perf_counter()
+        rec = {"seq": seq, "images": self.args.batch, "ok": False, "success_images": 0}
+        try:
+            resp = await self.client.post(**req)
+            rec["status_code"] = resp.status_code
+            if resp.status_code == 200:
+                body = resp.json()
+                results = body.get("results") or body.get("batch_results") or []
+                rec["success_images"] = sum(1 for r in results if r.get("status") == "success")
+                rec["ok"] = True
+                for r in results:
+                    for sp in (r.get("trace") or {}).get("spans", []):
+                        key = sp["stage"] + (f"[{sp['strategy']}]" if self.args.per_strategy and sp.get("strategy") else "")
+                        self.spans[key].append(sp["dur_ms"] / 1000.0)
+        except Exception as e:
+            rec["error"] = f"{type(e).__name__}: {e}"
+        rec["latency_s"] = time.perf_counter() - t0
+        self.records.append(rec)
+
+    async def run(self) -> dict:
+        await self.prepare()
+        before = await self._scrape()
+        interval = 1.0 / self.args.rps
+        total = max(1, int(self.args.duration * self.args.rps))
+        print(f"🚀 {self.args.mode} 模式 | {self.args.rps} req/s x {self.args.duration}s = {total} 个请求 | 每请求 {self.args.batch} 张")
+
+        t_start = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            # 开环：按计划时间发出，不等前一个请求
+            delay = t_start + i * interval - time.perf_counter()
+            if delay > 0: await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._one(i)))
+            if (i + 1) % max(1, int(self.args.rps * 10)) == 0:
+                done = len(self.records)
+                print(f"   ... 已发 {i + 1}/{total}，已完成 {done}")
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t_start
+
+        after = await self._scrape()
+        await self.client.aclose()
+        return self.report(wall, before, after)
+
+    async def _scrape(self) -> Dict[str, float]:
+        try:
+            resp = await self.client.get(f"{self.target}/metrics", timeout=10)
+            return parse_metrics(resp.text) if resp.status_code == 200 else {}
+        except Exception:
+            return {}
+
+    # ---------------- 报告 ----------------
+
+    def report(self, wall: float, before: Dict[str, float], after: Dict[str, float]) -> dict:
+        lat = [r["latency_s"] for r in self.records if r["ok"]]
+        images = sum(r["images"] for r in self.records)
+        ok_images = sum(r["success_images"] for r in self.records)
+        summary = {
+            "mode": self.args.mode, "rps_target": self.args.rps, "duration_s": round(wall, 1),
+            "requests": len(self.records), "requests_ok": len(lat),
+            "images": images, "images_success": ok_images,
+            "throughput_rps": round(len(lat) / wall, 3) if wall else 0,
+            "throughput_img_s": round(ok_images / wall, 3) if wall else 0,
+            "latency_s": {f"p{p}": round(percentile(lat, p), 2) if lat else None for p in (50, 95, 99)},
+            "errors": [r.get("error") or f"HTTP {r.get('status_code')}" for r in self.records if not r["ok"]][:20],
+            "stages": {k: {"n": len(v), "mean_s": round(statistics.mean(v), 3),
+                           "p50_s": round(percentile(v, 50), 3), "p95_s": round(percentile(v, 95), 3)}
+                       for k, v in sorted(self.spans.items())},
+            "pools": self._pool_diff(before, after),
+        }
+        if lat: summary["latency_s"]["max"] = round(max(lat), 2)
+        return summary
+
+    @staticmethod
+    def _pool_diff(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, dict]:
+        """压测期间各资源池的平均排队时间与平均占用时间 (来自 /metrics 的 _sum/_count 差值)"""
+        out: Dict[str, dict] = defaultdict(dict)
+        for metric, field in (("restore_pool_queue_wait_seconds", "wait"), ("restore_pool_service_seconds", "service")):
+            sums: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0.0])
+            for key, v in after.items():
+                if not key.startswith(metric): continue
+                pool = key.split('pool="', 1)[1].split('"', 1)[0]
+                d = v - before.get(key, 0.0)
+                sums[pool][0 if key.startswith(metric + "_sum") else 1] += d
+            for pool, (s, c) in sums.items():
+                if c: out[pool][f"{field}_mean_s"] = round(s / c, 3); out[pool][f"{field}_n"] = int(c)
+        return dict(out)
+
+
+def print_report(r: dict):
+    print("\n" + "=" * 72)
+    print(f"📊 请求 {r['requests']} (成功 {r['requests_ok']}) | 图片 {r['images']} (成功 {r['images_success']}) | 用时 {r['duration_s']}s")
+    print(f"   吞吐: {r['throughput_rps']} req/s | {r['throughput_img_s']} 图/s")
+    lat = r["latency_s"]
+    print(f"   延迟: p50 {lat['p50']}s | p95 {lat['p95']}s | p99 {lat['p99']}s | max {lat.get('max')}s")
+    if r["stages"]:
+        print(f"\n{'阶段':<36}{'次数':>8}{'均值':>10}{'p50':>10}{'p95':>10}")
+        for k, v in r["stages"].items():
+            print(f"{k:<36}{v['n']:>8}{v['mean_s']:>9.2f}s{v['p50_s']:>9.2f}s{v['p95_s']:>9.2f}s")
+    if r["pools"]:
+        print(f"\n{'资源池':<20}{'平均排队':>12}{'平均占用':>12}")
+        for pool, v in sorted(r["pools"].items()):
+            print(f"{pool:<20}{v.get('wait_mean_s', 0):>11.3f}s{v.get('service_mean_s', 0):>11.3f}s")
+    if r["errors"]:
+        print(f"\n❌ 失败示例: {r['errors'][:5]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="api.py 固定 RPS 压测")
+    parser.add_argument("--target", default="http://127.0.0.1:6003")
+    parser.add_argument("--mode", choices=("url", "file"), default="url")
+    parser.add_argument("--rps", type=float, default=0.5, help="每秒请求数")
+    parser.add_argument("--duration", type=float, default=60, help="发压时长 (秒)")
+    parser.add_argument("--batch", type=int, default=1, help="每个请求的图片数")
+    parser.add_argument("--image-host", default="http://127.0.0.1:6300", help="url 模式的替身图床")
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ref_imgs"),
+                        help="file 模式的样图目录")
+    parser.add_argument("--strategies", default="", help="只跑指定策略，逗号分隔")
+    parser.add_argument("--priority", default="", help="X-Priority 请求头 (interactive / bulk)")
+    parser.add_argument("--tenant", default="", help="X-Tenant-Id 请求头")
+    parser.add_argument("--no-unique", dest="unique", action="store_false", help="不加 nonce (测缓存命中)")
+    parser.add_argument("--per-strategy", action="store_true", help="分阶段耗时按策略拆开")
+    parser.add_argument("--timeout", type=float, default=900)
+    parser.add_argument("--out", default="", help="报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadGen(args).run())
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 报告已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
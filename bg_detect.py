@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : bg_detect.py
+@Description: 本地纯色背景检测 (替代 PROMPT_BG_CHECK 远程视觉调用)
+@Logic      :
+    1. 缩到长边 256，取内缩后的边框环带 (名片背景主要体现在四周留白)。
+    2. 转 Lab 空间，求环带中位色；统计与中位色色差 < DELTA_E 的像素占比 (覆盖率)。
+    3. 分别求上/下/左/右四条边的平均色，最大两两色差衡量渐变 (边差)。
+    4. 覆盖率高且边差小 -> 纯色；离判定阈值越远置信度越高。
+       置信度低时由调用方回退远程模型。
+"""
+
+from typing import Dict
+
+import cv2
+import numpy as np
+
+# 判定阈值
+DELTA_E = 12.0          # 单像素视为"同色"的 Lab 色差
+MIN_COVERAGE = 0.88     # 纯色所需的环带同色覆盖率
+MAX_SIDE_SPREAD = 8.0   # 纯色允许的四边平均色最大色差
+
+
+def _bgr_to_hex(bgr) -> str:
+    b, g, r = [int(round(float(v))) for v in bgr]
+    return f"#{r:02X}{g:02X}{b:02X}"
+
+
+def analyze_background(img_bgr: np.ndarray, outer_ratio: float = 0.01, inner_ratio: float = 0.07) -> Dict:
+    """
+    判断背景是否为纯色。
+
+    参数:
+        img_bgr: OpenCV BGR 图 (矫正后的名片，任意尺寸)
+        outer_ratio / inner_ratio: 环带的外/内边距占短边比例 (跳过最外圈残留的拍摄背景)
+
+    返回:
+        {"is_solid": bool, "hex_color": "#RRGGBB" 或 "", "confidence": 0~1,
+         "coverage": 覆盖率, "side_spread": 四边色差}
+    """
+    h, w = img_bgr.shape[:2]
+    scale = 256.0 / max(h, w)
+    if scale < 1:
+        # 用 LINEAR 而不是 AREA：AREA 会把密集花纹平均成"纯色"，LINEAR 只混合邻近像素，纹理得以保留
+        img_bgr = cv2.resize(img_bgr, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_LINEAR)
+        h, w = img_bgr.shape[:2]
+
+    short = min(h, w)
+    o = max(1, int(short * outer_ratio))
+    i = max(o + 2, int(short * inner_ratio))
+
+    lab = cv2.cvtColor(img_bgr.astype(np.float32) / 255.0, cv2.COLOR_BGR2Lab)
+
+    sides = [
+        lab[o:i, o:w - o],           # 上
+        lab[h - i:h - o, o:w - o],   # 下
+        lab[i:h - i, o:i],           # 左
+        lab[i:h - i, w - i:w - o],   # 右
+    ]
+    ring = np.concatenate([s.reshape(-1, 3) for s in sides], axis=0)
+    if ring.size == 0:
+        return {"is_solid": False, "hex_color": "", "confidence": 0.0, "coverage": 0.0, "side_spread": 0.0}
+
+    median = np.median(ring, axis=0)
+    coverage = float(np.mean(np.linalg.norm(ring - median, axis=1) < DELTA_E))
+
+    side_means = np.stack([s.reshape(-1, 3).mean(axis=0) for s in sides])
+    diffs = np.linalg.norm(side_means[:, None, :] - side_means[None, :, :], axis=2)
+    side_spread = float(diffs.max())
+
+    is_solid = coverage >= MIN_COVERAGE and side_spread <= MAX_SIDE_SPREAD
+    if is_solid:
+        margin = min((coverage - MIN_COVERAGE) / (1.0 - MIN_COVERAGE), (MAX_SIDE_SPREAD - side_spread) / MAX_SIDE_SPREAD)
+    else:
+        margin = max((MIN_COVERAGE - coverage) / 0.3, (side_spread - MAX_SIDE_SPREAD) / (2 * MAX_SIDE_SPREAD))
+    confidence = 0.5 + 0.5 * float(np.clip(margin, 0.0, 1.0))
+
+    hex_color = ""
+    if is_solid:
+        # 用 BGR 空间里与中位色接近的像素求均值，作为背景色
+        bgr_ring = np.concatenate([
+            img_bgr[o:i, o:w - o].reshape(-1, 3), img_bgr[h - i:h - o, o:w - o].reshape(-1, 3),
+            img_bgr[i:h - i, o:i].reshape(-1, 3), img_bgr[i:h - i, w - i:w - o].reshape(-1, 3),
+        ], axis=0).astype(np.float32)
+        close = np.linalg.norm(ring - median, axis=1) < DELTA_E
+        hex_color = _bgr_to_hex(bgr_ring[close].mean(axis=0))
+
+    return {
+        "is_solid": bool(is_solid),
+        "hex_color": hex_color,
+        "confidence": round(confidence, 3),
+        "coverage": round(coverage, 3),
+        "side_spread": round(side_spread, 2),
+    }
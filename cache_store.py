@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : cache_store.py
+@Description: 本地持久化缓存 (SQLite) + 并发去重 (single-flight)
+@Logic      :
+    1. SqliteLRUStore: key -> JSON 值，落盘保存，服务重启后仍可命中。
+       - TTL: 超过 ttl_seconds 的条目视为过期 (读时删除 + 写入时定期清理)。
+       - LRU: 条目数超过 max_entries 时按最近访问时间淘汰最旧的。
+    2. SingleFlight: 同一个 key 的并发请求只跑一次计算，其余请求共享结果。
+    3. VisionCache: 视觉模型结果缓存，key = 缩略图感知哈希 (pHash) + 颜色签名 + Prompt 哈希。
+       - pHash 只看灰度结构，同版式不同配色的名片哈希几乎一样；两个 Prompt 都要回答颜色，
+         所以 key 里带上粗量化的颜色签名 (2x2 区块均色)，颜色不同绝不互相命中。
+       - 同 Prompt + 同颜色签名下，汉明距离在阈值内即视为同一张图 (近似重复上传也能命中)。
+       - pHash 存 INTEGER 列，近似扫描只读 (prompt, color, phash) 主键索引，命中后才取 value。
+       - api.py 与 app.py 都用 vision_signature() 对 "矫正图缩到长边 VISION_THUMB_SIDE" 取签名，两边 key 一致。
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import cv2
+import numpy as np
+
+
+class SqliteLRUStore:
+    """SQLite 持久化的 LRU/TTL 键值缓存 (线程安全)"""
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl_seconds: float = 86400,
+                 name: str = "cache"):
+        self.path = path
+        self.max_entries = int(max_entries)
+        self.ttl_seconds = float(ttl_seconds)
+        self.name = name
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)")
+
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created = row
+            if self.ttl_seconds > 0 and now - created > self.ttl_seconds:
+                self._conn.execute("DELETE FROM entries WHERE key=?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_access=? WHERE key=?", (now, key))
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries(key, value, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, now, now)
+            )
+            self._writes += 1
+            # 每 100 次写入做一次 TTL 清理，平时只做 LRU 上限检查
+            if self._writes % 100 == 0:
+                self._purge_expired(now)
+            self._evict_overflow()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key=?", (key,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------------- 内部实现 (调用方已持锁) ----------------
+
+    def _purge_expired(self, now: float):
+        if self.ttl_seconds > 0:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl_seconds,))
+
+    def _evict_overflow(self):
+        if self.max_entries <= 0:
+            return
+        size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        overflow = size - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+
+
+class SingleFlight:
+    """asyncio 版请求合并：同 key 正在计算时，后来者直接等待同一个结果"""
+
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+
+    def is_running(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        # shield: 某个等待者被取消时，不影响其他共享同一计算的等待者
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: "asyncio.Future"):
+        if self._inflight.get(key) is task:
+            self._inflight.pop(key, None)
+
+
+def perceptual_hash(img: np.ndarray) -> int:
+    """
+    64 位 DCT 感知哈希 (pHash)。
+    输入 OpenCV BGR 图或灰度图；缩到 32x32 取 DCT 左上 8x8 低频，与中位数比较得到 64 位。
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # 去掉直流分量再求中位数，避免整体亮度主导
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits.astype(np.uint8)).view(">u8")[0])
+
+
+VISION_THUMB_SIDE = 1024
+_U64 = (1 << 64) - 1
+
+
+def color_signature(img: np.ndarray) -> str:
+    """粗颜色签名：缩到 2x2 取区块均色，每通道量化到 8 级 (近似重复图一致，换配色必变)"""
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    cells = cv2.resize(img, (2, 2), interpolation=cv2.INTER_AREA).reshape(-1)
+    return "".join(str(int(v) >> 5) for v in cells)
+
+
+def vision_signature(img: np.ndarray):
+    """
+    视觉缓存的图像签名 (pHash, 颜色签名)。
+    输入矫正后的 BGR 图 (全尺寸或已缩到长边 VISION_THUMB_SIDE 的缩略图)，先统一缩到同一尺寸再算，保证两个入口 key 一致。
+    """
+    h, w = img.shape[:2]
+    scale = VISION_THUMB_SIDE / float(max(h, w))
+    if scale < 1:
+        img = cv2.resize(img, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))), interpolation=cv2.INTER_AREA)
+    return perceptual_hash(img), color_signature(img)
+
+
+def _to_sqlite_int(phash: int) -> int:
+    """64 位无符号 -> SQLite INTEGER (有符号 64 位)"""
+    return phash - (1 << 64) if phash >= (1 << 63) else phash
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.strip().encode("utf-8")).hexdigest()[:16]
+
+
+class VisionCache:
+    """视觉模型结果的持久化缓存 (SQLite)，按条目数上限做 LRU 淘汰"""
+
+    def __init__(self, path: str, max_entries: int = 20000, max_distance: int = 4, name: str = "vision"):
+        self.path = path
+        self.max_entries = int(max_entries)
+        self.max_distance = int(max_distance)
+        self.name = name
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vision_v2 ("
+            " prompt TEXT NOT NULL,"
+            " color TEXT NOT NULL,"
+            " phash INTEGER NOT NULL,"
+            " value TEXT NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (prompt, color, phash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vision_v2_access ON vision_v2(last_access)")
+        # 旧表 (phash 存十六进制文本、key 不含颜色) 的结果无法确认配色，直接丢弃
+        self._conn.execute("DROP TABLE IF EXISTS vision")
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def get(self, phash: int, color: str, prompt: str) -> Optional[Any]:
+        p_key, h_key = prompt_hash(prompt), _to_sqlite_int(phash)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT phash, value FROM vision_v2 WHERE prompt=? AND color=? AND phash=?", (p_key, color, h_key)
+            ).fetchone()
+            if row is None and self.max_distance > 0:
+                # 近似命中：同一 Prompt + 颜色签名下找汉明距离最小且在阈值内的记录 (只扫主键索引，不读 value)
+                best = None
+                for (cand,) in self._conn.execute(
+                    "SELECT phash FROM vision_v2 WHERE prompt=? AND color=?", (p_key, color)
+                ):
+                    dist = bin((cand ^ h_key) & _U64).count("1")
+                    if dist <= self.max_distance and (best is None or dist < best[0]):
+                        best = (dist, cand)
+                if best is not None:
+                    row = self._conn.execute(
+                        "SELECT phash, value FROM vision_v2 WHERE prompt=? AND color=? AND phash=?", (p_key, color, best[1])
+                    ).fetchone()
+                    if row is not None: self.near_hits += 1
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE vision_v2 SET last_access=? WHERE prompt=? AND color=? AND phash=?",
+                (time.time(), p_key, color, row[0])
+            )
+            self.hits += 1
+        return json.loads(row[1])
+
+    def set(self, phash: int, color: str, prompt: str, value: Any):
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vision_v2(prompt, color, phash, value, last_access) VALUES (?, ?, ?, ?, ?)",
+                (prompt_hash(prompt), color, _to_sqlite_int(phash), data, time.time())
+            )
+            size = self._conn.execute("SELECT COUNT(*) FROM vision_v2").fetchone()[0]
+            overflow = size - self.max_entries
+            if self.max_entries > 0 and overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM vision_v2 WHERE rowid IN (SELECT rowid FROM vision_v2 ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM vision_v2").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : image_handle.py
+@Description: 请求内的图片句柄：解码后的像素与编码后的字节按需生成、各只做一次
+@Logic      :
+    1. ImageHandle 同时持有 "JPEG 字节" 和 "BGR 数组" 两种表示，缺哪个在第一次访问时才生成，之后复用。
+       - .bgr       : 没有数组时解码一次
+       - .data      : 没有字节时编码一次 (直接吃 BGR，不再经 PIL + BGR->RGB)
+       - .data_uri(): Base64 data URI 同样只算一次
+       编解码走 jpeg_codec 的默认后端 (turbojpeg / cv2 / pil)。
+    2. thumbnail(): 还没有全尺寸像素时，用 DCT 域缩放解码 (1/2、1/4、1/8) 直接出小图，不做全尺寸解码。
+       encode_as(): 按 (长边上限, 质量, jpeg / webp) 重新编码，供生图输入档位使用 (见 strategies.InputProfile)。
+    3. 同一请求里的所有句柄共享一个 CodecStats，记录解码/编码/缩放/色彩转换/Base64 次数与耗时，
+       在流程结束时打印，用于核对"每种表示最多转换一次"。
+    4. 句柄会在线程池中被访问，惰性生成加锁，避免两个线程重复解码同一张图。
+    5. 用户上传的原图用 from_source()：解码时保证按 EXIF Orientation 转正 (turbojpeg / pil 后端不会自动转)，
+       exif_orientation 记录原始 Orientation，供 process_image 判断是否跳过方向预检测。
+"""
+
+import time
+import base64
+import threading
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from jpeg_codec import JpegCodec, default_codec, exif_orientation, apply_orientation
+
+DEFAULT_QUALITY = 95
+
+
+class CodecStats:
+    """单个请求的编解码计数器 (线程安全)"""
+
+    KINDS = ("decode", "decode_scaled", "encode", "resize", "cvt_color", "b64")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {k: 0 for k in self.KINDS}
+        self.cost: Dict[str, float] = {k: 0.0 for k in self.KINDS}
+
+    def add(self, kind: str, seconds: float):
+        with self._lock:
+            self.counts[kind] += 1
+            self.cost[kind] += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {"counts": dict(self.counts), "cost_s": {k: round(v, 4) for k, v in self.cost.items()}}
+
+    def summary(self) -> str:
+        with self._lock:
+            return " | ".join(f"{k}:{self.counts[k]}次/{self.cost[k]:.2f}s" for k in self.KINDS)
+
+
+class ImageHandle:
+    """惰性编解码的图片句柄 (bytes <-> BGR ndarray)"""
+
+    def __init__(self, data: Optional[bytes] = None, bgr: Optional[np.ndarray] = None,
+                 stats: Optional[CodecStats] = None, quality: int = DEFAULT_QUALITY,
+                 codec: Optional[JpegCodec] = None, source: bool = False):
+        if data is None and bgr is None:
+            raise ValueError("ImageHandle 至少需要 bytes 或 BGR 数组之一")
+        self._data = data
+        self._bgr = bgr
+        self._uri: Optional[str] = None
+        self._decode_failed = False
+        self.quality = quality
+        self.stats = stats or CodecStats()
+        self.codec = codec or default_codec()
+        self._source = source and data is not None
+        self._orientation: Optional[int] = None
+        self._lock = threading.Lock()
+
+    # ---------------- 构造 ----------------
+
+    @classmethod
+    def from_bytes(cls, data: bytes, stats: Optional[CodecStats] = None) -> "ImageHandle":
+        return cls(data=data, stats=stats)
+
+    @classmethod
+    def from_source(cls, data: bytes, stats: Optional[CodecStats] = None) -> "ImageHandle":
+        """用户上传的原图：解码时按 EXIF Orientation 转正"""
+        return cls(data=data, stats=stats, source=True)
+
+    @classmethod
+    def from_bgr(cls, bgr: np.ndarray, stats: Optional[CodecStats] = None, quality: int = DEFAULT_QUALITY) -> "ImageHandle":
+        return cls(bgr=bgr, stats=stats, quality=quality)
+
+    @classmethod
+    def from_pil(cls, img: Image.Image, stats: Optional[CodecStats] = None, quality: int = DEFAULT_QUALITY) -> "ImageHandle":
+        """process_image 返回的 PIL (RGB) -> BGR 数组；只做一次色彩转换，不经过 JPEG"""
+        t0 = time.time()
+        bgr = cv2.cvtColor(np.asarray(img.convert("RGB")), cv2.COLOR_RGB2BGR)
+        stats = stats or CodecStats()
+        stats.add("cvt_color", time.time() - t0)
+        return cls(bgr=bgr, stats=stats, quality=quality)
+
+    # ---------------- 惰性表示 ----------------
+
+    @property
+    def bgr(self) -> Optional[np.ndarray]:
+        """BGR 像素；解码失败返回 None"""
+        if self._bgr is None and not self._decode_failed:
+            with self._lock:
+                if self._bgr is None and not self._decode_failed:
+                    t0 = time.time()
+                    if self._source:
+                        self._bgr, self._orientation = self.codec.decode_source(self._data)
+                    else:
+                        self._bgr = self.codec.decode(self._data)
+                    self._decode_failed = self._bgr is None
+                    self.stats.add("decode", time.time() - t0)
+        return self._bgr
+
+    @property
+    def exif_orientation(self) -> int:
+        """原图的 EXIF Orientation (1 = 无需旋转)；非原图句柄恒为 1"""
+        if not self._source:
+            return 1
+        if self._orientation is None:
+            self._orientation = exif_orientation(self._data)
+        return self._orientation
+
+    @property
+    def data(self) -> bytes:
+        """JPEG 字节"""
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    t0 = time.time()
+                    self._data = self.codec.encode(self._bgr, self.quality)
+                    self.stats.add("encode", time.time() - t0)
+        return self._data
+
+    def data_uri(self) -> str:
+        """data:image/jpeg;base64,... (视觉 / 生图接口入参)"""
+        if self._uri is None:
+            data = self.data
+            with self._lock:
+                if self._uri is None:
+                    t0 = time.time()
+                    self._uri = f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+                    self.stats.add("b64", time.time() - t0)
+        return self._uri
+
+    def encode_as(self, max_side: int = 0, quality: int = DEFAULT_QUALITY, fmt: str = "jpeg") -> Tuple[bytes, str]:
+        """按长边上限 (0 = 原尺寸) / 质量 / 格式重新编码，返回 (字节, MIME)"""
+        src = self.thumbnail(max_side, quality=quality) if max_side else ImageHandle(bgr=self.bgr, stats=self.stats, quality=quality, codec=self.codec)
+        if src.bgr is None:
+            raise ValueError("图片解码失败")
+        if fmt == "jpeg":
+            return src.data, "image/jpeg"
+        if fmt == "webp":
+            t0 = time.time()
+            ok, buf = cv2.imencode(".webp", src.bgr, [cv2.IMWRITE_WEBP_QUALITY, quality])
+            self.stats.add("encode", time.time() - t0)
+            if not ok: raise ValueError("WebP 编码失败")
+            return buf.tobytes(), "image/webp"
+        raise ValueError(f"不支持的格式: {fmt}")
+
+    # ---------------- 派生 ----------------
+
+    def thumbnail(self, max_side: int, quality: int = 85) -> "ImageHandle":
+        """等比缩到长边 max_side (不放大)，返回共享计数器的新句柄"""
+        img = self._bgr
+        if img is None and self._data is not None and not self._decode_failed:
+            # 还没有全尺寸像素：缩放解码直接出接近目标尺寸的小图，剩下的用 resize 补齐
+            t0 = time.time()
+            img, scale = self.codec.decode_for_max_side(self._data, max_side)
+            if img is not None and self._source and not self.codec.applies_exif:
+                img = apply_orientation(img, self.exif_orientation)
+            self.stats.add("decode_scaled" if scale > 1 else "decode", time.time() - t0)
+            if img is not None and scale == 1:
+                with self._lock:
+                    if self._bgr is None: self._bgr = img
+        if img is None:
+            raise ValueError("图片解码失败")
+        h, w = img.shape[:2]
+        scale = max_side / float(max(h, w))
+        if scale < 1:
+            t0 = time.time()
+            img = cv2.resize(img, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))), interpolation=cv2.INTER_AREA)
+            self.stats.add("resize", time.time() - t0)
+        return ImageHandle(bgr=img, stats=self.stats, quality=quality, codec=self.codec)
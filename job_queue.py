@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : job_queue.py
+@Description: 持久化任务队列 (SQLite)，支撑异步 Job 接口
+@Logic      :
+    1. 一个 Job = N 个子项 (每个子项一张图：URL 或上传的文件内容)。
+    2. Worker 以子项为单位领取 (claim)，领取时写入租约 lease_until 和本次租约的 lease_owner，处理中定期续约。
+       续约 / 写结果都带 lease_owner 校验：租约过期被别的 Worker 重新领走后，旧 Worker 迟到的结果直接丢弃。
+    3. 进程崩溃/重启后，租约过期的子项会被重新领取 -> 断点续跑，已完成的子项不会重跑。
+    4. 子项重试超过 max_attempts 次仍未完成则标记失败，避免毒图无限重试。
+    5. 所有子项结束后 Job 置为 done，由调用方负责触发回调 (webhook)。
+    6. Job 级的处理参数 (如指定策略) 存在 jobs.options (JSON)，claim 时随子项一起返回。
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class JobStore:
+    """SQLite 持久化的任务队列 (线程安全，多进程可共享同一文件)"""
+
+    def __init__(self, path: str, lease_seconds: float = 120, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = float(lease_seconds)
+        self.max_attempts = int(max_attempts)
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._completed: List[str] = []   # claim 过程中因重试耗尽而结束的 Job，等待调用方触发回调
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                callback_url TEXT,
+                callback_status TEXT,
+                options TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_items (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                content BLOB,
+                status TEXT NOT NULL,
+                result TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (job_id, idx)
+            );
+            CREATE INDEX IF NOT EXISTS idx_items_status ON job_items(status, lease_until, created);
+            """
+        )
+        # ✅ [新增] 旧库没有 options 列，补上
+        cols = {r[1] for r in self._conn.execute("PRAGMA table_info(jobs)").fetchall()}
+        if "options" not in cols:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN options TEXT")
+        # ✅ [新增] 旧库没有 lease_owner 列，补上
+        cols = {r[1] for r in self._conn.execute("PRAGMA table_info(job_items)").fetchall()}
+        if "lease_owner" not in cols:
+            self._conn.execute("ALTER TABLE job_items ADD COLUMN lease_owner TEXT NOT NULL DEFAULT ''")
+
+    # ---------------- 入队 ----------------
+
+    def create_job(self, items: List[Dict[str, Any]], callback_url: Optional[str] = None,
+                   options: Optional[Dict[str, Any]] = None) -> str:
+        """
+        items  : [{"source": URL 或文件名, "content": 文件内容(bytes) 或 None}, ...]
+        options: Job 级处理参数 (如 {"strategies": [...]})，claim 时原样返回
+        返回 job_id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs(id, status, total, callback_url, callback_status, options, created, updated)"
+                    " VALUES (?, 'queued', ?, ?, '', ?, ?, ?)",
+                    (job_id, len(items), callback_url or "", json.dumps(options or {}, ensure_ascii=False), now, now)
+                )
+                self._conn.executemany(
+                    "INSERT INTO job_items(job_id, idx, source, content, status, created, updated)"
+                    " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                    [(job_id, i, it["source"], it.get("content"), now, now) for i, it in enumerate(items)]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    # ---------------- Worker 侧 ----------------
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """领取一个待处理子项 (排队中，或处理中但租约已过期的)，没有则返回 None"""
+        exhausted_jobs = set()
+        claimed = None
+        with self._lock:
+            while claimed is None:
+                now = time.time()
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute(
+                        "SELECT job_id, idx, source, content, attempts FROM job_items"
+                        " WHERE status='queued' OR (status='running' AND lease_until < ?)"
+                        " ORDER BY created, idx LIMIT 1",
+                        (now,)
+                    ).fetchone()
+                    if row is None:
+                        self._conn.execute("COMMIT")
+                        break
+                    job_id, idx, source, content, attempts = row
+                    if attempts >= self.max_attempts:
+                        # 多次领取仍未完成 (通常是处理过程中进程崩溃)，直接判失败，继续找下一个
+                        result = json.dumps({"filename": source, "status": "failed", "error_msg": "超过最大重试次数"}, ensure_ascii=False)
+                        self._conn.execute(
+                            "UPDATE job_items SET status='done', result=?, content=NULL, lease_until=0, updated=?"
+                            " WHERE job_id=? AND idx=?",
+                            (result, now, job_id, idx)
+                        )
+                        exhausted_jobs.add(job_id)
+                    else:
+                        lease = uuid.uuid4().hex
+                        self._conn.execute(
+                            "UPDATE job_items SET status='running', attempts=attempts+1, lease_until=?, lease_owner=?, updated=?"
+                            " WHERE job_id=? AND idx=?",
+                            (now + self.lease_seconds, lease, now, job_id, idx)
+                        )
+                        self._conn.execute(
+                            "UPDATE jobs SET status='running', updated=? WHERE id=? AND status='queued'", (now, job_id)
+                        )
+                        opt = self._conn.execute("SELECT options FROM jobs WHERE id=?", (job_id,)).fetchone()
+                        claimed = {"job_id": job_id, "idx": idx, "source": source, "content": content, "attempt": attempts + 1,
+                                   "lease": lease, "options": json.loads(opt[0]) if opt and opt[0] else {}}
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+
+        for job_id in exhausted_jobs:
+            if self._refresh_job_status(job_id):
+                with self._lock:
+                    self._completed.append(job_id)
+        return claimed
+
+    def drain_completed(self) -> List[str]:
+        """取出 claim 过程中顺带结束的 Job id (只返回一次)"""
+        with self._lock:
+            done, self._completed = self._completed, []
+        return done
+
+    def renew(self, job_id: str, idx: int, lease: str) -> bool:
+        """续约：长时间处理的子项定期调用，防止被其他 Worker 抢走；返回 False 表示租约已被别人接手"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE job_items SET lease_until=?, updated=?"
+                " WHERE job_id=? AND idx=? AND status='running' AND lease_owner=?",
+                (now + self.lease_seconds, now, job_id, idx, lease)
+            )
+            return cur.rowcount > 0
+
+    def finish(self, job_id: str, idx: int, lease: str, result: Dict[str, Any]) -> bool:
+        """记录子项结果；返回 True 表示整个 Job 刚刚全部完成 (用于触发回调)。租约已不属于自己时不写入"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE job_items SET status='done', result=?, content=NULL, lease_until=0, updated=?"
+                " WHERE job_id=? AND idx=? AND status='running' AND lease_owner=?",
+                (json.dumps(result, ensure_ascii=False), now, job_id, idx, lease)
+            )
+            if cur.rowcount == 0:
+                return False
+        return self._refresh_job_status(job_id)
+
+    def set_callback_status(self, job_id: str, status: str):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET callback_status=?, updated=? WHERE id=?", (status, time.time(), job_id))
+
+    # ---------------- 查询 ----------------
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT id, status, total, callback_url, callback_status, created, updated FROM jobs WHERE id=?",
+                (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            items = self._conn.execute(
+                "SELECT idx, source, status, result, attempts FROM job_items WHERE job_id=? ORDER BY idx", (job_id,)
+            ).fetchall()
+
+        results, finished, success = [], 0, 0
+        for idx, source, status, result, attempts in items:
+            data = json.loads(result) if result else None
+            if status == "done":
+                finished += 1
+                if data and data.get("status") == "success":
+                    success += 1
+            results.append({"index": idx, "source": source, "status": status, "attempts": attempts, "result": data})
+
+        return {
+            "job_id": job[0],
+            "status": job[1],
+            "total": job[2],
+            "finished": finished,
+            "success": success,
+            "callback_url": job[3],
+            "callback_status": job[4],
+            "created": job[5],
+            "updated": job[6],
+            "items": results,
+        }
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM job_items WHERE status != 'done'").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------------- 内部实现 ----------------
+
+    def _refresh_job_status(self, job_id: str) -> bool:
+        """所有子项完成则把 Job 置为 done；只有真正发生状态切换的那次调用返回 True"""
+        now = time.time()
+        with self._lock:
+            left = self._conn.execute(
+                "SELECT COUNT(*) FROM job_items WHERE job_id=? AND status != 'done'", (job_id,)
+            ).fetchone()[0]
+            if left:
+                return False
+            cur = self._conn.execute(
+                "UPDATE jobs SET status='done', updated=? WHERE id=? AND status != 'done'", (now, job_id)
+            )
+            return cur.rowcount > 0
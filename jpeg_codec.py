@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : jpeg_codec.py
+@Description: 可插拔的 JPEG 编解码后端 (libjpeg-turbo / OpenCV / Pillow)
+@Logic      :
+    1. 三个后端接口一致：decode(data, scale) -> BGR，encode(bgr, quality) -> bytes
+       - turbojpeg: PyTurboJPEG (可选依赖，未安装自动跳过)，SIMD 加速，支持 DCT 域 1/2、1/4、1/8 缩放解码
+       - cv2      : cv2.imdecode，缩放解码走 IMREAD_REDUCED_COLOR_2/4/8
+       - pil      : Image.draft() 缩放解码 (Pillow-SIMD 环境下同样走 SIMD)
+    2. decode_for_max_side: 只需要缩略图时，先读 JPEG 头拿尺寸，选最大的缩放倍数
+       (解码结果长边仍 >= max_side)，缩略图不再为全分辨率解码买单。
+    3. 默认后端 auto：有 turbojpeg 用 turbojpeg，否则 cv2；可用 set_default_codec 切换。
+    4. EXIF 方向：cv2.imdecode 会自动按 Orientation 转正，turbojpeg / pil 不会。
+       用户上传的原图 (手机照片) 走 decode_source()，后端没转正的在这里补一次 transpose，
+       返回像素与原 Orientation 值；矫正图 / 生成图 / 缩略图没有 EXIF，照常走 decode()。
+"""
+
+import io
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+SCALES = (8, 4, 2)
+_CV2_REDUCED = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def is_jpeg(data: bytes) -> bool:
+    return data[:2] == b"\xff\xd8"
+
+
+def exif_orientation(data: bytes) -> int:
+    """读 EXIF Orientation (1~8)，没有或读不到返回 1；只解析文件头"""
+    if not is_jpeg(data):
+        return 1
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            value = int(img.getexif().get(0x0112, 1))
+            return value if 1 <= value <= 8 else 1
+    except Exception:
+        return 1
+
+
+def apply_orientation(bgr: np.ndarray, orientation: int) -> np.ndarray:
+    """按 EXIF Orientation 把原始像素转正 (与 PIL ImageOps.exif_transpose 一致)"""
+    if orientation == 2:
+        return cv2.flip(bgr, 1)
+    if orientation == 3:
+        return cv2.rotate(bgr, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(bgr, 0)
+    if orientation == 5:
+        return cv2.transpose(bgr)
+    if orientation == 6:
+        return cv2.rotate(bgr, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.rotate(cv2.transpose(bgr), cv2.ROTATE_180)
+    if orientation == 8:
+        return cv2.rotate(bgr, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return bgr
+
+
+def pick_scale(size: Tuple[int, int], max_side: int) -> int:
+    """缩放解码后长边仍 >= max_side 的最大倍数 (1 表示不缩放)"""
+    long_side = max(size)
+    for s in SCALES:
+        if long_side // s >= max_side:
+            return s
+    return 1
+
+
+class JpegCodec:
+    """后端基类：默认实现即 OpenCV"""
+
+    name = "cv2"
+    applies_exif = True   # cv2.imdecode 自带 EXIF 转正
+
+    def decode(self, data: bytes, scale: int = 1) -> Optional[np.ndarray]:
+        flag = _CV2_REDUCED.get(scale, cv2.IMREAD_COLOR) if is_jpeg(data) else cv2.IMREAD_COLOR
+        return cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+
+    def encode(self, bgr: np.ndarray, quality: int = 95) -> bytes:
+        ok, buf = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        if not ok:
+            raise ValueError("JPEG 编码失败")
+        return buf.tobytes()
+
+    def decode_source(self, data: bytes, scale: int = 1) -> Tuple[Optional[np.ndarray], int]:
+        """
+        用户原图解码：保证按 EXIF Orientation 转正，返回 (BGR, Orientation 原值)。
+        Orientation != 1 说明像素已经按 EXIF 旋转过 (process_image 据此跳过方向预检测)
+        """
+        orientation = exif_orientation(data)
+        bgr = self.decode(data, scale)
+        if bgr is not None and orientation != 1 and not self.applies_exif:
+            bgr = apply_orientation(bgr, orientation)
+        return bgr, orientation
+
+    def size(self, data: bytes) -> Optional[Tuple[int, int]]:
+        """只读文件头拿 (宽, 高)，不解码像素"""
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                return img.size
+        except Exception:
+            return None
+
+    def decode_for_max_side(self, data: bytes, max_side: int) -> Tuple[Optional[np.ndarray], int]:
+        """缩略图专用解码，返回 (BGR, 实际缩放倍数)；非 JPEG 只能全尺寸解码"""
+        scale = 1
+        if is_jpeg(data):
+            size = self.size(data)
+            if size:
+                scale = pick_scale(size, max_side)
+        return self.decode(data, scale), scale
+
+
+class PillowCodec(JpegCodec):
+    name = "pil"
+    applies_exif = False
+
+    def decode(self, data: bytes, scale: int = 1) -> Optional[np.ndarray]:
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                if scale > 1 and img.format == "JPEG":
+                    w, h = img.size
+                    img.draft("RGB", (w // scale, h // scale))
+                return cv2.cvtColor(np.asarray(img.convert("RGB")), cv2.COLOR_RGB2BGR)
+        except Exception:
+            return None
+
+    def encode(self, bgr: np.ndarray, quality: int = 95) -> bytes:
+        buff = io.BytesIO()
+        Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)).save(buff, format="JPEG", quality=int(quality))
+        return buff.getvalue()
+
+
+class TurboJpegCodec(JpegCodec):
+    name = "turbojpeg"
+    applies_exif = False
+
+    def __init__(self):
+        from turbojpeg import TurboJPEG, TJPF_BGR
+        self._tj = TurboJPEG()
+        self._bgr = TJPF_BGR
+
+    def decode(self, data: bytes, scale: int = 1) -> Optional[np.ndarray]:
+        if not is_jpeg(data):
+            # PNG 等格式 turbojpeg 不支持，交给 OpenCV
+            return super().decode(data, 1)
+        try:
+            factor = (1, scale) if scale > 1 else None
+            return self._tj.decode(data, pixel_format=self._bgr, scaling_factor=factor)
+        except Exception:
+            return None
+
+    def encode(self, bgr: np.ndarray, quality: int = 95) -> bytes:
+        return self._tj.encode(bgr, quality=int(quality), pixel_format=self._bgr)
+
+    def size(self, data: bytes) -> Optional[Tuple[int, int]]:
+        try:
+            width, height, _, _ = self._tj.decode_header(data)
+            return width, height
+        except Exception:
+            return super().size(data)
+
+
+def available_codecs() -> Dict[str, JpegCodec]:
+    """当前环境可用的全部后端"""
+    codecs: Dict[str, JpegCodec] = {}
+    try:
+        codecs["turbojpeg"] = TurboJpegCodec()
+    except Exception:
+        pass
+    codecs["cv2"] = JpegCodec()
+    codecs["pil"] = PillowCodec()
+    return codecs
+
+
+_default: Optional[JpegCodec] = None
+
+
+def get_codec(name: str = "auto") -> JpegCodec:
+    """按名字取后端；auto = turbojpeg 优先，不可用时回退 cv2"""
+    codecs = available_codecs()
+    if name == "auto":
+        return codecs.get("turbojpeg") or codecs["cv2"]
+    if name not in codecs:
+        raise ValueError(f"JPEG 后端不可用: {name}. 可用: {list(codecs)}")
+    return codecs[name]
+
+
+def set_default_codec(name: str = "auto") -> JpegCodec:
+    global _default
+    _default = get_codec(name)
+    return _default
+
+
+def default_codec() -> JpegCodec:
+    global _default
+    if _default is None:
+        _default = get_codec("auto")
+    return _default
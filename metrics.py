@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : metrics.py
+@Description: 分阶段计时与 Prometheus 指标 (无第三方依赖，直接输出文本格式)
+@Logic      :
+    1. 指标 (进程内累计，GET /metrics 以 Prometheus text format 0.0.4 输出)：
+       - restore_stage_seconds{stage, strategy}        各阶段耗时直方图 (GPU矫正 / 视觉 / 生图 / 下载 / 裁切 / 上传 ...)
+       - restore_pool_queue_wait_seconds{pool, priority} 各资源池的排队时间
+       - restore_pool_service_seconds{pool, outcome}   拿到名额后的占用时间 (服务时间)
+       - restore_bytes_total{direction}                上传 / 下载 / 内联发给 Ark 的字节数
+       - restore_requests_total{status}、restore_strategy_total{strategy, status}
+       - restore_codec_ops_total{kind}、restore_codec_seconds_total{kind}   编解码次数与耗时 (来自 CodecStats)
+       - 资源池当前 limit / inflight / queued 等瞬时值由 add_collector 注册的回调在抓取时读取
+       慢批次看 stage 与 pool 两组直方图即可区分是 GPU、Ark 还是上传瓶颈。
+    2. Trace：单张图一次处理的全部 span (相对开始时间的 start_ms / dur_ms)，保存在 contextvar 里，
+       子任务自动继承；record() 同时写直方图和当前 Trace，没有 Trace 时只写直方图。
+    3. 多 worker 部署时每个进程各自计数，按进程抓取 (或在前面加聚合)。
+"""
+
+import json
+import time
+import threading
+import contextvars
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180, 300)
+
+_Labels = Tuple[str, ...]
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"): return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[_Labels, float] = {}
+
+    def inc(self, value: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_num(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [各桶计数..., sum, count]
+        self._series: Dict[_Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+                    break
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, s in sorted(self._series.items()):
+                acc = 0.0
+                for i, b in enumerate(self.buckets):
+                    acc += s[i]
+                    le = 'le="%s"' % _fmt_num(b)
+                    lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {_fmt_num(acc)}")
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, inf)} {_fmt_num(s[-1])}")
+                lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_num(round(s[-2], 6))}")
+                lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {_fmt_num(s[-1])}")
+        return lines
+
+
+# 采集回调：抓取时返回 [(name, help, type, [(labels dict, value), ...]), ...]
+Collector = Callable[[], Iterable[Tuple[str, str, str, Iterable[Tuple[Dict[str, Any], float]]]]]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, fn: Collector):
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            lines.extend(m.render())
+        for fn in self._collectors:
+            try:
+                families = list(fn())
+            except Exception as e:
+                lines.append(f"# collector error: {_escape(e)}")
+                continue
+            for name, help, typ, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {typ}")
+                for labels, value in samples:
+                    if value is None: continue
+                    lines.append(f"{name}{_fmt_labels(list(labels), list(labels.values()))} {_fmt_num(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("restore_stage_seconds", "各处理阶段耗时 (秒)", ("stage", "strategy"))
+POOL_WAIT_SECONDS = registry.histogram("restore_pool_queue_wait_seconds", "资源池排队时间 (秒)", ("pool", "priority"))
+POOL_SERVICE_SECONDS = registry.histogram("restore_pool_service_seconds", "拿到名额后的占用时间 (秒)", ("pool", "outcome"))
+BYTES_TOTAL = registry.counter("restore_bytes_total", "传输字节数 (upload / download / ark_inline / ark_url)", ("direction",))
+REQUESTS_TOTAL = registry.counter("restore_requests_total", "单图处理次数 (按结果)", ("status",))
+STRATEGY_TOTAL = registry.counter("restore_strategy_total", "策略执行次数 (按结果)", ("strategy", "status"))
+GEN_INPUT_TOTAL = registry.counter("restore_gen_input_total", "生图主图输入方式 (url / inline) 与结果 (ok / fallback / failed)",
+                                   ("input", "outcome"))
+GEN_API_SECONDS = registry.histogram("restore_gen_api_seconds", "生图调用耗时 (秒，按主图输入方式 / 输入档位)", ("input", "profile"))
+CODEC_OPS_TOTAL = registry.counter("restore_codec_ops_total", "编解码操作次数", ("kind",))
+CODEC_SECONDS_TOTAL = registry.counter("restore_codec_seconds_total", "编解码累计耗时 (秒)", ("kind",))
+
+
+# ---------------- Trace ----------------
+
+class Trace:
+    """单张图一次处理的 span 记录"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.t0 = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self.attrs: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, start: float, end: float, strategy: str = "", **attrs):
+        span = {"stage": stage, "start_ms": round((start - self.t0) * 1000, 1), "dur_ms": round((end - start) * 1000, 1)}
+        if strategy: span["strategy"] = strategy
+        if attrs: span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {"name": self.name, "started_at": self.t0, "total_ms": round((time.time() - self.t0) * 1000, 1),
+                **self.attrs, "spans": spans}
+
+    def dump(self, path: str):
+        """追加一行 JSON 到 trace 日志 (JSONL)"""
+        line = json.dumps(self.to_dict(), ensure_ascii=False)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+# 请求头 X-Trace: 1 时由中间件置位，返回体附带 trace
+trace_requested: contextvars.ContextVar[bool] = contextvars.ContextVar("trace_requested", default=False)
+
+
+def record(stage: str, start: float, end: float, strategy: str = "", **attrs):
+    """记录一个阶段 (time.time() 时间戳)：写直方图，并附加到当前 Trace"""
+    STAGE_SECONDS.observe(max(0.0, end - start), stage=stage, strategy=strategy)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, start, end, strategy, **attrs)
+
+
+def add_bytes(direction: str, n: int):
+    if n: BYTES_TOTAL.inc(n, direction=direction)
+
+
+def add_codec(snapshot: Dict[str, Dict[str, float]]):
+    """合并一个请求的 CodecStats.snapshot()"""
+    for kind, n in snapshot["counts"].items():
+        if n:
+            CODEC_OPS_TOTAL.inc(n, kind=kind)
+            CODEC_SECONDS_TOTAL.inc(snapshot["cost_s"][kind], kind=kind)
+
+
+def observe_pool(pool: str, priority: str, queue_wait: float, service: Optional[float], error: Any = None):
+    """PriorityPool 的 observer：每次 slot 释放时调用"""
+    POOL_WAIT_SECONDS.observe(queue_wait, pool=pool, priority=priority)
+    if service is not None:
+        POOL_SERVICE_SECONDS.observe(service, pool=pool, outcome="error" if error is not None else "ok")
+    trace = current_trace.get()
+    if trace is not None and queue_wait >= 0.001:
+        end = time.time() - (service or 0.0)
+        trace.add(f"wait:{pool}", end - queue_wait, end, priority=priority)
+
+
+def pool_collector(pools: Dict[str, Any]) -> Collector:
+    """把各资源池的 stats() 转成 gauge"""
+    def _collect():
+        stats = {name: p.stats() for name, p in pools.items()}
+        for field in ("limit", "inflight", "queued"):
+            yield (f"restore_pool_{field}", f"资源池当前 {field}", "gauge",
+                   [({"pool": name}, s.get(field)) for name, s in stats.items()])
+    return _collect
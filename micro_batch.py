@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : micro_batch.py
+@Description: 微批推理队列 (线程安全)
+@Logic      :
+    1. 调用方 submit(单张图) -> 立即拿到 Future，不直接碰模型。
+    2. 后台单线程攒批：拿到第一张后最多再等 max_wait_ms，或攒满 max_batch_size 就发车。
+    3. 一次 batch_fn(列表) 推理，按顺序把结果分发回每个 Future。
+    4. 整批失败时逐张重试，避免一张坏图拖垮同批的其他请求。
+"""
+
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Tuple
+
+
+class MicroBatcher:
+    """把并发的单张推理请求合并成批量推理"""
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0, name: str = "batch"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+        # 统计信息 (平均批大小 = items / batches)
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_seen = 0
+
+    def submit(self, item: Any) -> Future:
+        """提交单个输入，返回结果 Future"""
+        self._ensure_worker()
+        fut: Future = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def run(self, item: Any) -> Any:
+        """同步便捷接口：提交并阻塞等待结果"""
+        return self.submit(item).result()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            avg = self._items / self._batches if self._batches else 0.0
+            return {
+                "name": self.name,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(avg, 2),
+                "max_batch_size_seen": self._max_seen,
+                "pending": self._queue.qsize(),
+            }
+
+    # ---------------- 内部实现 ----------------
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name=f"MicroBatcher-{self.name}", daemon=True)
+                self._worker.start()
+
+    def _collect(self) -> List[Tuple[Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # 窗口已过，但已排队的请求顺手带上，不再额外等待
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            # 调用方可能已取消 (例如上层超时)，跳过这些输入
+            batch = [(item, fut) for item, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._max_seen = max(self._max_seen, len(batch))
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"批量结果数量不匹配: {len(results)} != {len(items)}")
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # 整批失败 -> 逐张兜底
+                for item, fut in batch:
+                    try:
+                        fut.set_result(self.batch_fn([item])[0])
+                    except Exception as single_err:
+                        fut.set_exception(single_err)
+                continue
+
+            for (_, fut), res in zip(batch, results):
+                fut.set_result(res)
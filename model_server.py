@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : model_server.py
+@Description: 独立模型服务进程 (多进程部署模式)
+@Logic      :
+    1. 每个副本 (replica) 是一个独立进程，各自加载一份 ResNet/Paddle 模型，
+       监听一个本地 socket (unix:/path 或 tcp:host:port)。
+    2. 图片解码、模型推理、红框裁切、视觉缩略图 / 签名 / 背景检测、JPEG 编码全部在副本进程里完成，
+       API 进程 (单 worker) 只做异步 I/O 和 Base64，不再和 CPU 密集操作抢 GIL。
+    3. 副本内部每个连接一个线程，多个连接的请求会被 ImageProcessor 的微批队列自动合批。
+    4. 协议 (双向相同)：4 字节大端头长度 + JSON 头 + 二进制负载 (长度见头部 size 字段)。
+@Usage      :
+    # 启动 2 个副本 (可选 --gpus 0,1 把副本分配到不同显卡)
+    python model_server.py --replicas 2 --addr "unix:/tmp/restore_model_{i}.sock"
+    # API 进程 (单 worker) 通过环境变量指向副本
+    RESTORE_MODEL_SERVERS="unix:/tmp/restore_model_0.sock,unix:/tmp/restore_model_1.sock" python api.py
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import socket
+import asyncio
+import argparse
+import logging
+import socketserver
+import multiprocessing
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("SmartCard")
+
+_HEADER = struct.Struct(">I")
+
+
+# ================= 1. 协议 =================
+
+def _parse_addr(addr: str) -> Tuple[str, object]:
+    """'unix:/tmp/x.sock' -> ('unix', path)；'tcp:127.0.0.1:6101' -> ('tcp', (host, port))"""
+    kind, _, rest = addr.partition(":")
+    if kind == "unix":
+        return "unix", rest
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    raise ValueError(f"不支持的地址格式: {addr}")
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(min(n - len(buf), 1 << 20))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _send_frame(sock: socket.socket, header: dict, payload: bytes = b""):
+    header = dict(header, size=len(payload))
+    head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(head)) + head)
+    if payload:
+        sock.sendall(payload)
+
+
+def _recv_frame(sock: socket.socket) -> Tuple[dict, bytes]:
+    head_len = _HEADER.unpack(_recv_exact(sock, _HEADER.size))[0]
+    header = json.loads(_recv_exact(sock, head_len).decode("utf-8"))
+    payload = _recv_exact(sock, header.get("size", 0)) if header.get("size") else b""
+    return header, payload
+
+
+# ================= 2. 服务端 (副本进程) =================
+
+class _ModelOps:
+    """副本进程内的实际处理逻辑，各操作输入图片字节、输出结果字节"""
+
+    def __init__(self):
+        # 只在副本进程里加载模型
+        from image_correct_optimized import processor
+        self.processor = processor
+
+    def correct(self, data: bytes, meta: dict) -> bytes:
+        """原图矫正 (同 api.py 的 _gpu_task)"""
+        from image_handle import ImageHandle
+        img = ImageHandle.from_source(data)
+        if img.bgr is None:
+            raise ValueError("图片解码失败")
+        pil_res = self.processor.process_image(
+            image_input=img.bgr, model_name="resnet", proxy_detect=meta.get("proxy_detect"),
+            exif_rotated=img.exif_orientation != 1
+        )
+        return ImageHandle.from_pil(pil_res, img.stats).data
+
+    def crop(self, data: bytes, meta: dict) -> bytes:
+        """生成图兜底裁切 (同 api.py 的 _gpu_crop_task)；没检测到名片返回空负载，调用方回退原生成图"""
+        from image_handle import ImageHandle
+        img = ImageHandle.from_bytes(data)
+        if img.bgr is None:
+            raise ValueError("图片解码失败")
+        warped = self.processor.crop_generated(img.bgr, proxy_detect=meta.get("proxy_detect"))
+        return ImageHandle.from_bgr(warped, img.stats).data if warped is not None else b""
+
+    def red_frame(self, data: bytes, meta: dict) -> bytes:
+        """红框裁切；没找到红框返回空负载"""
+        from red_frame import try_red_frame_crop_memory
+        return try_red_frame_crop_memory(data) or b""
+
+    def thumb(self, data: bytes, meta: dict) -> Tuple[bytes, dict]:
+        """
+        矫正图 -> 视觉用缩略图 + 视觉缓存签名 + 本地背景检测 (同 api.py 的 _make_low_res_b64)
+        返回 (缩略图 JPEG, {"phash", "color", "bg"})，API 进程不再为矫正图做全尺寸解码
+        """
+        from image_handle import ImageHandle
+        from cache_store import vision_signature, VISION_THUMB_SIDE
+        from bg_detect import analyze_background
+        img = ImageHandle.from_bytes(data)
+        if img.bgr is None:
+            raise ValueError("图片解码失败")
+        thumb = img.thumbnail(VISION_THUMB_SIDE, quality=int(meta.get("quality", 85)))
+        phash, color = vision_signature(thumb.bgr)
+        bg = analyze_background(thumb.bgr) if meta.get("bg") else None
+        if bg is not None:
+            bg = {k: v.item() if hasattr(v, "item") else v for k, v in bg.items()}   # numpy 标量转成可 JSON 序列化的类型
+        return thumb.data, {"phash": phash, "color": color, "bg": bg}
+
+    def orientation_stats(self, data: bytes, meta: dict) -> bytes:
+        """本副本的方向预检测统计 (JSON)"""
+        return json.dumps(self.processor.get_orientation_stats(), ensure_ascii=False).encode("utf-8")
+
+    def dispatch(self, op: str, data: bytes, meta: dict) -> bytes:
+        fn = {"correct": self.correct, "crop": self.crop, "red_frame": self.red_frame, "thumb": self.thumb,
+              "orientation_stats": self.orientation_stats}.get(op)
+        if fn is None:
+            raise ValueError(f"未知操作: {op}")
+        return fn(data, meta)
+
+
+def _make_handler(ops: _ModelOps):
+    class _Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            # 长连接：一个连接上串行处理多次请求，直到客户端断开
+            while True:
+                try:
+                    header, payload = _recv_frame(self.request)
+                except (ConnectionError, OSError, struct.error):
+                    return
+                t0 = time.time()
+                try:
+                    out = ops.dispatch(header.get("op", ""), payload, header.get("meta") or {})
+                    # 操作可以额外返回一份 JSON 元数据 (bytes, dict)，放在响应头的 meta 字段
+                    out, meta = out if isinstance(out, tuple) else (out, None)
+                    _send_frame(self.request, {"ok": True, "cost": round(time.time() - t0, 4), "meta": meta}, out)
+                except Exception as e:
+                    try:
+                        _send_frame(self.request, {"ok": False, "error": str(e)})
+                    except OSError:
+                        return
+    return _Handler
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(addr: str, gpu: Optional[str] = None):
+    """启动单个副本 (阻塞)"""
+    if gpu is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = gpu
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s", datefmt="%H:%M:%S"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    # 与 API 进程同一个环境变量选 JPEG 后端
+    from jpeg_codec import set_default_codec
+    codec = set_default_codec(os.environ.get("RESTORE_JPEG_CODEC", "auto"))
+    logger.info(f"⏳ [模型服务] 正在加载模型: {addr} (GPU={gpu}, JPEG 后端: {codec.name})")
+    ops = _ModelOps()
+
+    kind, target = _parse_addr(addr)
+    if kind == "unix":
+        if os.path.exists(target):
+            os.unlink(target)
+        server = _ThreadingUnixServer(target, _make_handler(ops))
+    else:
+        server = _ThreadingTCPServer(target, _make_handler(ops))
+    logger.info(f"🔥 [模型服务] 就绪: {addr}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if kind == "unix" and os.path.exists(target):
+            os.unlink(target)
+
+
+# ================= 3. 客户端 (API 进程，asyncio) =================
+
+class _Replica:
+    def __init__(self, addr: str, max_conns: int):
+        self.addr = addr
+        self.kind, self.target = _parse_addr(addr)
+        self.inflight = 0
+        self.failures = 0
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._slots = asyncio.Semaphore(max_conns)
+
+    async def _connect(self):
+        if self.kind == "unix":
+            return await asyncio.open_unix_connection(self.target, limit=1 << 24)
+        host, port = self.target
+        return await asyncio.open_connection(host, port, limit=1 << 24)
+
+    async def call(self, op: str, payload: bytes, meta: dict, timeout: float) -> Tuple[dict, bytes]:
+        async with self._slots:
+            self.inflight += 1
+            writer = None
+            try:
+                conn = self._idle.pop() if self._idle else await self._connect()
+                reader, writer = conn
+                head = json.dumps({"op": op, "meta": meta, "size": len(payload)}, ensure_ascii=False).encode("utf-8")
+                writer.write(_HEADER.pack(len(head)) + head)
+                if payload:
+                    writer.write(payload)
+                await writer.drain()
+
+                async def _read():
+                    head_len = _HEADER.unpack(await reader.readexactly(_HEADER.size))[0]
+                    header = json.loads((await reader.readexactly(head_len)).decode("utf-8"))
+                    body = await reader.readexactly(header["size"]) if header.get("size") else b""
+                    return header, body
+
+                header, body = await asyncio.wait_for(_read(), timeout)
+                self._idle.append(conn)
+                self.failures = 0
+                return header, body
+            except BaseException as e:
+                # 协议状态未知，连接直接丢弃
+                if writer is not None:
+                    writer.close()
+                if not isinstance(e, asyncio.CancelledError):
+                    self.failures += 1
+                raise
+            finally:
+                self.inflight -= 1
+
+
+class RemoteModelPool:
+    """把矫正 / 裁切请求分发到多个模型副本 (最少在途优先)"""
+
+    def __init__(self, addrs: List[str], conns_per_replica: int = 8, timeout: float = 120.0):
+        if not addrs:
+            raise ValueError("至少需要一个模型服务地址")
+        self.replicas = [_Replica(a, conns_per_replica) for a in addrs]
+        self.timeout = timeout
+
+    def _pick(self) -> _Replica:
+        # 连续失败的副本降权，避免把请求持续打到挂掉的进程上
+        return min(self.replicas, key=lambda r: (r.failures > 3, r.inflight))
+
+    async def call(self, op: str, payload: bytes, meta: Optional[dict] = None) -> bytes:
+        return (await self.call_with_meta(op, payload, meta))[0]
+
+    async def call_with_meta(self, op: str, payload: bytes, meta: Optional[dict] = None) -> Tuple[bytes, dict]:
+        """同 call，额外返回响应头里的元数据"""
+        replica = self._pick()
+        header, body = await replica.call(op, payload, meta or {}, self.timeout)
+        if not header.get("ok"):
+            raise RuntimeError(f"[{replica.addr}] {op} 失败: {header.get('error')}")
+        return body, header.get("meta") or {}
+
+    async def correct(self, img_bytes: bytes, proxy_detect: Optional[bool] = None) -> bytes:
+        return await self.call("correct", img_bytes, {"proxy_detect": proxy_detect})
+
+    async def crop(self, img_bytes: bytes, proxy_detect: Optional[bool] = None) -> bytes:
+        return await self.call("crop", img_bytes, {"proxy_detect": proxy_detect})
+
+    async def red_frame(self, img_bytes: bytes) -> Optional[bytes]:
+        return await self.call("red_frame", img_bytes) or None
+
+    async def thumb(self, img_bytes: bytes, bg: bool = True, quality: int = 85) -> Tuple[bytes, dict]:
+        return await self.call_with_meta("thumb", img_bytes, {"bg": bg, "quality": quality})
+
+    async def orientation_stats(self) -> Dict[str, Dict]:
+        """逐个副本取方向预检测统计 (统计在副本进程里)"""
+        out = {}
+        for r in self.replicas:
+            try:
+                header, body = await r.call("orientation_stats", b"", {}, min(self.timeout, 5.0))
+                out[r.addr] = json.loads(body) if header.get("ok") else {"error": header.get("error")}
+            except Exception as e:
+                out[r.addr] = {"error": str(e)}
+        return out
+
+    def stats(self) -> List[Dict]:
+        return [{"addr": r.addr, "inflight": r.inflight, "failures": r.failures} for r in self.replicas]
+
+
+# ================= 4. 启动入口 =================
+
+def main():
+    parser = argparse.ArgumentParser(description="名片矫正模型服务 (多副本)")
+    parser.add_argument("--replicas", type=int, default=1, help="副本进程数，每个副本加载一份模型")
+    parser.add_argument("--addr", default="unix:/tmp/restore_model_{i}.sock",
+                        help="监听地址模板，{i} 替换为副本序号；也可用 tcp:127.0.0.1:{port}")
+    parser.add_argument("--base-port", type=int, default=6101, help="tcp 模式下 {port} = base-port + i")
+    parser.add_argument("--gpus", default="", help="逗号分隔的显卡号，副本按顺序轮流分配，如 0,1")
+    args = parser.parse_args()
+
+    gpus = [g for g in args.gpus.split(",") if g.strip()]
+    addrs = [args.addr.format(i=i, port=args.base_port + i) for i in range(args.replicas)]
+
+    if args.replicas == 1:
+        serve(addrs[0], gpus[0] if gpus else None)
+        return
+
+    # spawn：副本各自独立初始化 CUDA，不继承父进程状态
+    ctx = multiprocessing.get_context("spawn")
+    procs = []
+    for i, addr in enumerate(addrs):
+        p = ctx.Process(target=serve, args=(addr, gpus[i % len(gpus)] if gpus else None), name=f"model-{i}")
+        p.start()
+        procs.append(p)
+    print(f"🚀 已启动 {len(procs)} 个模型副本: {', '.join(addrs)}")
+    print(f"   API 侧设置: RESTORE_MODEL_SERVERS=\"{','.join(addrs)}\"")
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
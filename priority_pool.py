@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : priority_pool.py
+@Description: 带优先级与租户公平性的 asyncio 资源池 (替代 FIFO 的 asyncio.Semaphore)
+@Logic      :
+    1. 每个请求带一个 RequestTag (租户 tenant + 优先级 priority)，保存在 contextvar 里，
+       由 HTTP 中间件从请求头 X-Tenant-Id / X-Priority 设置，后续 create_task 出的子任务自动继承。
+    2. 名额不够时排队，出队顺序：
+       - 先按等级：urgent (交互请求的第一个策略) > interactive > bulk
+       - 同一等级内按租户做加权公平排队 (WFQ)：每个租户维护虚拟完成时间 finish = max(V, 上次 finish) + 1/weight，
+         取 finish 最小者。一个租户一次提交 200 张图，也只能和其他租户轮流拿名额，而不是霸占整个队列。
+    3. PriorityPool 是固定容量的池 (GPU / 上传 / 工作流)；adaptive_limiter.AdaptiveLimiter 继承它，
+       在同样的排队规则上再按延迟与错误率自动调整容量 (Ark 生图 / 视觉)。
+    4. reserve > 0 时为 interactive / urgent 预留名额：bulk 最多占 limit - reserve 个，
+       批量任务把池子占满时交互请求仍能立刻进场，不用排在一整批 bulk 后面等它们跑完。
+    5. 设置 pool.observer 后，每次 slot 释放都会上报 (池名, 优先级, 排队时间, 占用时间, 异常)，供 metrics 统计。
+"""
+
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PRIORITIES = ("urgent", "interactive", "bulk")
+_RANK = {p: i for i, p in enumerate(PRIORITIES)}
+
+
+@dataclass
+class RequestTag:
+    tenant: str = "default"
+    priority: str = "interactive"   # interactive / bulk (urgent 只在单次 acquire 时临时提升)
+    explicit: bool = False           # 优先级是否由请求头显式指定 (显式指定的不再被接口自动降级)
+
+
+current_tag: contextvars.ContextVar[RequestTag] = contextvars.ContextVar("request_tag", default=RequestTag())
+
+
+def get_tag() -> RequestTag:
+    return current_tag.get()
+
+
+def set_tag(tenant: str = "default", priority: str = "interactive", explicit: bool = False) -> contextvars.Token:
+    if priority not in ("interactive", "bulk"):
+        priority = "interactive"
+    return current_tag.set(RequestTag(tenant=tenant or "default", priority=priority, explicit=explicit))
+
+
+class _WfqQueue:
+    """等级优先 + 等级内按租户加权公平的等待队列"""
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = weights or {}
+        self._heap: List[Tuple[int, float, int, asyncio.Future, str]] = []
+        self._seq = itertools.count()
+        self._vtime = [0.0] * len(PRIORITIES)
+        self._finish: Dict[Tuple[int, str], float] = {}
+        self._live = [0] * len(PRIORITIES)
+
+    def push(self, fut: asyncio.Future, tag: RequestTag, urgent: bool = False):
+        rank = _RANK["urgent"] if urgent else _RANK.get(tag.priority, _RANK["interactive"])
+        key = (rank, tag.tenant)
+        finish = max(self._vtime[rank], self._finish.get(key, 0.0)) + 1.0 / max(self.weights.get(tag.tenant, 1.0), 1e-6)
+        self._finish[key] = finish
+        heapq.heappush(self._heap, (rank, finish, next(self._seq), fut, tag.tenant))
+        self._live[rank] += 1
+
+    def head_rank(self) -> Optional[int]:
+        """队首等待者的等级 (顺带丢掉已取消的)，队列为空返回 None"""
+        while self._heap and self._heap[0][3].done():
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop(self) -> Optional[asyncio.Future]:
+        while self._heap:
+            rank, finish, _, fut, tenant = heapq.heappop(self._heap)
+            if fut.done():
+                continue   # 已取消的等待者 (remove 时已扣过计数)
+            self._live[rank] -= 1
+            self._vtime[rank] = finish
+            if len(self._finish) > 1000:
+                # 清理已经落后于虚拟时钟的租户记录，防止字典无限增长
+                self._finish = {k: v for k, v in self._finish.items() if v > self._vtime[k[0]]}
+            return fut
+        return None
+
+    def remove(self, fut: asyncio.Future, rank: int):
+        self._live[rank] -= 1
+
+    def __len__(self) -> int:
+        return sum(self._live)
+
+    def by_priority(self) -> Dict[str, int]:
+        return {p: self._live[i] for i, p in enumerate(PRIORITIES)}
+
+
+class _Slot:
+    """一次占用的名额，退出时把结果 (延迟 / 异常) 上报给池"""
+
+    def __init__(self, pool: "PriorityPool", urgent: bool = False):
+        self.pool = pool
+        self.urgent = urgent
+        self.error: Any = None
+        self.t_start = 0.0
+        self.queue_wait = 0.0
+        self.priority = ""
+
+    def fail(self, exc: Any = True):
+        self.error = exc
+
+    async def __aenter__(self) -> "_Slot":
+        t0 = time.monotonic()
+        self.priority = "urgent" if self.urgent else get_tag().priority
+        await self.pool.acquire(self.urgent)
+        self.t_start = time.monotonic()
+        self.queue_wait = self.t_start - t0
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        latency = time.monotonic() - self.t_start
+        error = exc if exc is not None else self.error
+        if exc_type is asyncio.CancelledError:
+            self.pool.release(None, None)
+        else:
+            self.pool.release(error, latency)
+        if self.pool.observer is not None:
+            try: self.pool.observer(self.pool.name, self.priority, self.queue_wait,
+                                    None if exc_type is asyncio.CancelledError else latency, error)
+            except Exception: pass
+        return False
+
+
+class PriorityPool:
+    """固定容量的优先级资源池；用法同 Semaphore: `async with pool:` 或 `async with pool.slot(urgent=True):`
+    (需要排队/占用时间统计时用 slot()，`async with pool:` 不上报 observer)"""
+
+    def __init__(self, name: str, limit: int, weights: Optional[Dict[str, float]] = None, reserve: int = 0):
+        self.name = name
+        self.limit = float(max(1, int(limit)))
+        self.reserve = max(0, int(reserve))   # 只给 interactive / urgent 用的名额
+        self.inflight = 0
+        self._queue = _WfqQueue(weights)
+        self.granted = {p: 0 for p in PRIORITIES}
+        self.observer: Optional[Callable[[str, str, float, Optional[float], Any], None]] = None
+
+    # ---------------- 准入 ----------------
+
+    def slot(self, urgent: bool = False) -> _Slot:
+        return _Slot(self, urgent)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    async def acquire(self, urgent: bool = False):
+        tag = get_tag()
+        rank = _RANK["urgent"] if urgent else _RANK.get(tag.priority, _RANK["interactive"])
+        if self.inflight < self._capacity(rank) and not len(self._queue):
+            self.inflight += 1
+            self.granted[PRIORITIES[rank]] += 1
+            return
+        fut = asyncio.get_event_loop().create_future()
+        self._queue.push(fut, tag, urgent)
+        # 队里可能只剩被预留名额挡住的 bulk，交互请求不必等下一次 release
+        self._wake()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已经分到名额但等待方被取消：把名额还回去
+                self.inflight -= 1
+                self._wake()
+            else:
+                fut.cancel()
+                self._queue.remove(fut, rank)
+            raise
+        self.granted[PRIORITIES[rank]] += 1
+
+    def release(self, error: Any = None, latency: Optional[float] = None):
+        self.inflight -= 1
+        if latency is not None:
+            self._observe(error, latency)
+        self._wake()
+
+    def _observe(self, error: Any, latency: float):
+        """子类 (自适应限流) 在这里根据调用结果调整 limit"""
+
+    def _capacity(self, rank: int) -> int:
+        """该等级可用的名额上限：bulk 让出 reserve 个 (至少保留 1 个，避免 bulk 饿死)"""
+        if rank == _RANK["bulk"] and self.reserve:
+            return max(1, int(self.limit) - self.reserve)
+        return int(self.limit)
+
+    def _wake(self):
+        # 队列按等级排序：队首是 bulk 时后面也全是 bulk，队首进不去就都进不去
+        while True:
+            rank = self._queue.head_rank()
+            if rank is None or self.inflight >= self._capacity(rank):
+                break
+            fut = self._queue.pop()
+            self.inflight += 1
+            fut.set_result(True)
+
+    # ---------------- 运行时查看 ----------------
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "limit": int(self.limit),
+            "reserve": self.reserve,
+            "inflight": self.inflight,
+            "queued": len(self._queue),
+            "queued_by_priority": self._queue.by_priority(),
+            "granted_by_priority": dict(self.granted),
+        }
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : red_frame.py
+@Description: 红框裁切 (内容锁定 / 参考图策略的生成图自带红色边框)
+@Logic      : 独立成模块，API 进程和模型服务进程 (model_server.py) 都可以直接调用
+    1. 粗定位：整图缩到长边 DETECT_MAX_SIDE 再做 HSV 红色掩膜 -> 最大外轮廓 -> 四边形。
+       像素量约为原图的 1/14，掩膜/形态学/找轮廓的开销随之下降。
+    2. 四边形提取：凸包细粒度近似后取最长的 4 条边求交，圆角、缺角产生的短边直接丢掉；
+       不满足时退回逐步放大 epsilon 重试，再不行用最小外接矩形 (凸包填充率足够高时)，不再直接放弃走 ResNet 兜底。
+    3. 精修：回到全分辨率，沿每条边取一组垂直采样线 (cv2.remap 双线性插值，只取窄带内的几千个像素)，
+       每条线上取最外侧的红色点，拟合直线 (cv2.fitLine)，相邻两边求交得到亚像素角点。
+       切角/圆角处被两端裁掉不参与拟合，所以求交得到的是两条边延长线的交点；偏离粗定位太远时保留粗定位角点。
+    4. red_frame_crop 直接吃 BGR 数组 (配合 ImageHandle 复用已解码的像素)，
+       try_red_frame_crop_memory 是 bytes 进 bytes 出的包装。对比数据见 bench/bench_red_frame.py。
+"""
+
+from typing import Optional
+
+import cv2
+import numpy as np
+
+OUT_SIZE = (3000, 1824)
+DETECT_MAX_SIDE = 800
+MIN_AREA_FULL_RES = 2000        # 全分辨率下红框最小面积 (与旧实现一致)，粗定位时按缩放比例换算
+_LOWER_1, _UPPER_1 = np.array([0, 70, 50]), np.array([10, 255, 255])
+_LOWER_2, _UPPER_2 = np.array([170, 70, 50]), np.array([180, 255, 255])
+_CLOSE_KERNEL = np.ones((3, 3), np.uint8)
+
+def order_points(pts):
+    rect = np.zeros((4, 2), dtype="float32")
+    s = pts.sum(axis=1)
+    rect[0], rect[2] = pts[np.argmin(s)], pts[np.argmax(s)]
+    diff = np.diff(pts, axis=1)
+    rect[1], rect[3] = pts[np.argmin(diff)], pts[np.argmax(diff)]
+    return rect
+
+def _red_mask(img_cv: np.ndarray) -> np.ndarray:
+    hsv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2HSV)
+    return cv2.bitwise_or(cv2.inRange(hsv, _LOWER_1, _UPPER_1), cv2.inRange(hsv, _LOWER_2, _UPPER_2))
+
+def _intersect(l1: np.ndarray, l2: np.ndarray) -> Optional[np.ndarray]:
+    (vx1, vy1, x1, y1), (vx2, vy2, x2, y2) = l1, l2
+    den = vx1 * vy2 - vy1 * vx2
+    if abs(den) < 1e-6: return None
+    s = ((x2 - x1) * vy2 - (y2 - y1) * vx2) / den
+    return np.array([x1 + s * vx1, y1 + s * vy1], dtype=np.float32)
+
+def _quad_from_long_edges(hull: np.ndarray) -> Optional[np.ndarray]:
+    """
+    凸包细粒度多边形近似后取最长的 4 条边，相邻边求交得到角点。
+    圆角/切角只产生短边，被丢掉后求交得到的是两条边延长线的交点；
+    直接放大 epsilon 会把切角端点之一当成角点，让相邻那条边斜着穿过切角 (偏差可达切角长度)。
+    """
+    peri = cv2.arcLength(hull, True)
+    poly = cv2.approxPolyDP(hull, 0.005 * peri, True).reshape(-1, 2).astype(np.float32)
+    if len(poly) < 4: return None
+    nxt = np.roll(poly, -1, axis=0)
+    lens = np.hypot(*(nxt - poly).T)
+    idx = np.sort(np.argsort(lens)[-4:])                        # 保持环绕顺序
+    if lens[idx].sum() < 0.6 * peri: return None                # 4 条长边撑不起周长：不是四边形
+    dirs = (nxt[idx] - poly[idx]) / lens[idx, None]
+    # 相邻两条长边必须明显不平行，否则是一条边被拆成了两段
+    if np.min(np.abs(np.sum(dirs * np.roll(dirs, -1, axis=0), axis=1))) > 0.5: return None
+    lines = [np.array([*dirs[k], *poly[i]], dtype=np.float32) for k, i in enumerate(idx)]
+    pts = [_intersect(lines[k - 1], lines[k]) for k in range(4)]
+    if any(p is None for p in pts): return None
+    return np.array(pts, dtype=np.float32)
+
+def _quad_from_contour(c: np.ndarray) -> Optional[np.ndarray]:
+    """轮廓 -> 4 个角点 (未排序)；处理圆角/缺角产生的 5~6 点近似"""
+    hull = cv2.convexHull(c)
+    quad = _quad_from_long_edges(hull)
+    if quad is not None:
+        return quad
+    peri = cv2.arcLength(c, True)
+    for eps in (0.02, 0.03, 0.04, 0.06, 0.08):
+        approx = cv2.approxPolyDP(hull, eps * peri, True)
+        if len(approx) == 4:
+            return approx.reshape(4, 2).astype(np.float32)
+        if len(approx) < 4:
+            break
+    # 仍不是四边形：凸包基本是个矩形 (填充率高) 才用最小外接矩形，透视误差交给精修
+    rect = cv2.minAreaRect(hull)
+    rect_area = rect[1][0] * rect[1][1]
+    if rect_area > 0 and cv2.contourArea(hull) / rect_area > 0.9:
+        return cv2.boxPoints(rect).astype(np.float32)
+    return None
+
+def _fit_side(img_cv: np.ndarray, p0: np.ndarray, p1: np.ndarray, normal: np.ndarray, band: float,
+              bins: int = 96, step: float = 0.5) -> Optional[np.ndarray]:
+    """
+    沿 p0-p1 边取 bins 条垂直于边的采样线 (长 2*band，步长 step 像素，cv2.remap 一次取完)，
+    每条线上取最外侧的红色采样点作为边缘点，拟合直线，返回 (vx, vy, x0, y0)
+    """
+    d = p1 - p0
+    length = float(np.hypot(d[0], d[1]))
+    if length < 1: return None
+    t = d / length
+    # 两端各去掉 8% (角点附近属于另一条边，圆角/切角也在这里)
+    along = np.linspace(0.08, 0.92, bins, dtype=np.float32) * length
+    offs = np.arange(-band, band + step, step, dtype=np.float32)
+    pts = p0 + along[:, None, None] * t + offs[None, :, None] * normal          # (bins, steps, 2)
+    strip = cv2.remap(img_cv, pts[..., 0], pts[..., 1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    red = _red_mask(strip) > 0                                                 # (bins, steps)
+    has = red.any(axis=1)
+    if has.sum() < bins // 4: return None
+    # 最外侧 = 偏移最大的红色采样点 (法向朝外)
+    last = red.shape[1] - 1 - np.argmax(red[:, ::-1], axis=1)
+    edge = pts[np.nonzero(has)[0], last[has]]
+    return cv2.fitLine(edge.astype(np.float32), cv2.DIST_HUBER, 0, 0.01, 0.01).reshape(4)
+
+def _refine_corners(img_cv: np.ndarray, corners: np.ndarray, band: float) -> np.ndarray:
+    """全分辨率窄带直线拟合 + 相邻边求交；某个角点失败或偏离过大时保留粗定位结果"""
+    center = corners.mean(axis=0)
+    lines = []
+    for i in range(4):
+        p0, p1 = corners[i], corners[(i + 1) % 4]
+        d = p1 - p0
+        n = np.array([-d[1], d[0]], dtype=np.float32) / max(float(np.hypot(d[0], d[1])), 1e-6)
+        if np.dot((p0 + p1) / 2 - center, n) < 0: n = -n   # 法向朝外
+        lines.append(_fit_side(img_cv, p0, p1, n, band))
+    refined = corners.copy()
+    # 切角/圆角时粗定位角点可能落在切角端点上，允许精修移动到短边长度的 10%
+    limit = max(band, 0.1 * min(float(np.hypot(*(corners[i] - corners[i - 1]))) for i in range(4)))
+    for i in range(4):
+        # 角点 i 是边 (i-1) 与边 i 的交点
+        la, lb = lines[i - 1], lines[i]
+        if la is None or lb is None: continue
+        p = _intersect(la, lb)
+        if p is not None and np.hypot(*(p - corners[i])) <= limit:
+            refined[i] = p
+    return refined
+
+def detect_red_frame(img_cv: np.ndarray, max_side: int = DETECT_MAX_SIDE, refine: bool = True) -> Optional[np.ndarray]:
+    """返回红框外边缘的 4 个角点 (全分辨率坐标，顺序: 左上/右上/右下/左下)；找不到返回 None"""
+    h, w = img_cv.shape[:2]
+    scale = min(1.0, max_side / float(max(h, w)))
+    # INTER_LINEAR 而不是 INTER_AREA：3000 -> 800 的非整数倍 AREA 缩放本身就要 ~25ms，和全图算掩膜差不多
+    small = cv2.resize(img_cv, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_LINEAR) if scale < 1 else img_cv
+
+    # 不做开运算：缩图后 10px 左右的红框只剩 2~3px，开运算会把框打断；零星噪点由面积阈值和取最大轮廓过滤。
+    # 反过来膨胀 1px，把细框在缩放 / JPEG 后出现的断口接上 (外扩的 1 个缩图像素由精修消掉)
+    mask = cv2.dilate(_red_mask(small), _CLOSE_KERNEL)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours: return None
+    c = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(c) < MIN_AREA_FULL_RES * scale * scale: return None
+
+    quad = _quad_from_contour(c)
+    if quad is None: return None
+    corners = order_points(quad / scale)
+    if refine:
+        # 窄带半宽覆盖粗定位误差 (约 1~2 个缩图像素) 并留足余量；采样线很短，加宽几乎不增加开销
+        corners = _refine_corners(img_cv, corners, band=max(16.0, 6.0 / scale))
+    return corners
+
+def red_frame_crop(img_cv: np.ndarray) -> Optional[np.ndarray]:
+    """在 BGR 图上找红框并透视到 3000x1824，返回 BGR 数组；找不到返回 None"""
+    try:
+        pts = detect_red_frame(img_cv)
+        if pts is None: return None
+        w, h = OUT_SIZE
+        dst = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype="float32")
+        M = cv2.getPerspectiveTransform(pts, dst)
+        return cv2.warpPerspective(img_cv, M, OUT_SIZE)
+    except: pass
+    return None
+
+def try_red_frame_crop_memory(img_bytes: bytes) -> Optional[bytes]:
+    try:
+        img_cv = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img_cv is None: return None
+        warped = red_frame_crop(img_cv)
+        if warped is None: return None
+        ok, buf = cv2.imencode(".jpg", warped, [cv2.IMWRITE_JPEG_QUALITY, 95]) # 保持高清
+        return buf.tobytes() if ok else None
+    except: pass
+    return None
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : ref_assets.py
+@Description: 参考图资产管理 (内容哈希 + 预编码 + 链接保活)
+@Logic      :
+    1. 本地参考图只在文件变化 (mtime / size) 时重新读盘，读入后算 sha256 并预先编码好 data URI，
+       生图时直接取内存里的字符串，不再每张卡片、每个策略都读盘 + Base64 一遍 (app.py)。
+    2. 保活：对当前 URL 发 HEAD (不支持 HEAD 时退回 Range: bytes=0-0 的 GET)，只有链接失效
+       或本地内容变了 (与该 URL 上传时的哈希不一致) 才重新上传；网络异常视为"未知"，保留原链接不折腾。
+    3. URL 列表是不可变 tuple，刷新时整体替换 (原子切换)；请求里取一次 urls 用到底，不会读到刷新一半的列表。
+    4. 某张图链接失效且重传失败时，generation_inputs() 用它的预编码 data URI 顶上，生图请求不会缺参考图。
+    5. 状态 (URL + 上传时的内容哈希) 写入 state_path，重启后沿用，不必每次启动都重传；初始配置的 URL 变了则作废。
+@Usage      :
+    assets = RefAssetManager(paths, seed_urls, uploader=uploader, client=http_client, state_path="ref_state.json")
+    await assets.ensure_local(); await assets.refresh()
+    imgs = assets.generation_inputs() + [main_img]
+"""
+
+import os
+import json
+import base64
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+logger = logging.getLogger("SmartCard")
+
+
+@dataclass(frozen=True)
+class RefAsset:
+    path: str
+    sha256: str
+    size: int
+    mtime: float
+    mime: str
+    data_uri: str
+
+    @classmethod
+    def read(cls, path: str) -> "RefAsset":
+        st = os.stat(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        mime = mimetypes.guess_type(path)[0] or "image/png"
+        return cls(path=path, sha256=hashlib.sha256(data).hexdigest(), size=st.st_size, mtime=st.st_mtime,
+                   mime=mime, data_uri=f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}")
+
+    def changed_on_disk(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False          # 文件被删：沿用内存里的内容
+        return st.st_mtime != self.mtime or st.st_size != self.size
+
+
+class RefAssetManager:
+    """参考图资产：预编码负载 + URL 保活 (只重传失效的链接)"""
+
+    def __init__(self, paths: Sequence[str], seed_urls: Sequence[str] = (), uploader=None,
+                 client: Optional[httpx.AsyncClient] = None, state_path: str = "", check_timeout: float = 10.0):
+        self.paths = list(paths)
+        self.uploader = uploader
+        self.client = client
+        self.state_path = state_path
+        self.check_timeout = check_timeout
+
+        self._load_lock = threading.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self._assets: List[Optional[RefAsset]] = [None] * len(self.paths)
+
+        urls = list(seed_urls)[:len(self.paths)]
+        urls += [""] * (len(self.paths) - len(urls))
+        # 每个 URL 上传时对应的内容哈希；"" = 未知 (初始配置的链接)，首次确认存活时记为当前内容
+        hashes = [""] * len(self.paths)
+        self._seed = list(urls)
+        state = self._read_state()
+        # 初始配置换过时状态文件作废
+        if state and state.get("seed") == self._seed and len(state.get("urls", [])) == len(self.paths):
+            urls, hashes = list(state["urls"]), list(state.get("hashes") or hashes)
+        self._urls: Tuple[str, ...] = tuple(urls)
+        self._url_hashes: Tuple[str, ...] = tuple(hashes)
+        self._stats = {"checks": 0, "alive": 0, "dead": 0, "unknown": 0, "uploads": 0, "upload_failed": 0, "reloads": 0}
+
+    # ---------------- 本地内容 ----------------
+
+    def load(self) -> int:
+        """读入新增 / 变化的本地文件，返回本次重新读盘的张数 (没变化时只做几次 stat)"""
+        with self._load_lock:
+            n = 0
+            for i, path in enumerate(self.paths):
+                asset = self._assets[i]
+                if asset is not None and not asset.changed_on_disk():
+                    continue
+                if not os.path.exists(path):
+                    continue
+                try:
+                    self._assets[i] = RefAsset.read(path)
+                    n += 1
+                except Exception as e:
+                    logger.error(f"❌ [参考图] 读取失败 {path}: {e}")
+            self._stats["reloads"] += n
+            return n
+
+    def data_uris(self) -> List[str]:
+        """预编码好的 data URI (缺失的文件跳过)"""
+        self.load()
+        return [a.data_uri for a in self._assets if a is not None]
+
+    async def ensure_local(self):
+        """本地缺文件时从当前 URL 下载一份备份 (首次部署)"""
+        for i, path in enumerate(self.paths):
+            url = self._urls[i]
+            if os.path.exists(path) or not url or self.client is None:
+                continue
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            logger.info(f"📥 [参考图] 本地缺少第 {i+1} 张，正在从 URL 下载备份...")
+            try:
+                resp = await self.client.get(url, timeout=60)
+                resp.raise_for_status()
+                tmp = f"{path}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(resp.content)
+                os.replace(tmp, path)
+                logger.info(f"✅ [参考图] 第 {i+1} 张下载成功: {path}")
+            except Exception as e:
+                logger.error(f"❌ [参考图] 第 {i+1} 张下载失败! URL: {url} ({e})")
+        self.load()
+
+    # ---------------- URL 保活 ----------------
+
+    @property
+    def urls(self) -> Tuple[str, ...]:
+        """当前 URL 列表 (不可变，刷新时整体替换)"""
+        return self._urls
+
+    def generation_inputs(self) -> List[str]:
+        """生图用的参考图输入：URL 可用时传 URL (零带宽)，否则用预编码的 data URI 兜底"""
+        urls = self._urls
+        out = []
+        for i, url in enumerate(urls):
+            if url:
+                out.append(url)
+            else:
+                asset = self._assets[i]
+                if asset is not None: out.append(asset.data_uri)
+        return out
+
+    async def is_alive(self, url: str) -> Optional[bool]:
+        """HEAD 探活：True 存活 / False 失效 / None 网络异常 (无法判断)"""
+        if not url or self.client is None:
+            return False if not url else None
+        try:
+            resp = await self.client.head(url, timeout=self.check_timeout, follow_redirects=True)
+            if resp.status_code in (405, 501):
+                # 部分 CDN 不支持 HEAD：只取 1 个字节
+                resp = await self.client.get(url, timeout=self.check_timeout, follow_redirects=True,
+                                             headers={"Range": "bytes=0-0"})
+            return resp.status_code < 400
+        except Exception as e:
+            logger.warning(f"⚠️ [参考图] 探活异常 {url}: {e}")
+            return None
+
+    async def refresh(self) -> Dict[str, int]:
+        """检查全部链接，只重传失效 / 内容已变化的参考图，最后原子替换 URL 列表"""
+        async with self._refresh_lock:
+            await asyncio.get_event_loop().run_in_executor(None, self.load)
+            urls, hashes = list(self._urls), list(self._url_hashes)
+            alive = await asyncio.gather(*(self.is_alive(u) for u in urls))
+            summary = {"kept": 0, "uploaded": 0, "failed": 0}
+
+            for i, ok in enumerate(alive):
+                asset = self._assets[i]
+                self._stats["checks"] += 1
+                self._stats["alive" if ok else ("unknown" if ok is None else "dead")] += 1
+                if ok and asset is not None and not hashes[i]:
+                    hashes[i] = asset.sha256
+                stale = asset is not None and hashes[i] and hashes[i] != asset.sha256
+                if ok is not False and not stale:
+                    summary["kept"] += 1
+                    continue
+                reason = "链接失效" if ok is False else "本地内容已变化"
+                if asset is None or self.uploader is None:
+                    logger.error(f"❌ [参考图] 第 {i+1} 张{reason}，但没有本地文件 / 上传器，无法重传")
+                    summary["failed"] += 1
+                    continue
+                data = base64.b64decode(asset.data_uri.split(",", 1)[1])   # 与 sha256 对应的那份内容
+                new_url = await self.uploader.upload(data, filename=os.path.basename(asset.path), content_type=asset.mime)
+                if new_url:
+                    urls[i], hashes[i] = new_url, asset.sha256
+                    summary["uploaded"] += 1
+                    self._stats["uploads"] += 1
+                    logger.info(f"✅ [参考图] 第 {i+1} 张{reason}，已重传 -> {new_url}")
+                else:
+                    # 重传失败：失效的链接清空 (生图时改用 data URI)，内容变化的先保留旧链接
+                    if ok is False: urls[i] = ""
+                    summary["failed"] += 1
+                    self._stats["upload_failed"] += 1
+                    logger.error(f"❌ [参考图] 第 {i+1} 张{reason}，重传失败")
+
+            self._urls, self._url_hashes = tuple(urls), tuple(hashes)
+            self._write_state()
+            return summary
+
+    # ---------------- 状态 ----------------
+
+    def describe(self) -> dict:
+        return {
+            "assets": [{"path": p, "url": u, "sha256": a.sha256[:16] if a else "", "loaded": a is not None}
+                       for p, u, a in zip(self.paths, self._urls, self._assets)],
+            "stats": dict(self._stats),
+        }
+
+    def _read_state(self) -> Optional[dict]:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ [参考图] 状态文件读取失败，使用初始配置: {e}")
+            return None
+
+    def _write_state(self):
+        if not self.state_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp = f"{self.state_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"seed": self._seed, "urls": list(self._urls), "hashes": list(self._url_hashes)}, f, indent=2)
+            os.replace(tmp, self.state_path)
+        except Exception as e:
+            logger.warning(f"⚠️ [参考图] 状态文件写入失败: {e}")
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : strategies.py
+@Description: 生成策略注册表 (声明式配置，可从 JSON 文件加载)
+@Logic      :
+    1. 每个策略 = Prompt (CONFIG 中的 PROMPT_xxx 或直接给文本) + 是否带参考图 + 是否依赖视觉分析 + 裁切方式。
+       - need_vision=True 的策略，Prompt 末尾追加 "视觉参考：<布局分析结果>"
+       - crop: red_frame (红框检测，找不到红框回退 ResNet) / resnet / none (不裁切，直接用生成图)
+    2. 默认策略见 DEFAULT_STRATEGIES；配置文件 (strategies.json) 存在时以文件为准，改策略不用改代码。
+    3. 请求可以指定只跑哪些策略 (按名称或代码标识)，不指定则跑 default=True 的全部策略。
+    4. fingerprint() 给出所选策略的指纹，参与结果缓存 key，不同策略组合的结果互不串用。
+    5. 输入档位 (input_profiles)：生图前主图缩到多大、用什么格式 / 质量编码，按名称在策略里引用 (input_profile)。
+       默认 full = 原图 3000x1824 JPEG q95 (与改造前一致)；各档位的体积 / 耗时 / 保真度对比见 bench/eval_input_profiles.py。
+"""
+
+import os
+import json
+import hashlib
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+CROP_METHODS = ("red_frame", "resnet", "none")
+INPUT_FORMATS = ("jpeg", "webp")
+
+
+@dataclass
+class InputProfile:
+    name: str
+    max_side: int = 0                  # 长边上限，0 = 不缩放 (原图尺寸)
+    quality: int = 95                  # JPEG / WebP 质量
+    format: str = "jpeg"               # jpeg / webp
+
+    def __post_init__(self):
+        if self.format not in INPUT_FORMATS:
+            raise ValueError(f"输入档位 {self.name} 的格式不支持: {self.format}. 支持: {INPUT_FORMATS}")
+        if not 1 <= self.quality <= 100:
+            raise ValueError(f"输入档位 {self.name} 的质量超出范围 (1~100): {self.quality}")
+
+    @property
+    def is_original(self) -> bool:
+        """与矫正图本身一致 (不缩放、JPEG q95)，可以直接复用已编码的数据 / 已上传的 URL"""
+        return self.max_side == 0 and self.format == "jpeg" and self.quality == 95
+
+
+DEFAULT_INPUT_PROFILE = "full"
+DEFAULT_INPUT_PROFILES = {
+    "full": InputProfile("full"),
+    "2k_q90": InputProfile("2k_q90", max_side=2048, quality=90),
+    "1536_q85": InputProfile("1536_q85", max_side=1536, quality=85),
+    "2k_webp": InputProfile("2k_webp", max_side=2048, quality=85, format="webp"),
+}
+
+
+@dataclass
+class StrategySpec:
+    name: str                          # 展示名 (返回体 strategy_name)
+    key: str                           # 代码标识，如 V7_STATIC
+    prompt_key: str = ""               # CONFIG 中的 Prompt 属性名，如 PROMPT_WithoutVison
+    prompt: str = ""                   # 直接给 Prompt 文本 (优先于 prompt_key)
+    need_vision: bool = False          # 是否依赖视觉布局分析
+    use_ref: bool = False              # 是否带参考图
+    crop: str = "resnet"               # red_frame / resnet / none
+    deadline_s: Optional[float] = None # 单策略截止时间，None 时用 CONFIG.STRATEGY_DEADLINE_S
+    input_profile: str = DEFAULT_INPUT_PROFILE  # 生图主图输入档位 (input_profiles 中的名称)
+    default: bool = True               # 请求未指定策略时是否运行
+
+    def __post_init__(self):
+        if self.crop not in CROP_METHODS:
+            raise ValueError(f"策略 {self.name} 的裁切方式不支持: {self.crop}. 支持: {CROP_METHODS}")
+        if not (self.prompt or self.prompt_key):
+            raise ValueError(f"策略 {self.name} 缺少 prompt / prompt_key")
+
+
+DEFAULT_STRATEGIES = [
+    StrategySpec("静态生成", "V7_STATIC", prompt_key="PROMPT_WithoutVison", crop="resnet"),
+    StrategySpec("视觉分析", "V7_DYNAMIC", prompt_key="PROMPT_Gen_BASE", need_vision=True, crop="resnet"),
+    StrategySpec("内容锁定", "V8_STRICT", prompt_key="PROMPT_V2STRICT", use_ref=True, crop="red_frame"),
+    StrategySpec("参考图", "V8_SIMPLE", prompt_key="PROMPT_V2SIMPLE", use_ref=True, crop="red_frame"),
+]
+
+
+class StrategyRegistry:
+    def __init__(self, specs: Sequence[StrategySpec], profiles: Optional[Dict[str, InputProfile]] = None):
+        if not specs:
+            raise ValueError("策略注册表为空")
+        self.specs: List[StrategySpec] = list(specs)
+        self.profiles: Dict[str, InputProfile] = dict(DEFAULT_INPUT_PROFILES)
+        self.profiles.update(profiles or {})
+        missing = [f"{s.name}: {s.input_profile}" for s in self.specs if s.input_profile not in self.profiles]
+        if missing:
+            raise ValueError(f"策略引用了未定义的输入档位: {missing}. 可选: {list(self.profiles)}")
+        self._index: Dict[str, StrategySpec] = {}
+        for s in self.specs:
+            for alias in (s.name, s.key.lower()):
+                if alias in self._index:
+                    raise ValueError(f"策略名重复: {alias}")
+                self._index[alias] = s
+
+    # ---------------- 加载 ----------------
+
+    @classmethod
+    def from_file(cls, path: str) -> "StrategyRegistry":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        items = data["strategies"] if isinstance(data, dict) else data
+        profiles = data.get("input_profiles", {}) if isinstance(data, dict) else {}
+        return cls([StrategySpec(**item) for item in items],
+                   {name: InputProfile(name=name, **p) for name, p in profiles.items()})
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "StrategyRegistry":
+        """配置文件存在则加载文件，否则用内置默认策略"""
+        if path and os.path.exists(path):
+            return cls.from_file(path)
+        return cls(DEFAULT_STRATEGIES)
+
+    # ---------------- 选择 ----------------
+
+    def get(self, name: str) -> Optional[StrategySpec]:
+        return self._index.get(name) or self._index.get(name.strip().lower())
+
+    def select(self, names: Union[str, Sequence[str], None] = None) -> List[StrategySpec]:
+        """
+        按名称 / 代码标识选择策略 (保持注册表顺序、去重)；未指定时返回默认策略；有未知名称抛 ValueError
+        names 也可以是表单里的逗号分隔字符串 ("a,b")
+        """
+        if isinstance(names, str):
+            names = [n.strip() for n in names.split(",") if n.strip()]
+        if not names:
+            return [s for s in self.specs if s.default]
+        unknown = [n for n in names if self.get(n) is None]
+        if unknown:
+            raise ValueError(f"未知策略: {unknown}. 可选: {[s.name for s in self.specs]}")
+        wanted = {self.get(n).key for n in names}
+        return [s for s in self.specs if s.key in wanted]
+
+    def profile(self, spec: StrategySpec) -> InputProfile:
+        return self.profiles[spec.input_profile]
+
+    # ---------------- Prompt / 指纹 ----------------
+
+    @staticmethod
+    def build_prompt(spec: StrategySpec, prompts: Any, layout_desc: str = "") -> str:
+        """prompts: 提供 PROMPT_xxx 属性的对象 (各服务的 CONFIG 类)"""
+        prompt = spec.prompt or getattr(prompts, spec.prompt_key)
+        if spec.need_vision:
+            prompt = f"{prompt}\n视觉参考：{layout_desc}"
+        return prompt
+
+    @staticmethod
+    def fingerprint(specs: Sequence[StrategySpec], prompts: Any = None,
+                    profiles: Optional[Dict[str, InputProfile]] = None) -> str:
+        payload = []
+        for s in specs:
+            item = asdict(s)
+            # 截止时间 / 默认开关不影响生成结果，不参与指纹
+            item.pop("deadline_s", None); item.pop("default", None)
+            # 默认档位不参与指纹 (已有缓存不失效)；其他档位按实际参数计入，改档位参数也会换 key
+            name = item.pop("input_profile", DEFAULT_INPUT_PROFILE)
+            profile = profiles.get(name) if profiles else None
+            if name != DEFAULT_INPUT_PROFILE or (profile is not None and profile != DEFAULT_INPUT_PROFILES[name]):
+                item["input_profile"] = asdict(profile) if profile is not None else name
+            if prompts is not None and not s.prompt:
+                item["prompt"] = getattr(prompts, s.prompt_key, "")
+            payload.append(item)
+        return hashlib.sha1(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [asdict(s) for s in self.specs]
+
+    def describe_profiles(self) -> List[Dict[str, Any]]:
+        return [asdict(p) for p in self.profiles.values()]
@@ -4,8 +4,23 @@ from PIL import Image
 from paddleocr import DocImgOrientationClassification
 from sqlalchemy.dialects.mssql import IMAGE
 
+from micro_batch import MicroBatcher
+
 model = DocImgOrientationClassification(model_name="PP-LCNet_x1_0_doc_ori")
 
+# 批量分类的上限与攒批等待时间 (毫秒)
+ORIENTATION_BATCH_SIZE = 16
+ORIENTATION_BATCH_WAIT_MS = 5
+
+
+def _to_cv2(img):
+    """PIL.Image / numpy 统一转成 OpenCV (BGR) 格式"""
+    if isinstance(img, Image.Image):
+        return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+    elif isinstance(img, np.ndarray):
+        return img
+    raise TypeError(f"不支持的图像输入类型: {type(img)}")
+
 
 def text_orientation(img):
     """
@@ -50,6 +65,50 @@ def text_orientation(img):
 
     return label_name, scores
 
+def text_orientation_batch(imgs):
+    """
+    批量文字方向分类：一次 predict 处理多张图。
+
+    参数:
+        imgs (list): PIL.Image 或 OpenCV 图像组成的列表。
+
+    返回:
+        list: 与输入顺序一致的 [(标签名列表, 置信度列表), ...]
+    """
+    if not imgs:
+        return []
+    imgs_cv2 = [_to_cv2(img) for img in imgs]
+
+    output = list(model.predict(imgs_cv2, batch_size=len(imgs_cv2)))
+    if len(output) != len(imgs_cv2):
+        raise RuntimeError(f"方向分类结果数量不匹配: {len(output)} != {len(imgs_cv2)}")
+
+    return [(res["label_names"], res["scores"]) for res in output]
+
+
+# 异步合批队列：ImageProcessor 的并发线程各自提交单张，由后台线程合成一个 predict
+_orientation_batcher = MicroBatcher(
+    text_orientation_batch,
+    max_batch_size=ORIENTATION_BATCH_SIZE,
+    max_wait_ms=ORIENTATION_BATCH_WAIT_MS,
+    name="DocOrientation"
+)
+
+
+def text_orientation_async(img):
+    """提交单张图到合批队列，返回 concurrent.futures.Future，结果同 text_orientation"""
+    return _orientation_batcher.submit(_to_cv2(img))
+
+
+def text_orientation_queued(img):
+    """阻塞版：经合批队列分类，适合在线程池中调用"""
+    return text_orientation_async(img).result()
+
+
+def orientation_batch_stats():
+    return _orientation_batcher.stats()
+
+
 def text_orientation_all(img):
     """
     对图像进行文字方向分类，自动处理 PIL.Image 和 OpenCV 图像输入。
@@ -1,45 +1,35 @@
 # -*- coding: utf-8 -*-
 import os
 import json
-import base64
-import requests
+
+from uploader import CdnUploader
 
 # === 配置 (直接复用您项目中的配置) ===
 UPLOAD_API_URL = "https://tt.36588.com.cn/mcard/common/commonUpload"
 IMG_URL_PREFIX = "https://tt.36588.com.cn/mcard/assets/resource/imgs/normal/"
 REF_DIR = "ref_imgs"  # 您的参考图文件夹名称
 FILES = ["1.png", "2.png", "3.png", "4.png"] # 文件名
+# 上传方式: multipart / binary / base64 (二进制方式失败会自动回退 base64)
+UPLOAD_TRANSPORT = os.environ.get("RESTORE_UPLOAD_TRANSPORT", "base64")
+
+uploader = CdnUploader(UPLOAD_API_URL, IMG_URL_PREFIX, UPLOAD_TRANSPORT, timeout=60)
 
 def upload_file(file_path):
-    """读取文件 -> 转Base64 -> 上传 -> 返回URL"""
+    """读取文件 -> 上传 (二进制，必要时回退 Base64) -> 返回URL"""
     if not os.path.exists(file_path):
         print(f"❌ 文件未找到: {file_path}")
         return None
     
     try:
-        # 1. 转 Base64
         with open(file_path, "rb") as f:
-            b64_str = base64.b64encode(f.read()).decode('utf-8')
-        
-        # 2. 构造请求
-        payload = {"base64Str": f"data:image/jpeg;base64,{b64_str}"}
-        headers = {"Content-Type": "application/json"}
+            data = f.read()
         
-        # 3. 发送
         print(f"⬆️ 正在上传 {file_path} ...")
-        resp = requests.post(UPLOAD_API_URL, json=payload, headers=headers, timeout=60)
-        
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get("success"):
-                relative_path = data.get("userData", "")
-                full_url = f"{IMG_URL_PREFIX}{relative_path}"
-                print(f"✅ 上传成功: {full_url}")
-                return full_url
-            else:
-                print(f"❌ 上传接口报错: {data}")
-        else:
-            print(f"❌ HTTP 状态码错误: {resp.status_code}")
+        full_url = uploader.upload_sync(data, filename=os.path.basename(file_path))
+        if full_url:
+            print(f"✅ 上传成功: {full_url}")
+            return full_url
+        print("❌ 上传失败")
             
     except Exception as e:
         print(f"❌ 发生异常: {e}")
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+@File       : uploader.py
+@Description: 图片上传 (CDN) 统一封装
+@Logic      :
+    1. 传输方式 (transport):
+       - multipart: multipart/form-data 直接发送二进制 (httpx 按块流式发送内存中的 bytes，不做 Base64)
+       - binary   : 请求体就是图片原始字节 (Content-Type: image/jpeg)
+       - base64   : 旧接口，JSON {"base64Str": "data:image/jpeg;base64,..."}，体积 +33%
+    2. 首选方式失败时自动回退 base64，保证老接口始终可用。
+    3. 三种方式的响应格式一致：{"success": true, "userData": "相对路径"} -> IMG_URL_PREFIX + 相对路径
+    4. 同时提供 async (api.py) 与同步 (app.py / upload_refs.py) 两套入口，并统计各方式的次数与字节数。
+"""
+
+import base64
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger("SmartCard")
+
+TRANSPORTS = ("multipart", "binary", "base64")
+
+
+class CdnUploader:
+    """CDN 上传器：二进制优先，Base64 JSON 兜底"""
+
+    def __init__(self, api_url: str, url_prefix: str, transport: str = "base64",
+                 binary_url: str = "", field_name: str = "file", timeout: float = 180,
+                 client: Optional[httpx.AsyncClient] = None, executor=None):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"不支持的上传方式: {transport}. 支持: {TRANSPORTS}")
+        self.api_url = api_url
+        self.url_prefix = url_prefix
+        self.transport = transport
+        # 二进制接口地址，未配置时与 base64 接口共用同一个地址
+        self.binary_url = binary_url or api_url
+        self.field_name = field_name
+        self.timeout = timeout
+        self.client = client
+        self.executor = executor
+
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {t: {"ok": 0, "fail": 0, "bytes": 0} for t in TRANSPORTS}
+
+    # ---------------- 公共入口 ----------------
+
+    async def upload(self, data: bytes, filename: str = "image.jpg", content_type: str = "image/jpeg") -> str:
+        """上传并返回完整 URL，失败返回空字符串"""
+        if not data: return ""
+        for transport in self._plan():
+            try:
+                url = await self._upload_async(transport, data, filename, content_type)
+            except Exception as e:
+                logger.error(f"⚠️ Upload Fail [{transport}]: {e}")
+                url = ""
+            self._record(transport, url, data)
+            if url: return url
+        return ""
+
+    def upload_sync(self, data: bytes, filename: str = "image.jpg", content_type: str = "image/jpeg") -> str:
+        """同步版本 (线程池 / 脚本中使用)"""
+        if not data: return ""
+        with httpx.Client(timeout=self.timeout) as client:
+            for transport in self._plan():
+                try:
+                    resp = client.post(self._target(transport), **self._request_kwargs(transport, data, filename, content_type))
+                    url = self._parse(resp)
+                except Exception as e:
+                    logger.error(f"⚠️ Upload Fail [{transport}]: {e}")
+                    url = ""
+                self._record(transport, url, data)
+                if url: return url
+        return ""
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._stats_lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    # ---------------- 内部实现 ----------------
+
+    def _plan(self):
+        return [self.transport] if self.transport == "base64" else [self.transport, "base64"]
+
+    def _target(self, transport: str) -> str:
+        return self.api_url if transport == "base64" else self.binary_url
+
+    @staticmethod
+    def _b64_payload(data: bytes) -> dict:
+        return {"base64Str": f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"}
+
+    def _request_kwargs(self, transport: str, data: bytes, filename: str, content_type: str,
+                        b64_payload: Optional[dict] = None) -> dict:
+        if transport == "multipart":
+            return {"files": {self.field_name: (filename, data, content_type)}}
+        if transport == "binary":
+            return {"content": data, "headers": {"Content-Type": content_type, "X-File-Name": filename}}
+        return {"json": b64_payload or self._b64_payload(data)}
+
+    async def _upload_async(self, transport: str, data: bytes, filename: str, content_type: str) -> str:
+        b64_payload = None
+        if transport == "base64":
+            # Base64 放到线程池里做，不阻塞事件循环
+            b64_payload = await asyncio.get_event_loop().run_in_executor(self.executor, self._b64_payload, data)
+        kwargs = self._request_kwargs(transport, data, filename, content_type, b64_payload)
+        if self.client is not None:
+            resp = await self.client.post(self._target(transport), timeout=self.timeout, **kwargs)
+        else:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                resp = await client.post(self._target(transport), **kwargs)
+        return self._parse(resp)
+
+    def _parse(self, resp: httpx.Response) -> str:
+        if resp.status_code == 200:
+            d = resp.json()
+            if d.get("success"): return f"{self.url_prefix}{d.get('userData', '')}"
+            logger.error(f"⚠️ Upload Failed: {d}")
+        else:
+            logger.error(f"⚠️ Upload HTTP Error: {resp.status_code}")
+        return ""
+
+    def _record(self, transport: str, url: str, data: bytes):
+        # 线上实际发送字节数：base64 比原始字节多约 1/3
+        sent = len(data) * 4 // 3 if transport == "base64" else len(data)
+        with self._stats_lock:
+            item = self._stats[transport]
+            item["ok" if url else "fail"] += 1
+            item["bytes"] += sent